@@ -0,0 +1,157 @@
+# Arrival processes for traffic_simulation.Simulation
+#
+#   Simulation(arrivalMode="uniform")   one random vehicle every vehicleInterval seconds (the original behaviour)
+#   Simulation(arrivalMode="poisson")   Poisson arrivals at 1/vehicleInterval per second, or following
+#                                    arrivalProfile = [[startSecond, vehiclesPerSecond], ...]
+#   Simulation(arrivalMode="counts.csv") or a list of .csv/.parquet files: replay recorded crossings
+#   Simulation(arrivalMode={"type": "trace", "paths": [...], "camera": "cam1", "directionMap": {...}})
+#
+# Trace files hold one crossing per row with a time column ("ts" in epoch seconds, as in
+# the counts store, or "time" in seconds, as in VehicleCounter events), "class" and
+# "direction", plus an optional "camera_id". Each file must be in time order; several
+# files are merged lazily (CSV row by row, Parquet READ_AHEAD rows at a time), so a
+# multi-day trace is never held in memory. Directions must be simulation direction
+# names or be mapped to them with directionMap: the counter's default zones label
+# crossings "line" or "any", and a trace in which no row maps is rejected.
+import csv
+import heapq
+import math
+
+READ_AHEAD = 1024       # rows read from a Parquet trace file at a time
+SKIPPED_BEFORE_ERROR = 1024     # leading rows that may all be skipped before a trace is rejected
+
+# Detector classes (COCO names from the vehicle counter) to simulation vehicle classes
+CLASS_MAP = {'car': 'car', 'bus': 'bus', 'truck': 'truck', 'rickshaw': 'rickshaw', 'bike': 'bike',
+             'motorbike': 'bike', 'motorcycle': 'bike', 'bicycle': 'bike'}
+
+
+def readCsvTrace(path):
+    with open(path, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            yield row
+
+
+def readParquetTrace(path):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("reading Parquet traces needs pyarrow (pip install pyarrow)")
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=READ_AHEAD):
+        yield from batch.to_pylist()
+
+
+def readTrace(path, camera=None):
+    """(time, direction, class) for every row of one trace file, in file order."""
+    rows = readParquetTrace(path) if path.endswith('.parquet') else readCsvTrace(path)
+    for row in rows:
+        if camera is not None and row.get('camera_id') not in (None, camera):
+            continue
+        time = row['ts'] if row.get('ts') not in (None, '') else row['time']
+        yield float(time), row.get('direction'), row.get('class')
+
+
+class TraceArrivals:
+    """Replays recorded crossings; simulated second 0 is the first event (or start)."""
+
+    def __init__(self, paths, directionNumbers, vehicleTypes, camera=None, directionMap=None, start=None):
+        if isinstance(paths, str):
+            paths = paths.split(',')
+        self.events = heapq.merge(*(readTrace(p, camera) for p in paths), key=lambda e: e[0])
+        self.directions = {name: d for d, name in directionNumbers.items()}
+        self.directionMap = directionMap or {}
+        self.types = {name: t for t, name in vehicleTypes.items()}
+        self.start = start
+        self.pending = next(self.events, None)
+        self.skipped = 0        # rows whose direction or class has no simulation equivalent
+        self.replayed = 0
+        self.unmatched = set()  # (direction, class) values of skipped rows, for the error message
+
+    def arrivalsUntil(self, now):
+        while self.pending is not None:
+            time, direction, vehicleClass = self.pending
+            if self.start is None:
+                self.start = time
+            if time - self.start > now:
+                return
+            self.pending = next(self.events, None)
+            d = self.directions.get(self.directionMap.get(direction, direction))
+            t = self.types.get(CLASS_MAP.get(vehicleClass))
+            if d is None or t is None:
+                self.skipped += 1
+                self._checkSkipped(direction, vehicleClass)
+                continue
+            self.replayed += 1
+            yield d, t
+
+    def _checkSkipped(self, direction, vehicleClass):
+        if self.replayed:
+            return
+        self.unmatched.add((direction, vehicleClass))
+        if self.skipped >= SKIPPED_BEFORE_ERROR or self.pending is None:
+            directions = sorted({str(d) for d, _ in self.unmatched})
+            classes = sorted({str(c) for _, c in self.unmatched})
+            raise ValueError(f"None of the first {self.skipped} trace rows map to a simulation direction and "
+                             f"vehicle class (directions {', '.join(directions)}; classes {', '.join(classes)}); "
+                             f"map the directions with directionMap, e.g. {{\"{directions[0]}\": \"right\"}}")
+
+
+class PoissonArrivals:
+    """Poisson arrivals with a piecewise-constant rate; directions follow directionSplit, classes are uniform.
+
+    profile is [[startSecond, vehiclesPerSecond], ...] sorted by start; the last rate holds
+    until the end of the run.
+    """
+
+    def __init__(self, rng, profile, directionSplit, numTypes):
+        self.rng = rng
+        self.profile = sorted(profile)
+        self.directionSplit = directionSplit
+        self.numTypes = numTypes
+        self.nextTime = self._after(0.0)
+
+    def _rateAt(self, t):
+        rate, end = 0.0, math.inf
+        for i, (start, value) in enumerate(self.profile):
+            if start <= t:
+                rate = value
+                end = self.profile[i+1][0] if i+1 < len(self.profile) else math.inf
+        return rate, end
+
+    def _after(self, t):
+        # exponential gaps within each rate segment; memorylessness lets a gap restart at a segment boundary
+        while True:
+            rate, end = self._rateAt(t)
+            gap = self.rng.expovariate(rate) if rate > 0 else math.inf
+            if t + gap < end:
+                return t + gap
+            if end == math.inf:
+                return math.inf
+            t = end
+
+    def arrivalsUntil(self, now):
+        while self.nextTime <= now:
+            self.nextTime = self._after(self.nextTime)
+            temp = self.rng.randint(0, 999)
+            direction = next((d for d, bound in enumerate(self.directionSplit) if temp < bound), 0)
+            yield direction, self.rng.randint(0, self.numTypes-1)
+
+
+def createArrivals(spec, sim, directionNumbers, vehicleTypes):
+    """Arrival source for a Simulation, or None for the built-in uniform generator."""
+    if spec is None or spec == "uniform":
+        return None
+    if spec == "poisson":
+        spec = {"type": "poisson"}
+    elif isinstance(spec, (str, list)):
+        spec = {"type": "trace", "paths": spec}
+    elif not isinstance(spec, dict):
+        return spec     # an object with arrivalsUntil(now)
+
+    kind = spec.get("type")
+    if kind == "poisson":
+        profile = spec.get("profile") or sim.arrivalProfile or [[0, 1.0/sim.vehicleInterval]]
+        return PoissonArrivals(sim.rng, profile, sim.directionSplit, len(vehicleTypes))
+    if kind == "trace":
+        return TraceArrivals(spec["paths"], directionNumbers, vehicleTypes, spec.get("camera"),
+                             spec.get("directionMap"), spec.get("start"))
+    raise ValueError("Unknown arrivals: " + str(kind))
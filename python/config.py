@@ -0,0 +1,8 @@
+import os
+
+# --- Service Configuration ---
+PORT = int(os.environ.get("PORT", "5000"))
+UPLOAD_FOLDER = "uploads"
+HLS_FOLDER = os.path.join(UPLOAD_FOLDER, "hls")
+os.makedirs(HLS_FOLDER, exist_ok=True)
+OUTPUT_TTL = int(os.environ.get("OUTPUT_TTL", "3600"))     # seconds finished HLS outputs are kept for playback
@@ -0,0 +1,241 @@
+import json
+import os
+import cv2
+import numpy as np
+import profiling
+
+# --- Configuration ---
+MIN_DIST = 30           # max centroid jump (px) to keep the same track ID between frames
+LINE_OFFSET = 150       # default counting line sits this many pixels above the bottom edge
+CONF_THRESHOLD = 0.5
+NMS_THRESHOLD = 0.4
+ZONES_FILE = os.environ.get("COUNTING_ZONES", "zones.json")
+
+# COCO classes that are counted; everything else (persons, animals, ...) is ignored
+VEHICLE_CLASSES = ("car", "bus", "truck", "motorbike", "bicycle")
+COLORS = {"car": (0, 255, 0), "bus": (0, 0, 255), "truck": (0, 128, 255),
+          "motorbike": (255, 0, 255), "bicycle": (255, 255, 0)}
+DIRECTIONS = {"up": (0, -1), "down": (0, 1), "left": (-1, 0), "right": (1, 0)}
+
+
+class CountingZones:
+    """Counting lines and polygons for one camera, tested against all tracks at once.
+
+    Each zone is a dict:
+        {"name": "north_in", "type": "line" | "polygon", "points": [[x, y], ...],
+         "direction": "down" | [dx, dy] | None, "classes": ["car", ...] | None,
+         "after": "other_zone_name" | None, "normalized": false}
+
+    A line is crossed when a track's step between two frames intersects it; a polygon
+    when the step crosses one of its edges and ends inside. "direction" keeps only
+    crossings whose motion points the same way, "classes" filters vehicle classes, and
+    "after" only counts tracks that already crossed another zone (turning movements).
+    Points are in pixels, or fractions of the frame size when "normalized" is true.
+    """
+
+    def __init__(self, zones, width, height):
+        self.zones = zones
+        self.names = [z["name"] for z in zones]
+        self.after = [self.names.index(z["after"]) if z.get("after") else None for z in zones]
+        self.labels = []
+        starts, ends, owner = [], [], []
+        n = len(zones)
+        self.is_line = np.zeros(n, bool)
+        self.dirs = np.zeros((n, 2))
+        self.has_dir = np.zeros(n, bool)
+        self.class_mask = np.zeros((len(VEHICLE_CLASSES), n), bool)
+        self.polylines = []
+
+        for z, zone in enumerate(zones):
+            pts = np.asarray(zone["points"], float)
+            if zone.get("normalized"):
+                pts = pts * (width, height)
+            self.polylines.append(pts.astype(np.int32))
+            self.is_line[z] = zone.get("type", "line") == "line"
+            edges = [(pts[0], pts[1])] if self.is_line[z] else list(zip(pts, np.roll(pts, -1, axis=0)))
+            for a, b in edges:
+                starts.append(a); ends.append(b); owner.append(z)
+
+            direction = zone.get("direction")
+            if direction is not None:
+                vec = np.asarray(DIRECTIONS.get(direction, direction), float)
+                self.dirs[z] = vec / np.linalg.norm(vec)
+                self.has_dir[z] = True
+            self.labels.append(direction if isinstance(direction, str) else zone["name"])
+
+            allowed = zone.get("classes") or VEHICLE_CLASSES
+            for c, cls in enumerate(VEHICLE_CLASSES):
+                self.class_mask[c, z] = cls in allowed
+
+        self.seg_a = np.asarray(starts, float).reshape(-1, 2)
+        self.seg_b = np.asarray(ends, float).reshape(-1, 2)
+        # (edges, zones) one-hot so per-edge results can be summed per zone with a matmul
+        self.edge_zone = np.zeros((len(owner), n), np.int32)
+        self.edge_zone[np.arange(len(owner)), owner] = 1
+
+    def crossings(self, p0, p1, cls_idx):
+        """Boolean (tracks, zones) matrix of zones entered by each track this frame.
+
+        p0/p1 are (T, 2) arrays of previous and current centroids, cls_idx the index of
+        each track's class in VEHICLE_CLASSES.
+        """
+        if len(p0) == 0 or len(self.zones) == 0:
+            return np.zeros((len(p0), len(self.zones)), bool)
+        a, b = self.seg_a[None], self.seg_b[None]             # (1, E, 2)
+        q0, q1 = p0[:, None], p1[:, None]                     # (T, 1, 2)
+        edge, step = b - a, q1 - q0
+
+        def cross(u, v):
+            return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+
+        # Proper segment intersection: endpoints of each segment on opposite sides of the other
+        hits = ((cross(edge, q0 - a) > 0) != (cross(edge, q1 - a) > 0)) & \
+               ((cross(step, a - q0) > 0) != (cross(step, b - q0) > 0))          # (T, E)
+        crossed = (hits.astype(np.int32) @ self.edge_zone) > 0                   # (T, Z)
+
+        # Even-odd ray test of the current point against every polygon edge at once
+        ay, by = a[..., 1], b[..., 1]
+        py, px = q1[..., 1], q1[..., 0]
+        straddles = (ay > py) != (by > py)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_at = (b[..., 0] - a[..., 0]) * (py - ay) / (by - ay) + a[..., 0]
+        ray = straddles & (px < x_at)
+        inside = ((ray.astype(np.int32) @ self.edge_zone) % 2) == 1
+
+        moving_along = ~self.has_dir | ((p1 - p0) @ self.dirs.T > 0)
+        return crossed & (self.is_line | inside) & moving_along & self.class_mask[cls_idx]
+
+    def draw(self, frame):
+        for pts, is_line in zip(self.polylines, self.is_line):
+            cv2.polylines(frame, [pts], not is_line, (255, 0, 0), 2)
+
+
+def default_zones(width, height):
+    """The original single horizontal counting line, counting any direction."""
+    y = height - LINE_OFFSET
+    return [{"name": "line", "type": "line", "points": [[0, y], [width, y]]}]
+
+
+def load_zones(camera_id, width, height):
+    """Zones configured for camera_id in ZONES_FILE, or the default line."""
+    if os.path.exists(ZONES_FILE):
+        with open(ZONES_FILE, "r") as f:
+            config = json.load(f)
+        if camera_id in config:
+            return CountingZones(config[camera_id], width, height)
+    return CountingZones(default_zones(width, height), width, height)
+
+
+class VehicleCounter:
+    """Centroid tracker and zone counter shared by the video endpoints.
+
+    update() does the tracking and counting only; drawing is a separate step so that
+    analytics-only callers never touch the frame pixels.
+    """
+
+    def __init__(self, width, height, fps, class_names, zones=None):
+        self.width = width
+        self.height = height
+        self.fps = fps or 25.0
+        self.class_names = class_names
+        self.zones = zones or CountingZones(default_zones(width, height), width, height)
+        self.counts = {cls: 0 for cls in VEHICLE_CLASSES}
+        self.zone_counts = {name: {cls: 0 for cls in VEHICLE_CLASSES} for name in self.zones.names}
+        self.events = []
+        self.tracker = {}
+        self.next_id = 0
+        self.frames = 0
+
+    def _match(self, centers):
+        """Track ID for each detection: the first live track within MIN_DIST, else a new one."""
+        ids = [None] * len(centers)
+        if self.tracker and len(centers):
+            tids = list(self.tracker)
+            known = np.array([(self.tracker[t]['cx'], self.tracker[t]['cy']) for t in tids], float)
+            near = np.hypot(*(centers[:, None] - known[None]).transpose(2, 0, 1)) < MIN_DIST
+            first = near.argmax(axis=1)
+            for i in np.flatnonzero(near.any(axis=1)):
+                ids[i] = tids[first[i]]
+        return ids
+
+    def update(self, boxes, confs, cids):
+        """Track this frame's detections and record zone crossings.
+
+        Returns a list of (track_id, box, vehicle_type) for the tracked vehicles.
+        """
+        frame_idx = self.frames
+        self.frames += 1
+        idxs = cv2.dnn.NMSBoxes([b[:4] for b in boxes], confs, CONF_THRESHOLD, NMS_THRESHOLD)
+        keep = [i for i in np.asarray(idxs, dtype=int).reshape(-1) if self.class_names[cids[i]] in VEHICLE_CLASSES]
+        tracks = []
+        current = set()
+
+        with profiling.span("track"):
+            centers = np.array([boxes[i][4:6] for i in keep], float).reshape(-1, 2)
+            moved, p0, p1, cls_idx = [], [], [], []
+            for i, vid, center in zip(keep, self._match(centers), centers):
+                vtype = self.class_names[cids[i]]
+                if vid is None:
+                    vid = self.next_id
+                    self.next_id += 1
+                    self.tracker[vid] = {'cx': center[0], 'cy': center[1], 'counted': set(), 'type': vtype}
+                else:
+                    data = self.tracker[vid]
+                    moved.append(vid)
+                    p0.append((data['cx'], data['cy']))
+                    p1.append(center)
+                    cls_idx.append(VEHICLE_CLASSES.index(data['type']))
+                    data.update({'cx': center[0], 'cy': center[1]})
+                current.add(vid)
+                tracks.append((vid, boxes[i][:4], self.tracker[vid]['type']))
+
+            hit = self.zones.crossings(np.array(p0, float).reshape(-1, 2), np.array(p1, float).reshape(-1, 2),
+                                       np.array(cls_idx, int))
+            for t, z in zip(*np.nonzero(hit)):
+                self._count(moved[t], z, frame_idx)
+
+            for tid in list(self.tracker):
+                if tid not in current:
+                    del self.tracker[tid]
+        return tracks
+
+    def _count(self, vid, z, frame_idx):
+        data = self.tracker[vid]
+        after = self.zones.after[z]
+        if z in data['counted'] or (after is not None and after not in data['counted']):
+            return
+        data['counted'].add(z)
+        vtype = data['type']
+        zone = self.zones.names[z]
+        self.counts[vtype] += 1
+        self.zone_counts[zone][vtype] += 1
+        self.events.append({
+            "time": round(frame_idx / self.fps, 3),
+            "frame": frame_idx,
+            "track_id": vid,
+            "class": vtype,
+            "zone": zone,
+            "direction": self.zones.labels[z],
+        })
+
+    def draw(self, frame, tracks):
+        """Draw boxes, the counting zones and running totals onto the frame in place."""
+        for vid, (x, y, w_, h_), vtype in tracks:
+            clr = COLORS[vtype]
+            cv2.rectangle(frame, (x, y), (x + w_, y + h_), clr, 2)
+            cv2.putText(frame, f"{vtype} ID:{vid}", (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, clr, 2)
+        self.zones.draw(frame)
+        for row, (vtype, n) in enumerate(self.counts.items()):
+            cv2.putText(frame, f"{vtype}: {n}", (10, 30 + 40 * row), cv2.FONT_HERSHEY_SIMPLEX, 1, COLORS[vtype], 2)
+        return frame
+
+    def summary(self):
+        """JSON-serialisable time series of crossings plus totals."""
+        return {
+            "fps": self.fps,
+            "frames": self.frames,
+            "duration": round(self.frames / self.fps, 3),
+            "counts": dict(self.counts),
+            "zones": self.zone_counts,
+            "events": self.events,
+        }
@@ -0,0 +1,149 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import Counter
+from forksafe import start_in_each_process
+
+# --- Configuration ---
+COUNTS_DB = os.environ.get("COUNTS_DB", "counts.db")
+FLUSH_INTERVAL = 1.0    # seconds a batch may wait before it is written
+BATCH_SIZE = 1000       # events per write transaction
+GRANULARITIES = {"minute": 60, "hour": 3600, "day": 86400}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS crossings (
+    ts REAL NOT NULL,
+    camera_id TEXT NOT NULL,
+    class TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    track_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS crossings_camera_ts ON crossings (camera_id, ts);
+CREATE TABLE IF NOT EXISTS counts_minute (
+    camera_id TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    class TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (camera_id, bucket, class, direction)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS counts_hour (
+    camera_id TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    class TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (camera_id, bucket, class, direction)
+) WITHOUT ROWID;
+"""
+
+UPSERT = """
+INSERT INTO {table} (camera_id, bucket, class, direction, count) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (camera_id, bucket, class, direction) DO UPDATE SET count = count + excluded.count
+"""
+
+
+class CountsStore:
+    """Append-only store of crossing events with per-minute and per-hour rollups.
+
+    add() only enqueues; a background thread writes batches in one transaction that
+    appends the raw events and bumps the pre-aggregated tables, so queries over long
+    ranges read the small rollup tables instead of scanning every crossing.
+    """
+
+    def __init__(self, path=COUNTS_DB):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        start_in_each_process(self._start_writer)
+
+    def _start_writer(self):
+        self._queue = queue.Queue()
+        self._closed = threading.Event()
+        self.written = self.failed = 0
+        self._writer = threading.Thread(name="counts-writer", target=self._run, daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def add(self, camera_id, events, start_time):
+        """Queue crossing events; event["time"] is seconds since start_time (epoch seconds)."""
+        for event in events:
+            self._queue.put((
+                start_time + event["time"],
+                camera_id,
+                event["class"],
+                event.get("direction", "any"),
+                event.get("track_id"),
+            ))
+
+    def _run(self):
+        conn = self._connect()
+        while not (self._closed.is_set() and self._queue.empty()):
+            batch = []
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(conn, batch)
+        conn.close()
+
+    def _write(self, conn, batch):
+        minute, hour = Counter(), Counter()
+        for ts, camera_id, cls, direction, _ in batch:
+            minute[(camera_id, int(ts // 60) * 60, cls, direction)] += 1
+            hour[(camera_id, int(ts // 3600) * 3600, cls, direction)] += 1
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO crossings (ts, camera_id, class, direction, track_id) VALUES (?, ?, ?, ?, ?)", batch)
+                conn.executemany(UPSERT.format(table="counts_minute"), [k + (n,) for k, n in minute.items()])
+                conn.executemany(UPSERT.format(table="counts_hour"), [k + (n,) for k, n in hour.items()])
+            self.written += len(batch)
+        except sqlite3.Error as e:
+            # the batch is lost, but the writer keeps draining the queue
+            self.failed += len(batch)
+            print(f"Dropped {len(batch)} crossing events: {e}")
+
+    def close(self):
+        """Flush everything queued so far and stop the writer thread."""
+        self._closed.set()
+        self._writer.join()
+
+    def stats(self):
+        return {"queued": self._queue.qsize(), "written": self.written, "failed": self.failed}
+
+    def rollup(self, camera_id, granularity="minute", start=None, end=None, by_direction=False):
+        """Counts per bucket and class (and direction) for one camera between start and end."""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity must be one of: {', '.join(GRANULARITIES)}")
+        size = GRANULARITIES[granularity]
+        table = "counts_minute" if granularity == "minute" else "counts_hour"
+        group = "class, direction" if by_direction else "class"
+        sql = (f"SELECT (bucket / {size}) * {size} AS b, {group}, SUM(count) FROM {table} "
+               f"WHERE camera_id = ? AND bucket >= ? AND bucket < ? GROUP BY b, {group} ORDER BY b")
+        params = (camera_id, start if start is not None else 0, end if end is not None else 2 ** 62)
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+        if by_direction:
+            return [{"bucket": b, "class": c, "direction": d, "count": n} for b, c, d, n in rows]
+        return [{"bucket": b, "class": c, "count": n} for b, c, n in rows]
+
+    def cameras(self):
+        conn = self._connect()
+        try:
+            return [r[0] for r in conn.execute("SELECT DISTINCT camera_id FROM counts_hour ORDER BY camera_id")]
+        finally:
+            conn.close()
@@ -0,0 +1,200 @@
+import collections
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import cv2
+from forksafe import start_in_each_process
+
+# --- Configuration ---
+EVIDENCE_DIR = os.environ.get("EVIDENCE_DIR", "evidence")
+EVIDENCE_BUFFER = int(os.environ.get("EVIDENCE_BUFFER", "512"))    # events held in memory before the oldest drop
+BATCH_SIZE = 64             # events per write transaction
+FLUSH_INTERVAL = 1.0        # seconds a batch may wait before it is written
+SNAPSHOT_MAX_SIDE = 320     # evidence crops are shrunk to at most this many pixels per side
+SNAPSHOT_QUALITY = 80       # JPEG quality of evidence crops
+MAX_ATTEMPTS = 3            # frames a track is inspected for each kind of event before giving up
+
+HELMET_VIOLATION, PLATE = "helmet_violation", "plate"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS evidence (
+    id TEXT PRIMARY KEY,
+    ts REAL NOT NULL,
+    camera_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    track_id INTEGER,
+    frame INTEGER,
+    path TEXT NOT NULL,
+    meta TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS evidence_camera_ts ON evidence (camera_id, ts);
+"""
+
+
+def snapshot(crop):
+    """The crop as a compact JPEG, shrunk to SNAPSHOT_MAX_SIDE."""
+    scale = SNAPSHOT_MAX_SIDE / max(crop.shape[:2])
+    if scale < 1:
+        crop = cv2.resize(crop, (max(1, int(crop.shape[1] * scale)), max(1, int(crop.shape[0] * scale))),
+                          interpolation=cv2.INTER_AREA)
+    _, buffer = cv2.imencode('.jpg', crop, [cv2.IMWRITE_JPEG_QUALITY, SNAPSHOT_QUALITY])
+    return buffer.tobytes()
+
+
+class EvidenceStore:
+    """Violation and plate events with a JPEG snapshot each, kept on disk with a SQLite index.
+
+    put() only appends to a ring buffer of EVIDENCE_BUFFER events, so a frame loop never
+    waits for the disk; when a burst outruns the writer the oldest buffered events are
+    dropped (and counted) instead of memory growing. A background thread writes the
+    snapshots and indexes them, BATCH_SIZE events per transaction.
+    """
+
+    def __init__(self, directory=EVIDENCE_DIR, capacity=EVIDENCE_BUFFER):
+        self.directory = directory
+        self.capacity = capacity
+        self.index_path = os.path.join(directory, "index.db")
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        start_in_each_process(self._start_writer)
+
+    def _start_writer(self):
+        self._buffer = collections.deque(maxlen=self.capacity)
+        self._ready = threading.Condition()
+        self._closed = False
+        self.written = self.dropped = self.failed = 0
+        self._writer = threading.Thread(name="evidence-writer", target=self._run, daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def put(self, event, jpeg):
+        """Queue an event (a dict with id, ts, camera_id, kind, ...) and its snapshot; never blocks on I/O."""
+        with self._ready:
+            if len(self._buffer) == self.capacity:
+                self.dropped += 1
+            self._buffer.append((event, jpeg))
+            if len(self._buffer) >= BATCH_SIZE:
+                self._ready.notify()
+
+    def recorder(self, camera_id, start_time, fps):
+        return EvidenceRecorder(self, camera_id, start_time, fps)
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            with self._ready:
+                self._ready.wait_for(lambda: self._closed or len(self._buffer) >= BATCH_SIZE, FLUSH_INTERVAL)
+                batch = [self._buffer.popleft() for _ in range(min(BATCH_SIZE, len(self._buffer)))]
+                done = self._closed and not self._buffer
+            if batch:
+                self._write(conn, batch)
+            if done:
+                break
+        conn.close()
+
+    def _write(self, conn, batch):
+        rows = []
+        for event, jpeg in batch:
+            day = time.strftime("%Y%m%d", time.gmtime(event["ts"]))
+            camera = re.sub(r"[^A-Za-z0-9_.-]", "_", event["camera_id"])
+            path = os.path.join(camera, day, f"{event['id']}.jpg")
+            try:
+                os.makedirs(os.path.join(self.directory, camera, day), exist_ok=True)
+                with open(os.path.join(self.directory, path), "wb") as f:
+                    f.write(jpeg)
+            except OSError:
+                self.failed += 1
+                continue
+            meta = {k: v for k, v in event.items() if k not in ("id", "ts", "camera_id", "kind", "track_id", "frame")}
+            rows.append((event["id"], event["ts"], event["camera_id"], event["kind"], event.get("track_id"),
+                         event.get("frame"), path, json.dumps(meta)))
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO evidence VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.written += len(rows)
+        except sqlite3.Error:
+            self.failed += len(rows)
+
+    def close(self):
+        """Write everything buffered so far and stop the writer thread."""
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+        self._writer.join()
+
+    def stats(self):
+        return {"buffered": len(self._buffer), "capacity": self.capacity, "written": self.written,
+                "dropped": self.dropped, "failed": self.failed}
+
+    def query(self, camera_id=None, kind=None, start=None, end=None, limit=100):
+        """Indexed events, newest first, filtered by camera, kind and start/end in epoch seconds."""
+        where, params = ["ts >= ?", "ts < ?"], [start if start is not None else 0, end if end is not None else 2 ** 62]
+        if camera_id is not None:
+            where.append("camera_id = ?"); params.append(camera_id)
+        if kind is not None:
+            where.append("kind = ?"); params.append(kind)
+        sql = (f"SELECT id, ts, camera_id, kind, track_id, frame, meta FROM evidence WHERE {' AND '.join(where)} "
+               f"ORDER BY ts DESC LIMIT ?")
+        conn = self._connect()
+        try:
+            rows = conn.execute(sql, params + [limit]).fetchall()
+        finally:
+            conn.close()
+        return [{"id": i, "ts": ts, "camera_id": c, "kind": k, "track_id": t, "frame": f, **json.loads(m)}
+                for i, ts, c, k, t, f, m in rows]
+
+    def snapshot_path(self, event_id):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT path FROM evidence WHERE id = ?", (event_id,)).fetchone()
+        finally:
+            conn.close()
+        return os.path.join(self.directory, row[0]) if row else None
+
+
+class EvidenceRecorder:
+    """Evidence for one video: at most one event of each kind per track.
+
+    wants() tells the frame loop whether a track still needs inspecting, so a track that
+    already has its event (or was inspected MAX_ATTEMPTS times) costs nothing more.
+    """
+
+    def __init__(self, store, camera_id, start_time, fps):
+        self.store = store
+        self.camera_id = camera_id
+        self.start_time = start_time
+        self.fps = fps
+        self.attempts = collections.Counter()
+        self.recorded = set()
+        self.events = []
+
+    def wants(self, track_id, kind):
+        return (track_id, kind) not in self.recorded and self.attempts[track_id, kind] < MAX_ATTEMPTS
+
+    def tried(self, track_id, kind):
+        self.attempts[track_id, kind] += 1
+
+    def add(self, kind, track_id, frame_idx, crop, **meta):
+        if (track_id, kind) in self.recorded or crop.size == 0:
+            return None
+        self.recorded.add((track_id, kind))
+        event = {"id": uuid.uuid4().hex, "ts": self.start_time + frame_idx / self.fps, "camera_id": self.camera_id,
+                 "kind": kind, "track_id": int(track_id), "frame": frame_idx, **meta}
+        self.store.put(event, snapshot(crop))
+        self.events.append(event)
+        return event
+
+
+def union_box(a, b):
+    x0, y0 = min(a[0], b[0]), min(a[1], b[1])
+    return [x0, y0, max(a[0] + a[2], b[0] + b[2]) - x0, max(a[1] + a[3], b[1] + b[3]) - y0]
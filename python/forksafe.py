@@ -0,0 +1,12 @@
+import os
+
+
+def start_in_each_process(start):
+    """Call start() now, and again in every child forked from this process.
+
+    A forked server worker (gunicorn preload_app) inherits the objects the master
+    created but none of its threads, so anything that runs a background thread has to
+    start it again in the child.
+    """
+    start()
+    os.register_at_fork(after_in_child=start)
@@ -0,0 +1,35 @@
+# gunicorn -c gunicorn.conf.py app:app
+#
+# With preload (the default) the master imports the app, loads and warms every model
+# in PRELOAD_MODELS and then forks the workers. The weights are never written after
+# that, so the workers share the master's pages copy-on-write and each worker's unique
+# memory (USS, see GET /models) is just its own request state. EasyOCR's torch weights
+# are additionally memory-mapped from MODEL_CACHE_DIR (MMAP_WEIGHTS=0 turns that off);
+# cv2.dnn keeps darknet weights on its own heap, so those rely on copy-on-write alone.
+# The worker count and every worker's thread pools come from thread_plan.
+import gc
+import os
+from config import PORT
+from models import registry, PRELOAD_MODELS
+from thread_plan import current_plan
+
+bind = os.environ.get("BIND", f"0.0.0.0:{PORT}")
+workers = current_plan().workers
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.environ.get("PRELOAD_APP", "1") != "0"
+timeout = 120
+
+
+def when_ready(server):
+    """Runs in the master after the app is imported and before any worker is forked."""
+    if not preload_app:
+        return
+    current_plan().apply()
+    registry.preload(PRELOAD_MODELS)
+    # move everything allocated so far out of the collector's reach: a collection in a
+    # worker would otherwise write to every object header and un-share those pages
+    gc.freeze()
+    report = registry.report()
+    server.log.info("Preloaded models %s, master RSS %s MB",
+                    ", ".join(name for name, m in report["models"].items() if m["loaded"]),
+                    report["process"]["rss_mb"])
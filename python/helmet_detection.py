@@ -1,115 +1,122 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import APIRouter, File, UploadFile, HTTPException
 import cv2
-import numpy as np
 from typing import List
-import io
-
-app = FastAPI()
-
-# Configure CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Load specialized helmet detection model (replace with your trained model)
-helmet_net = cv2.dnn.readNet("helmet_detection.weights", "helmet_detection.cfg")
-with open("helmet_classes.txt", "r") as f:
-    helmet_classes = [line.strip() for line in f.readlines()]
-
-# Configuration for optimal accuracy
-CONFIDENCE_THRESHOLD = 0.7
+from image_decode import read_image
+from models import registry
+from plate_detection import recognize_number_plate
+
+router = APIRouter()
+
 NMS_THRESHOLD = 0.4
-INPUT_SIZE = (640, 640)
-
-def detect_helmets(img: np.ndarray) -> List[dict]:
-    height, width = img.shape[:2]
-    
-    # Preprocess image
-    blob = cv2.dnn.blobFromImage(
-        img, 
-        1/255.0, 
-        INPUT_SIZE, 
-        swapRB=True, 
-        crop=False
-    )
-    
-    # Perform detection
-    helmet_net.setInput(blob)
-    outputs = helmet_net.forward(helmet_net.getUnconnectedOutLayersNames())
-    
-    # Process detections
-    boxes, confidences, class_ids = [], [], []
-    
-    for output in outputs:
-        for detection in output:
-            scores = detection[5:]
-            class_id = np.argmax(scores)
-            confidence = scores[class_id]
-            
-            if confidence > CONFIDENCE_THRESHOLD:
-                # Scale bounding box coordinates
-                box = detection[0:4] * np.array([width, height, width, height])
-                (x, y, w, h) = box.astype("int")
-                
-                # Convert to proper box format
-                x = int(x - (w / 2))
-                y = int(y - (h / 2))
-                
-                boxes.append([x, y, int(w), int(h)])
-                confidences.append(float(confidence))
-                class_ids.append(class_id)
-    
-    # Apply Non-Maximum Suppression
-    indices = cv2.dnn.NMSBoxes(
-        boxes, 
-        confidences, 
-        CONFIDENCE_THRESHOLD,
-        NMS_THRESHOLD
-    )
-    
-    results = []
-    if len(indices) > 0:
-        for i in indices.flatten():
-            results.append({
-                "class": helmet_classes[class_ids[i]],
-                "confidence": confidences[i],
-                "box": boxes[i]
-            })
-    
-    return results
-
-@app.post("/detect-helmet")
+VEHICLE_CLASSES = {'car', 'motorbike', 'bus', 'truck'}
+VEHICLE_CROP_MIN_SIDE = 480     # pixels a vehicle crop is given for plate OCR, when the upload has them
+
+# --- Rider Cascade ---
+# yolov3-spp finds persons and motorbikes on the whole frame; only the heads of persons
+# riding a bike go to the helmet model, in batches at its small input size, so helmet
+# compute grows with the number of riders rather than with the frame.
+RIDER_MIN_OVERLAP = 0.5     # share of a person's width that must lie over the bike
+HEAD_FRACTION = 0.4         # top part of a rider's box that is sent to the helmet model
+HEAD_PADDING = 0.1          # widened by this share of the box width on each side
+HEAD_MIN_SIDE = 64          # pixels a head crop is given, when the upload has them
+HELMET_BATCH = 16           # head crops per helmet forward pass
+
+
+def nms(boxes, confidences):
+    indices = cv2.dnn.NMSBoxes([b[:4] for b in boxes], confidences, 0.5, NMS_THRESHOLD)
+    return [int(i) for i in (indices.flatten() if len(indices) > 0 else [])]
+
+
+def ride_score(person, bike):
+    """How well a person box sits on a bike box (0 when it does not): the person must
+    start above the bike, end with their feet within it and overlap it horizontally."""
+    x, y, w, h = person[:4]
+    bx, by, bw, bh = bike[:4]
+    overlap = (min(x + w, bx + bw) - max(x, bx)) / max(w, 1)
+    feet = y + h
+    if overlap < RIDER_MIN_OVERLAP or y >= by or not by < feet <= by + bh * 1.25:
+        return 0.0
+    return overlap
+
+
+def pair_riders(boxes, class_ids, classes, keep):
+    """(person index, motorbike index) for every person riding a motorbike; a bike may carry several."""
+    persons = [i for i in keep if classes[class_ids[i]] == 'person']
+    bikes = [i for i in keep if classes[class_ids[i]] == 'motorbike']
+    pairs = []
+    for p in persons:
+        score, bike = max(((ride_score(boxes[p], boxes[b]), b) for b in bikes), default=(0.0, None))
+        if score > 0:
+            pairs.append((p, bike))
+    return pairs
+
+
+def check_riders(upload, boxes, confidences, class_ids, classes) -> List[dict]:
+    """Helmet result for each rider found in a yolov3-spp detection of upload.image."""
+    pairs = pair_riders(boxes, class_ids, classes, nms(boxes, confidences) if boxes else [])
+    if not pairs:
+        return []
+    crops = []
+    for p, _ in pairs:
+        x, y, w, h = boxes[p][:4]
+        crops.append(upload.crop(x - w * HEAD_PADDING, y, w * (1 + 2 * HEAD_PADDING), h * HEAD_FRACTION,
+                                 min_side=HEAD_MIN_SIDE))
+
+    model = registry.get("helmet")
+    found = []
+    for start in range(0, len(crops), HELMET_BATCH):
+        found += model.detect_batch(crops[start:start + HELMET_BATCH])
+
+    riders = []
+    for (p, b), (_, helmet_confidences, helmet_ids) in zip(pairs, found):
+        confidence = max((c for c, k in zip(helmet_confidences, helmet_ids) if model.classes[k].lower() == 'helmet'),
+                         default=0.0)
+        riders.append({
+            "box": upload.to_original(boxes[p][:4]),
+            "motorbike": upload.to_original(boxes[b][:4]),
+            "helmet": confidence > 0,
+            "confidence": round(confidence, 3),
+        })
+    return riders
+
+
+# --- Helmet Detection Endpoint ---
+@router.post("/detect-helmet")
 async def detect_helmet(file: UploadFile = File(...)):
+    """Overall compliance (status.helmet, as the dashboard shows it) and the result for every rider."""
     try:
-        content = await file.read()
-        np_arr = np.frombuffer(content, np.uint8)
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        
-        if img is None:
-            raise HTTPException(400, "Invalid image file")
-        
-        # Convert to RGB for better accuracy
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        
-        # Perform detection
-        detections = detect_helmets(img)
-        
-        # Filter only helmet detections
-        helmets = [d for d in detections if d["class"] == "helmet"]
-        
-        return {
-            "helmet_detected": len(helmets) > 0,
-            "total_helmets": len(helmets),
-            "detections": helmets,
-            "confidence": max([d["confidence"] for d in helmets], default=0)
-        }
-    
+        upload = await read_image(file)
+        model = registry.get("yolov3-spp")
+        boxes, confs, cids = model.detect(upload.image)
+        riders = check_riders(upload, boxes, confs, cids, model.classes)
+
+        # Determine compliance status
+        helmet_status = "✅ Helmet Compliant"
+        if any(not rider["helmet"] for rider in riders):
+            helmet_status = "⚠️ Helmet Violation"
+
+        return {"status": {"helmet": helmet_status}, "riders": riders}
+
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(500, f"Processing error: {str(e)}")
+        raise HTTPException(500, str(e))
+
+# --- Combined Helmet and Plate Endpoint ---
+@router.post("/detect-helmet-plate")
+async def detect_helmet_plate(file: UploadFile = File(...)):
+    upload = await read_image(file)
+    model = registry.get("yolov3-spp")
+    boxes, confs, cids = model.detect(upload.image)
+    classes = model.classes
+    riders = check_riders(upload, boxes, confs, cids, classes)
+
+    # Plates are read from each vehicle at higher resolution, or from the whole image if none was found
+    vehicles = [boxes[i][:4] for i in range(len(boxes)) if classes[cids[i]] in VEHICLE_CLASSES]
+    crops = [crop for crop in (upload.crop(*box, min_side=VEHICLE_CROP_MIN_SIDE) for box in vehicles) if crop.size]
+    plates = list(dict.fromkeys(text for crop in crops or [upload.image] for text in recognize_number_plate(crop)))
 
-# To run: uvicorn app:app --reload
\ No newline at end of file
+    dets = [{"class": classes[cids[i]], "box": upload.to_original(boxes[i][:4]), "confidence": confs[i]}
+            for i in range(len(boxes))]
+    return {"helmet_on_motorcycle": all(rider["helmet"] for rider in riders), "riders": riders,
+            "plates": plates, "detections": dets}
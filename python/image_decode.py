@@ -0,0 +1,117 @@
+import os
+import struct
+import cv2
+import numpy as np
+from fastapi import HTTPException
+import profiling
+
+# --- Configuration ---
+# Uploaded JPEGs are decoded at 1/2, 1/4 or 1/8 scale (libjpeg scales while decoding,
+# so the full-size bitmap is never built) as long as the short side stays at least
+# DECODE_MIN_SIDE pixels; the detector input is 416x416, so that leaves ample detail.
+DECODE_MIN_SIDE = int(os.environ.get("DECODE_MIN_SIDE", "720"))
+REDUCED_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4,
+                 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# SOFn markers carry the frame size; C4 (DHT), C8 (JPG) and CC (DAC) share the range but do not
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def jpeg_size(data):
+    """(width, height) from a JPEG's frame header without decoding it, or None if data is not a JPEG."""
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:          # fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            i += 2                  # standalone markers have no length
+            continue
+        length = struct.unpack(">H", data[i + 2:i + 4])[0]
+        if marker in SOF_MARKERS:
+            if i + 9 > len(data):
+                return None
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        i += 2 + length
+    return None
+
+
+def reduction_for(width, height, min_side=DECODE_MIN_SIDE):
+    """Largest decode scale factor (1, 2, 4 or 8) that keeps the short side at least min_side."""
+    short = min(width, height)
+    return next((f for f in (8, 4, 2) if short // f >= min_side), 1)
+
+
+class UploadedImage:
+    """An uploaded still, decoded at reduced scale for detection.
+
+    image is the working copy that detection, drawing and returned previews use.
+    Boxes found on it can be cut out at higher resolution with crop(), which decodes
+    the upload again at the scale needed (cached per scale) only when asked. OpenCV
+    cannot decode just a region of a JPEG, so a crop at full detail costs one
+    full-size decode, but only for requests that need it.
+    """
+
+    def __init__(self, data, min_side=DECODE_MIN_SIDE):
+        self.data = np.frombuffer(data, np.uint8)
+        size = jpeg_size(data)
+        self.factor = reduction_for(*size, min_side) if size else 1
+        self._decoded = {}
+        self.image = self.decode(self.factor)
+
+    def decode(self, factor):
+        if factor not in self._decoded:
+            self._decoded[factor] = cv2.imdecode(self.data, REDUCED_FLAGS[factor])
+        return self._decoded[factor]
+
+    def crop(self, x, y, w, h, min_side=None):
+        """Region (x, y, w, h) of image, decoded so its short side has at least min_side
+        pixels where the upload has them (None: full resolution)."""
+        factor = 1
+        if min_side is not None:
+            factor = next((f for f in (8, 4, 2) if f <= self.factor and min(w, h) * self.factor // f >= min_side),
+                          1)
+        source = self.decode(factor)
+        sy = source.shape[0] / self.image.shape[0]
+        sx = source.shape[1] / self.image.shape[1]
+        x0, y0 = max(0, int(x * sx)), max(0, int(y * sy))
+        x1, y1 = min(source.shape[1], int(np.ceil((x + w) * sx))), min(source.shape[0], int(np.ceil((y + h) * sy)))
+        return source[y0:y1, x0:x1].copy()
+
+    def to_original(self, box):
+        """A box or point in image coordinates scaled to the uploaded image (to within factor pixels)."""
+        return [int(v * self.factor) for v in box]
+
+
+class FrameImage:
+    """A decoded video frame with UploadedImage's crop interface, so per-image code runs on video too."""
+
+    factor = 1
+
+    def __init__(self, image):
+        self.image = image
+
+    def crop(self, x, y, w, h, min_side=None):
+        height, width = self.image.shape[:2]
+        x0, y0 = max(0, int(x)), max(0, int(y))
+        x1, y1 = min(width, int(np.ceil(x + w))), min(height, int(np.ceil(y + h)))
+        return self.image[y0:y1, x0:x1].copy()
+
+    def to_original(self, box):
+        return [int(v) for v in box]
+
+
+async def read_image(file):
+    """Decode an uploaded image file for an endpoint; 400 if it is not an image."""
+    data = await file.read()
+    with profiling.span("decode"):
+        upload = UploadedImage(data)
+    if upload.image is None:
+        raise HTTPException(400, "Invalid image file")
+    return upload
@@ -0,0 +1,223 @@
+# Load generator for the service: replays the images and clips in a data directory
+# against the detection and counting endpoints and reports throughput, latency
+# percentiles and errors per endpoint.
+#
+#   python load_test.py --endpoints helmet,plate --concurrency 16 --duration 30
+#   python load_test.py --endpoints count,ws --rate 2 --duration 60
+#
+# Without --rate every one of --concurrency clients sends its next request as soon as
+# the previous one is answered (closed loop). With --rate requests arrive as a Poisson
+# process at that many per second (open loop), at most --concurrency in flight; their
+# latency counts from the scheduled arrival, so time spent queued for a free slot is
+# included rather than hidden.
+#
+# Run the server with STUB_MODELS=1 (see models.py) to measure the serving path
+# without the model weights. Clips (.mp4/.avi/.mov) are taken from the data directory;
+# if it has none, a short clip is made from its images.
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import tempfile
+import time
+
+ENDPOINTS = {
+    "helmet": ("POST", "/detect-helmet", "image"),
+    "plate": ("POST", "/detect-plate", "image"),
+    "count": ("POST", "/count-vehicles", "clip"),
+    "ws": ("WS", "/ws/vehicle-count", "clip"),
+}
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+CLIP_EXTENSIONS = (".mp4", ".avi", ".mov")
+
+
+def load_inputs(data_dir, clip_seconds=2.0, clip_fps=10):
+    """(name, bytes) of every image and clip in data_dir, making a clip when there is none."""
+    files = sorted(glob.glob(os.path.join(data_dir, "*")))
+    images = [(os.path.basename(f), open(f, "rb").read()) for f in files if f.lower().endswith(IMAGE_EXTENSIONS)]
+    clips = [(os.path.basename(f), open(f, "rb").read()) for f in files if f.lower().endswith(CLIP_EXTENSIONS)]
+    if not clips and images:
+        clips = [("generated.mp4", make_clip([f for f in files if f.lower().endswith(IMAGE_EXTENSIONS)],
+                                             clip_seconds, clip_fps))]
+    return {"image": images, "clip": clips}
+
+
+def make_clip(image_paths, seconds, fps, size=(640, 360)):
+    import cv2
+    frames = [cv2.resize(img, size) for img in (cv2.imread(p) for p in image_paths) if img is not None]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "clip.mp4")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+        for i in range(int(seconds * fps)):
+            writer.write(frames[i * len(frames) // int(seconds * fps)])
+        writer.release()
+        with open(path, "rb") as f:
+            return f.read()
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = {}
+
+    def record(self, latency, error=None):
+        if error is None:
+            self.latencies.append(latency)
+        else:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def summary(self, elapsed):
+        ok = len(self.latencies)
+        failed = sum(self.errors.values())
+        ms = lambda v: round(v * 1000, 1) if v is not None else None
+        return {
+            "requests": ok + failed,
+            "ok": ok,
+            "error_rate": round(failed / (ok + failed), 4) if ok + failed else 0.0,
+            "throughput": round(ok / elapsed, 2),
+            "p50_ms": ms(percentile(self.latencies, 0.50)),
+            "p95_ms": ms(percentile(self.latencies, 0.95)),
+            "p99_ms": ms(percentile(self.latencies, 0.99)),
+            "mean_ms": ms(sum(self.latencies) / ok if ok else None),
+            "errors": self.errors,
+        }
+
+
+class LoadTest:
+    def __init__(self, url, endpoints, inputs, concurrency, rate=None, duration=30.0, count_query="analytics_only=true",
+                 timeout=120.0, seed=0):
+        import httpx
+        self.url = url.rstrip("/")
+        self.ws_url = "ws" + self.url[len("http"):]
+        self.endpoints = endpoints
+        self.inputs = inputs
+        self.concurrency = concurrency
+        self.rate = rate
+        self.duration = duration
+        self.count_query = count_query
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.client = httpx.AsyncClient(timeout=timeout, limits=httpx.Limits(max_connections=concurrency))
+        self.stats = {name: Stats() for name in endpoints}
+        self.sent = 0
+
+    def _pick(self):
+        name = self.endpoints[self.sent % len(self.endpoints)]
+        files = self.inputs[ENDPOINTS[name][2]]
+        filename, data = files[self.sent // len(self.endpoints) % len(files)]
+        self.sent += 1
+        return name, filename, data
+
+    async def _request(self, name, filename, data):
+        method, path, kind = ENDPOINTS[name]
+        if method == "WS":
+            return await self._websocket(path, data)
+        query = f"?{self.count_query}" if name == "count" and self.count_query else ""
+        content_type = "video/mp4" if kind == "clip" else "image/jpeg"
+        response = await self.client.post(self.url + path + query, files={"file": (filename, data, content_type)})
+        await response.aread()
+        return None if response.status_code < 400 else f"HTTP {response.status_code}"
+
+    async def _websocket(self, path, data):
+        import websockets
+        messages = 0
+        async with websockets.connect(f"{self.ws_url}{path}?analytics_only=true", max_size=None,
+                                      open_timeout=self.timeout) as ws:
+            await ws.send(data)
+            try:
+                async for _ in ws:
+                    messages += 1
+            except websockets.ConnectionClosedError as e:
+                return f"WS closed {e.code}"
+        return None if messages else "WS no messages"
+
+    async def _timed(self, name, filename, data, scheduled):
+        try:
+            error = await asyncio.wait_for(self._request(name, filename, data), self.timeout)
+        except asyncio.TimeoutError:
+            error = "timeout"
+        except Exception as e:
+            error = type(e).__name__
+        self.stats[name].record(time.perf_counter() - scheduled, error)
+
+    async def _closed_loop(self, deadline):
+        async def client():
+            while time.perf_counter() < deadline:
+                await self._timed(*self._pick(), time.perf_counter())
+        await asyncio.gather(*(client() for _ in range(self.concurrency)))
+
+    async def _open_loop(self, deadline):
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def one(request, scheduled):
+            async with slots:
+                await self._timed(*request, scheduled)
+
+        tasks = []
+        next_arrival = time.perf_counter()
+        while next_arrival < deadline:
+            await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+            tasks.append(asyncio.create_task(one(self._pick(), next_arrival)))
+            next_arrival += self.rng.expovariate(self.rate)
+        await asyncio.gather(*tasks)
+
+    async def run(self):
+        start = time.perf_counter()
+        try:
+            if self.rate:
+                await self._open_loop(start + self.duration)
+            else:
+                await self._closed_loop(start + self.duration)
+        finally:
+            await self.client.aclose()
+        elapsed = time.perf_counter() - start
+        return {name: stats.summary(elapsed) for name, stats in self.stats.items()}
+
+
+def format_report(report):
+    columns = ("requests", "ok", "error_rate", "throughput", "p50_ms", "p95_ms", "p99_ms", "mean_ms")
+    lines = ["endpoint  " + "".join(f"{c:>12}" for c in columns)]
+    for name, row in report.items():
+        lines.append(f"{name:<10}" + "".join(f"{str(row[c]):>12}" for c in columns))
+        for error, n in row["errors"].items():
+            lines.append(f"{'':<10}  {n} x {error}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the detection and counting endpoints")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--endpoints", default="helmet,plate", help=f"comma-separated, from: {', '.join(ENDPOINTS)}")
+    parser.add_argument("--data", default="test data", help="directory of images and clips to send")
+    parser.add_argument("--concurrency", type=int, default=8, help="clients (closed loop) or requests in flight")
+    parser.add_argument("--rate", type=float, default=None, help="open-loop Poisson arrivals per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to send requests for")
+    parser.add_argument("--count-query", default="analytics_only=true", help="query string for /count-vehicles")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds before a request counts as failed")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    endpoints = [e for e in args.endpoints.split(",") if e]
+    unknown = [e for e in endpoints if e not in ENDPOINTS]
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(unknown)}")
+    inputs = load_inputs(args.data)
+    missing = {ENDPOINTS[e][2] for e in endpoints} - {kind for kind, files in inputs.items() if files}
+    if missing:
+        parser.error(f"no {' or '.join(sorted(missing))} files in {args.data}")
+
+    report = asyncio.run(LoadTest(args.url, endpoints, inputs, args.concurrency, args.rate, args.duration,
+                                  args.count_query, args.timeout).run())
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,290 @@
+import hashlib
+import itertools
+import os
+import threading
+import time
+import cv2
+import numpy as np
+import profiling
+
+# --- Model files ---
+YOLO_WEIGHTS = os.environ.get("YOLO_WEIGHTS", "yolov3-spp.weights")
+YOLO_CFG = os.environ.get("YOLO_CFG", "yolov3-spp.cfg")
+YOLO_NAMES = "coco.names"
+HELMET_WEIGHTS = os.environ.get("HELMET_WEIGHTS", "yolov3-helmet.weights")
+HELMET_CFG = os.environ.get("HELMET_CFG", "yolov3-helmet.cfg")
+HELMET_NAMES = "helmet.names"
+HELMET_INPUT_SIZE = int(os.environ.get("HELMET_INPUT_SIZE", "128"))    # rider head crops, a multiple of 32
+# Lower finds more helmets in small or blurred head crops, but each false "helmet" hides a
+# violation; 0.7 is what the whole-frame helmet check used
+HELMET_CONF_THRESHOLD = float(os.environ.get("HELMET_CONF_THRESHOLD", "0.7"))
+OCR_LANGUAGES = ["en"]
+
+# --- Loading ---
+PRELOAD_MODELS = [m for m in os.environ.get("PRELOAD_MODELS", "yolov3-spp,ocr").split(",") if m]
+MMAP_WEIGHTS = os.environ.get("MMAP_WEIGHTS", "1") != "0"
+MODEL_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", "model_cache")   # memory-mappable copies of torch weights
+
+# --- Stub Models ---
+# STUB_MODELS=1 replaces every model with a fake that takes STUB_INFERENCE_MS per image
+# (STUB_OCR_MS per OCR call) and returns canned results, so the service runs without
+# weights and load tests (load_test.py) measure serving overhead rather than inference.
+STUB_MODELS = os.environ.get("STUB_MODELS", "0") == "1"
+STUB_INFERENCE_MS = float(os.environ.get("STUB_INFERENCE_MS", "20"))
+STUB_OCR_MS = float(os.environ.get("STUB_OCR_MS", "30"))
+STUB_CROSSING_FRAMES = 60   # frames the stub car takes to drive from the top to the bottom of the image
+
+
+def memory_usage():
+    """Resident (rss) and unique (uss, when available) memory of this process in bytes."""
+    try:
+        import psutil
+        info = psutil.Process().memory_full_info()
+        return {"rss": info.rss, "uss": getattr(info, "uss", None)}
+    except (ImportError, OSError):
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return {"rss": pages * os.sysconf("SC_PAGE_SIZE"), "uss": None}
+
+
+class YoloDetector:
+    """Darknet YOLO network loaded through cv2.dnn together with its class names."""
+
+    def __init__(self, name, weights, cfg, names, input_size=(416, 416), conf_threshold=0.5):
+        self.name = name
+        self.net = cv2.dnn.readNet(weights, cfg)
+        layer_names = self.net.getLayerNames()
+        self.output_layers = [layer_names[i - 1] for i in self.net.getUnconnectedOutLayers()]
+        with open(names, "r") as f:
+            self.classes = [line.strip() for line in f.readlines()]
+        self.input_size = input_size
+        self.conf_threshold = conf_threshold
+        self.lock = threading.Lock()    # a cv2.dnn net holds its input between setInput and forward
+
+    def detect(self, img):
+        """Boxes as [x, y, w, h, center_x, center_y], confidences and class ids above the threshold."""
+        return self.detect_batch([img])[0]
+
+    def detect_batch(self, images, input_size=None):
+        """detect() for several images in one forward pass, one result per image."""
+        with profiling.span("detect", model=self.name, batch=len(images)):
+            blob = cv2.dnn.blobFromImages(images, 0.00392, input_size or self.input_size, (0, 0, 0), True, crop=False)
+            with self.lock:
+                self.net.setInput(blob)
+                outs = self.net.forward(self.output_layers)
+        # one image gives (rows, 5 + classes) per output layer, a batch (images, rows, 5 + classes)
+        outs = [out.reshape(len(images), -1, out.shape[-1]) for out in outs]
+        return [self._boxes([out[i] for out in outs], *img.shape[:2]) for i, img in enumerate(images)]
+
+    def _boxes(self, outs, height, width):
+        boxes, confidences, class_ids = [], [], []
+        for out in outs:
+            for detection in out:
+                scores = detection[5:]
+                class_id = np.argmax(scores)
+                confidence = scores[class_id]
+                if confidence > self.conf_threshold:
+                    center_x = int(detection[0] * width)
+                    center_y = int(detection[1] * height)
+                    w = int(detection[2] * width)
+                    h = int(detection[3] * height)
+                    x = int(center_x - w / 2)
+                    y = int(center_y - h / 2)
+                    boxes.append([x, y, w, h, center_x, center_y])
+                    confidences.append(float(confidence))
+                    class_ids.append(class_id)
+        return boxes, confidences, class_ids
+
+    def warmup(self):
+        # the first forward pass fuses layers and allocates the layer buffers
+        self.detect(np.zeros((self.input_size[1], self.input_size[0], 3), np.uint8))
+
+
+class StubDetector:
+    """YoloDetector stand-in: a rider on a motorbike at a fixed place and a car driving down
+    the image (or a helmet, for the helmet model), after sleeping STUB_INFERENCE_MS per image.
+
+    The car moves on with every image the detector is shown and starts again at the top
+    every STUB_CROSSING_FRAMES images, so a stub video crosses the counting line.
+    """
+
+    # (class, x, y, w, h) as fractions of the image
+    DETECTIONS = [("person", 0.40, 0.20, 0.10, 0.40), ("motorbike", 0.37, 0.45, 0.16, 0.30),
+                  ("helmet", 0.20, 0.05, 0.60, 0.40)]
+    # (class, x, w, h) of the moving vehicle; its centre goes from y 0.1 to 0.95
+    MOVING = ("car", 0.60, 0.25, 0.25)
+
+    def __init__(self, name, names, input_size=(416, 416), conf_threshold=0.5):
+        self.name = name
+        with open(names, "r") as f:
+            self.classes = [line.strip() for line in f.readlines()]
+        self.input_size = input_size
+        self.conf_threshold = conf_threshold
+        lower = [c.lower() for c in self.classes]
+        self.detections = [(lower.index(c), box) for c, *box in self.DETECTIONS if c in lower]
+        moving, *self.moving_box = self.MOVING
+        self.moving_class = lower.index(moving) if moving in lower else None
+        self.frame_index = itertools.count()
+
+    def detect(self, img):
+        return self.detect_batch([img])[0]
+
+    def detect_batch(self, images, input_size=None):
+        with profiling.span("detect", model=self.name, batch=len(images)):
+            time.sleep(STUB_INFERENCE_MS / 1000 * len(images))
+        results = []
+        for img in images:
+            height, width = img.shape[:2]
+            boxes, confidences, class_ids = [], [], []
+            detections = self.detections
+            if self.moving_class is not None:
+                x, w, h = self.moving_box
+                progress = next(self.frame_index) % STUB_CROSSING_FRAMES / STUB_CROSSING_FRAMES
+                detections = detections + [(self.moving_class, (x, 0.1 + 0.85*progress - h/2, w, h))]
+            for class_id, (x, y, w, h) in detections:
+                box = [int(x * width), int(y * height), int(w * width), int(h * height)]
+                boxes.append(box + [box[0] + box[2] // 2, box[1] + box[3] // 2])
+                confidences.append(0.9)
+                class_ids.append(class_id)
+            results.append((boxes, confidences, class_ids))
+        return results
+
+    def warmup(self):
+        pass
+
+
+class StubOCR:
+    """easyocr.Reader stand-in that reads the same plate from any image after STUB_OCR_MS."""
+
+    def readtext(self, img):
+        time.sleep(STUB_OCR_MS / 1000)
+        height, width = img.shape[:2]
+        return [([[0, 0], [width, 0], [width, height], [0, height]], "MH12AB1234", 0.9)]
+
+
+def mmap_torch_weights(module, name):
+    """Back module's float parameters and buffers with a memory-mapped file.
+
+    The tensors are written once to MODEL_CACHE_DIR under a hash of their contents and
+    loaded back with torch.load(mmap=True), so their pages are clean file pages that
+    every process mapping the file shares through the page cache, instead of private
+    heap copies. Quantized (packed) weights are left where they are. Returns whether
+    the weights are now mapped.
+    """
+    import torch
+    tensors = {key: t for key, t in (*module.named_parameters(), *module.named_buffers())
+               if t.device.type == "cpu" and not t.is_quantized and t.is_floating_point()}
+    try:
+        digest = hashlib.blake2b(digest_size=8)
+        for key, t in tensors.items():
+            digest.update(key.encode())
+            digest.update(t.detach().contiguous().numpy())
+        path = os.path.join(MODEL_CACHE_DIR, f"{name}-{digest.hexdigest()}.pt")
+        if not os.path.exists(path):
+            os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            torch.save({key: t.detach() for key, t in tensors.items()}, tmp)
+            os.replace(tmp, path)
+        mapped = torch.load(path, mmap=True, weights_only=True)
+    except (TypeError, RuntimeError, OSError) as e:     # torch < 2.1 has no mmap, or an unwritable cache
+        print(f"Not memory-mapping {name} weights: {e}")
+        return False
+    with torch.no_grad():
+        for key, t in tensors.items():
+            t.data = mapped[key]
+    return True
+
+
+def load_ocr():
+    import easyocr
+    reader = easyocr.Reader(OCR_LANGUAGES, gpu=False)
+    if MMAP_WEIGHTS:
+        mmap_torch_weights(reader.detector, "ocr-detector")
+        mmap_torch_weights(reader.recognizer, "ocr-recognizer")
+    return reader
+
+
+def warmup_ocr(reader):
+    reader.readtext(np.zeros((64, 256), np.uint8))
+
+
+class ModelRegistry:
+    """Every model the service uses, loaded once on first use and shared by all routes.
+
+    Each load records how much the process RSS grew, so report() can show what every
+    model costs alongside the process totals. Models preloaded in a server master
+    before it forks are shared copy-on-write by all workers; the registry never writes
+    to a loaded model, so those pages stay shared (see gunicorn.conf.py).
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._warmups = {}
+        self._models = {}
+        self._stats = {}
+        self._warm = set()
+        self._lock = threading.Lock()
+
+    def register(self, name, loader, warmup=None):
+        self._loaders[name] = loader
+        if warmup is not None:
+            self._warmups[name] = warmup
+
+    def get(self, name):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._lock:
+            if name not in self._models:
+                if name not in self._loaders:
+                    raise KeyError(f"Unknown model: {name}")
+                before = memory_usage()["rss"]
+                start = time.perf_counter()
+                self._models[name] = self._loaders[name]()
+                self._stats[name] = {
+                    "load_seconds": round(time.perf_counter() - start, 3),
+                    "rss_mb": round((memory_usage()["rss"] - before) / 2**20, 1),
+                }
+            return self._models[name]
+
+    def loaded(self, name):
+        return name in self._models
+
+    def preload(self, names=None):
+        """Load the given models (default all) and run each once, so nothing is allocated lazily later."""
+        for name in names or list(self._loaders):
+            model = self.get(name)
+            if name in self._warm or name not in self._warmups:
+                continue
+            start = time.perf_counter()
+            self._warmups[name](model)
+            self._warm.add(name)
+            self._stats[name]["warmup_seconds"] = round(time.perf_counter() - start, 3)
+
+    def report(self):
+        usage = memory_usage()
+        return {
+            "process": {
+                "pid": os.getpid(),
+                "rss_mb": round(usage["rss"] / 2**20, 1),
+                "uss_mb": round(usage["uss"] / 2**20, 1) if usage["uss"] is not None else None,
+                "shared_mb": round((usage["rss"] - usage["uss"]) / 2**20, 1) if usage["uss"] is not None else None,
+            },
+            "models": {name: {"loaded": name in self._models, **self._stats.get(name, {})} for name in self._loaders},
+        }
+
+
+registry = ModelRegistry()
+if STUB_MODELS:
+    registry.register("yolov3-spp", lambda: StubDetector("yolov3-spp", YOLO_NAMES))
+    registry.register("helmet", lambda: StubDetector("helmet", HELMET_NAMES, (HELMET_INPUT_SIZE, HELMET_INPUT_SIZE),
+                                                     HELMET_CONF_THRESHOLD))
+    registry.register("ocr", StubOCR)
+else:
+    registry.register("yolov3-spp", lambda: YoloDetector("yolov3-spp", YOLO_WEIGHTS, YOLO_CFG, YOLO_NAMES),
+                      YoloDetector.warmup)
+    registry.register("helmet", lambda: YoloDetector("helmet", HELMET_WEIGHTS, HELMET_CFG, HELMET_NAMES,
+                                                     input_size=(HELMET_INPUT_SIZE, HELMET_INPUT_SIZE),
+                                                     conf_threshold=HELMET_CONF_THRESHOLD),
+                      YoloDetector.warmup)
+    registry.register("ocr", load_ocr, warmup_ocr)
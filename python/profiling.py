@@ -0,0 +1,344 @@
+import asyncio
+import collections
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+# Profiling is opt-in per request: send "X-Profile: 1" (or "X-Profile: cpu" to also
+# sample the Python stack), or set PROFILE_SAMPLE_RATE to profile a fraction of requests.
+PROFILE_HEADER = b"x-profile"
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+CPU_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_CPU_INTERVAL", "0.005"))
+MAX_STORED_PROFILES = int(os.environ.get("PROFILE_MAX_STORED", "50"))
+
+_active_profile = contextvars.ContextVar("active_profile", default=None)
+_NO_SPAN = nullcontext()
+
+
+class RequestProfile:
+    """Span timeline (and optional CPU samples) recorded for a single request.
+
+    A request can fan out into worker threads and asyncio tasks, so every span is
+    recorded on a track (one per thread and task) and exported as its own stack.
+    Spans that start after finish() are dropped; spans still open then are cut off at
+    the end and marked unfinished. The CPU sampler follows the request thread plus any
+    thread that has a span of this profile open when it takes a sample.
+    """
+
+    def __init__(self, name, cpu=False, interval=CPU_SAMPLE_INTERVAL):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.cpu = cpu
+        self.interval = interval
+        self.events = []      # ("O"|"C", span name, microseconds since start, args, track)
+        self.samples = []     # (microseconds since start, stack tuple, outermost first, thread id)
+        self.tracks = {}      # (thread id, task id or None) -> track number, in first-seen order
+        self.track_names = []
+        self.thread_names = {threading.get_ident(): threading.current_thread().name}
+        self._t0 = time.perf_counter()
+        self._end = None
+        self._thread_id = threading.get_ident()
+        self._open = collections.Counter()    # thread id -> spans of this profile open on it
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._stop = threading.Event()
+
+    def _now(self):
+        return (time.perf_counter() - self._t0) * 1e6
+
+    def _track(self, thread):
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        key = (thread.ident, id(task) if task is not None else None)
+        if key not in self.tracks:
+            self.tracks[key] = len(self.track_names)
+            self.track_names.append(f"{thread.name} / {task.get_name()}" if task is not None else thread.name)
+            self.thread_names[thread.ident] = thread.name
+        return self.tracks[key]
+
+    @contextmanager
+    def span(self, name, **args):
+        thread = threading.current_thread()
+        with self._lock:
+            track = None
+            if self._end is None:
+                track = self._track(thread)
+                self._open[thread.ident] += 1
+                self.events.append(("O", name, self._now(), args, track))
+        try:
+            yield
+        finally:
+            if track is not None:
+                with self._lock:
+                    self._open[thread.ident] -= 1
+                    if self._end is None:
+                        self.events.append(("C", name, self._now(), args, track))
+
+    def start(self):
+        if self.cpu:
+            self._sampler = threading.Thread(name="profile-sampler", target=self._sample, daemon=True)
+            self._sampler.start()
+        return self
+
+    def finish(self):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        with self._lock:
+            self._end = self._now()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                threads = {self._thread_id, *(t for t, n in self._open.items() if n > 0)}
+            frames = sys._current_frames()
+            now = self._now()
+            for thread_id in threads:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.samples.append((now, tuple(reversed(stack)), thread_id))
+
+    def _end_time(self):
+        return self._end if self._end is not None else self._now()
+
+    def _track_events(self):
+        """Events per track, with spans still open at the end closed there."""
+        with self._lock:
+            events = list(self.events)
+        per_track = [[] for _ in self.track_names]
+        for event in events:
+            per_track[event[4]].append(event)
+        end = self._end_time()
+        for track_events in per_track:
+            open_spans = []
+            for kind, name, _, args, _ in list(track_events):
+                if kind == "O":
+                    open_spans.append((name, args))
+                else:
+                    open_spans.pop()
+            for name, args in reversed(open_spans):
+                track_events.append(("C", name, end, {**args, "unfinished": True}, None))
+        return per_track
+
+    def _thread_samples(self):
+        """CPU samples grouped by thread id, in the order the threads were first sampled."""
+        per_thread = {}
+        for ts, stack, thread_id in self.samples:
+            per_thread.setdefault(thread_id, []).append((ts, stack))
+        return per_thread
+
+    def spans(self):
+        """Completed spans as (name, start_us, duration_us, depth, args, track)."""
+        done = []
+        for track, track_events in enumerate(self._track_events()):
+            open_spans = []
+            for kind, name, ts, args, _ in track_events:
+                if kind == "O":
+                    open_spans.append((ts, args))
+                else:
+                    start, span_args = open_spans.pop()
+                    done.append((name, start, ts - start, len(open_spans), {**span_args, **args}, track))
+        return sorted(done, key=lambda s: s[1])
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "duration_ms": round(self._end_time() / 1000, 3),
+            "spans": [
+                {"name": name, "start_ms": round(start / 1000, 3), "duration_ms": round(dur / 1000, 3),
+                 "track": self.track_names[track], **args}
+                for name, start, dur, _, args, track in self.spans()
+            ],
+            "cpu_samples": len(self.samples),
+            "cpu_sampled_threads": [self.thread_names.get(t, str(t)) for t in self._thread_samples()],
+        }
+
+    def to_chrome_trace(self):
+        """Chrome trace event format, loadable in chrome://tracing or Perfetto.
+
+        Spans go on one row per track; CPU samples on one row per sampled thread below them.
+        """
+        pid = os.getpid()
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": self.name}}]
+        for track, track_name in enumerate(self.track_names):
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": track + 1,
+                           "args": {"name": f"spans: {track_name}"}})
+        for name, start, dur, _, args, track in self.spans():
+            events.append({"name": name, "ph": "X", "ts": start, "dur": dur, "pid": pid, "tid": track + 1,
+                           "args": args})
+        end = self._end_time()
+        for i, (thread_id, samples) in enumerate(self._thread_samples().items()):
+            tid = len(self.track_names) + 1 + i
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                           "args": {"name": f"cpu: {self.thread_names.get(thread_id, thread_id)}"}})
+            # Collapse consecutive samples sharing a frame at the same depth into one flame-chart slice
+            open_frames = []
+            for ts, stack in samples + [(end, ())]:
+                keep = 0
+                while keep < min(len(open_frames), len(stack)) and open_frames[keep][0] == stack[keep]:
+                    keep += 1
+                for frame_name, start in reversed(open_frames[keep:]):
+                    events.append({"name": frame_name, "ph": "X", "ts": start, "dur": ts - start, "pid": pid,
+                                   "tid": tid})
+                open_frames = open_frames[:keep] + [(frame_name, ts) for frame_name in stack[keep:]]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def to_speedscope(self):
+        """speedscope file format: one evented profile per span track, one sampled profile per CPU-sampled thread."""
+        frames, frame_index = [], {}
+
+        def frame_id(name):
+            if name not in frame_index:
+                frame_index[name] = len(frames)
+                frames.append({"name": name})
+            return frame_index[name]
+
+        end = self._end_time()
+        profiles = []
+        for track_name, track_events in zip(self.track_names, self._track_events()):
+            profiles.append({
+                "type": "evented",
+                "name": f"{self.name} spans: {track_name}",
+                "unit": "microseconds",
+                "startValue": 0,
+                "endValue": end,
+                "events": [{"type": kind, "frame": frame_id(name), "at": ts} for kind, name, ts, _, _ in track_events],
+            })
+        for thread_id, samples in self._thread_samples().items():
+            weights = [b[0] - a[0] for a, b in zip(samples, samples[1:] + [(end, ())])]
+            profiles.append({
+                "type": "sampled",
+                "name": f"{self.name} cpu: {self.thread_names.get(thread_id, thread_id)}",
+                "unit": "microseconds",
+                "startValue": samples[0][0],
+                "endValue": end,
+                "samples": [[frame_id(f) for f in stack] for _, stack in samples],
+                "weights": weights,
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+            "name": self.name,
+            "exporter": "urban-nav",
+        }
+
+
+class ProfileStore:
+    """Keeps the most recent finished profiles so they can be downloaded afterwards."""
+
+    def __init__(self, capacity=MAX_STORED_PROFILES):
+        self.capacity = capacity
+        self._profiles = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profile):
+        with self._lock:
+            self._profiles[profile.id] = profile
+            while len(self._profiles) > self.capacity:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id):
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self):
+        with self._lock:
+            return [p.summary() for p in reversed(self._profiles.values())]
+
+
+profiles = ProfileStore()
+
+
+def profile_mode(value):
+    """Return None, "spans" or "cpu" given the X-Profile header value and the sampling rate."""
+    value = (value or "").lower()
+    if value in ("cpu", "2"):
+        return "cpu"
+    if value in ("1", "true", "spans"):
+        return "spans"
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "spans"
+    return None
+
+
+def begin(name, mode):
+    """Start profiling the current context; returns a token for end()."""
+    profile = RequestProfile(name, cpu=(mode == "cpu")).start()
+    return profile, _active_profile.set(profile)
+
+
+def end(token):
+    profile, ctx_token = token
+    _active_profile.reset(ctx_token)
+    profile.finish()
+    profiles.add(profile)
+    return profile
+
+
+def span(name, **args):
+    """Time a block in the active request profile; a shared no-op when profiling is off."""
+    profile = _active_profile.get()
+    if profile is None:
+        return _NO_SPAN
+    return profile.span(name, **args)
+
+
+def export(profile, fmt):
+    if fmt == "speedscope":
+        return profile.to_speedscope()
+    if fmt == "chrome":
+        return profile.to_chrome_trace()
+    return profile.summary()
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles opted-in HTTP and WebSocket requests.
+
+    Requests without the header (and not picked by PROFILE_SAMPLE_RATE) are passed
+    straight through. Profiled HTTP responses carry an X-Profile-Id header; WebSocket
+    clients can also opt in with a ?profile=1 (or ?profile=cpu) query parameter.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+        value = None
+        for key, header in scope["headers"]:
+            if key == PROFILE_HEADER:
+                value = header.decode("latin-1")
+                break
+        if value is None and scope["type"] == "websocket" and b"profile=" in scope.get("query_string", b""):
+            value = scope["query_string"].decode().split("profile=", 1)[1].split("&", 1)[0]
+        mode = profile_mode(value)
+        if mode is None:
+            return await self.app(scope, receive, send)
+
+        token = begin(f"{scope.get('method', 'WS')} {scope['path']}", mode)
+        profile_id = token[0].id.encode()
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-id", profile_id)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            end(token)
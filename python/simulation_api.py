@@ -0,0 +1,118 @@
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Body
+from fastapi.responses import JSONResponse
+import asyncio
+from typing import Optional
+import simulation_stream
+from simulation_jobs import jobs as simulation_jobs, JobQueueFull, DONE, FINISHED, SIM_MAX_SIM_TIME
+
+router = APIRouter()
+
+# --- Endpoint: Run Traffic Simulation ---
+@router.get("/run-simulation")
+async def run_simulation(headless: bool = False, sim_time: int = 300, seed: Optional[int] = None,
+                         rate: float = simulation_stream.DEFAULT_RATE, speed: float = simulation_stream.DEFAULT_SPEED):
+    """Start a live run whose state is streamed on /ws/simulation/{run_id}, or with
+    headless=true run the simulation as a pooled job and return its summary.
+    DELETE /simulations/{run_id} stops a live run; one nobody watches stops by itself."""
+    if headless:
+        job = submit_simulation_job(sim_time, seed, None)
+        await asyncio.to_thread(job.done.wait)
+        if job.status != DONE:
+            raise HTTPException(500, job.error or f"Simulation {job.status}")
+        return JSONResponse(job.result, headers={"X-Simulation-Job": job.id})
+    if not 0 < sim_time <= SIM_MAX_SIM_TIME:
+        raise HTTPException(400, f"sim_time must be between 1 and {SIM_MAX_SIM_TIME}")
+    if not (0 < rate <= 60 and 0 < speed <= 100):
+        raise HTTPException(400, "rate must be in (0, 60] and speed in (0, 100]")
+    try:
+        run = simulation_stream.runs.start(sim_time=sim_time, seed=seed, rate=rate, speed=speed)
+    except simulation_stream.TooManyRuns as e:
+        raise HTTPException(429, str(e))
+    return JSONResponse({
+        "message": "Traffic simulation started",
+        "run_id": run.id,
+        "stream": f"/ws/simulation/{run.id}",
+    })
+
+@router.get("/simulations")
+async def list_simulations():
+    return {"runs": simulation_stream.runs.list()}
+
+@router.get("/simulations/{run_id}")
+async def get_simulation(run_id: str):
+    run = simulation_stream.runs.get(run_id)
+    if run is None:
+        raise HTTPException(404, "Simulation not found")
+    return run.status()
+
+@router.delete("/simulations/{run_id}")
+async def stop_simulation(run_id: str):
+    run = simulation_stream.runs.get(run_id)
+    if run is None:
+        raise HTTPException(404, "Simulation not found")
+    run.stop()
+    return run.status()
+
+# --- Simulation Jobs ---
+def submit_simulation_job(sim_time, seed, params):
+    try:
+        return simulation_jobs.submit(sim_time, seed, params)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except JobQueueFull as e:
+        raise HTTPException(429, str(e))
+
+def get_simulation_job(job_id):
+    job = simulation_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Simulation job not found")
+    return job
+
+@router.post("/simulation-jobs")
+async def create_simulation_job(sim_time: int = 300, seed: Optional[int] = None, params: Optional[dict] = Body(None)):
+    """Queue a headless run; params overrides simulation parameters, e.g. {"controller": "actuated"}."""
+    job = submit_simulation_job(sim_time, seed, params)
+    return JSONResponse(job.to_dict(), status_code=202)
+
+@router.get("/simulation-jobs")
+async def list_simulation_jobs():
+    return {"jobs": simulation_jobs.list()}
+
+@router.get("/simulation-jobs/{job_id}")
+async def get_simulation_job_status(job_id: str):
+    return get_simulation_job(job_id).to_dict()
+
+@router.get("/simulation-jobs/{job_id}/result")
+async def get_simulation_job_result(job_id: str):
+    job = get_simulation_job(job_id)
+    if job.status not in FINISHED:
+        raise HTTPException(409, f"Simulation job is {job.status}")
+    if job.result is None:
+        raise HTTPException(500, job.error or f"Simulation {job.status}")
+    return {"status": job.status, "result": job.result}
+
+@router.delete("/simulation-jobs/{job_id}")
+async def cancel_simulation_job(job_id: str):
+    get_simulation_job(job_id)
+    return simulation_jobs.cancel(job_id).to_dict()
+
+# --- WebSocket for Live Simulation State ---
+@router.websocket("/ws/simulation/{run_id}")
+async def websocket_simulation(websocket: WebSocket, run_id: str):
+    """Scene description as JSON, then binary state frames (see simulation_stream), then the summary."""
+    run = simulation_stream.runs.get(run_id)
+    if run is None:
+        await websocket.close(code=4404)
+        return
+    await websocket.accept()
+    viewer = run.join()
+    try:
+        await websocket.send_json({"scene": simulation_stream.scene_info(), "run": run.status()})
+        async for frame in run.frames(viewer):
+            await websocket.send_bytes(frame)
+        await websocket.send_json({"summary": run.result, "error": run.error})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        run.leave(viewer)
@@ -0,0 +1,326 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+
+# --- Configuration ---
+SIM_MAX_QUEUED = int(os.environ.get("SIM_MAX_QUEUED", "32"))           # jobs waiting for a worker
+SIM_JOB_TIMEOUT = float(os.environ.get("SIM_JOB_TIMEOUT", "120"))      # wall-clock seconds per run
+SIM_MAX_SIM_TIME = int(os.environ.get("SIM_MAX_SIM_TIME", "86400"))    # longest simulated duration accepted
+SIM_MEMORY_LIMIT_MB = int(os.environ.get("SIM_MEMORY_LIMIT_MB", "1024"))   # address space per worker, 0 = unlimited
+SIM_MAX_STORED_JOBS = int(os.environ.get("SIM_MAX_STORED_JOBS", "200"))
+KILL_GRACE = 5.0            # seconds past the timeout before an unresponsive worker is killed
+
+# Simulation parameters a job may override, with their accepted ranges; everything else
+# (tick rate, trace replay of server files, lane layout) stays at the module defaults
+SIGNAL_TIME_RANGE = (1, 600)        # seconds, for defaultRed/Yellow/Green/Minimum/Maximum
+DETECTION_TIME_RANGE = (1, 60)
+VEHICLE_INTERVAL_RANGE = (0.1, 3600.0)     # seconds between vehicles (uniform, and the default poisson rate)
+MAX_ARRIVAL_RATE = 10.0             # vehicles per second in an arrivalProfile segment
+MAX_PROFILE_SEGMENTS = 96
+ARRIVAL_MODES = ("uniform", "poisson")
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED, TIMED_OUT = "queued", "running", "done", "failed", "cancelled", "timeout"
+FINISHED = (DONE, FAILED, CANCELLED, TIMED_OUT)
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def _number(name, value, low, high, integer=False):
+    kinds = (int,) if integer else (int, float)
+    if isinstance(value, bool) or not isinstance(value, kinds) or not low <= value <= high:
+        raise ValueError(f"{name} must be {'an integer' if integer else 'a number'} between {low} and {high}")
+    return value
+
+
+def check_params(params):
+    """Raise ValueError unless params only overrides what a client may set, within range."""
+    from signal_controllers import CONTROLLERS
+    if not isinstance(params, dict):
+        raise ValueError("params must be an object")
+    for name, value in params.items():
+        if name == "controller":
+            if value not in CONTROLLERS:
+                raise ValueError(f"controller must be one of: {', '.join(CONTROLLERS)}")
+        elif name in ("defaultRed", "defaultYellow", "defaultGreen", "defaultMinimum", "defaultMaximum"):
+            _number(name, value, *SIGNAL_TIME_RANGE, integer=True)
+        elif name == "detectionTime":
+            _number(name, value, *DETECTION_TIME_RANGE, integer=True)
+        elif name == "vehicleInterval":
+            _number(name, value, *VEHICLE_INTERVAL_RANGE)
+        elif name == "arrivalMode":
+            if value not in ARRIVAL_MODES:
+                raise ValueError(f"arrivalMode must be one of: {', '.join(ARRIVAL_MODES)}")
+        elif name == "arrivalProfile":
+            if value is None:
+                continue
+            if not isinstance(value, list) or not 0 < len(value) <= MAX_PROFILE_SEGMENTS:
+                raise ValueError(f"arrivalProfile must be a list of 1 to {MAX_PROFILE_SEGMENTS} [startSecond, rate] pairs")
+            for segment in value:
+                if not isinstance(segment, list) or len(segment) != 2:
+                    raise ValueError("arrivalProfile entries must be [startSecond, vehiclesPerSecond]")
+                _number("arrivalProfile start", segment[0], 0, SIM_MAX_SIM_TIME)
+                _number("arrivalProfile rate", segment[1], 0, MAX_ARRIVAL_RATE)
+        else:
+            raise ValueError(f"Unknown or unsupported simulation parameter: {name}")
+
+
+def _worker_main(conn, memory_limit_mb):
+    """Worker process: imports the simulation once, then runs jobs sent over conn.
+
+    The run checks the pipe and its deadline once per simulated second, so cancel and
+    timeout are honoured without killing the (warm) process.
+    """
+    if memory_limit_mb:
+        try:
+            import resource
+            limit = memory_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError):
+            pass
+    from traffic_simulation import Simulation
+
+    while True:
+        message = conn.recv()
+        if message is None:
+            return
+        if message[0] != "run":
+            continue    # a cancel that arrived after its job had already finished
+        _, job_id, options, timeout = message
+        deadline = time.monotonic() + timeout
+        try:
+            sim = Simulation(seed=options.get("seed"), **options.get("params", {}))
+            end_tick = options["sim_time"] * sim.ticksPerSecond
+            outcome = None
+            while sim.tick < end_tick and outcome is None:
+                for _ in range(min(sim.ticksPerSecond, end_tick - sim.tick)):
+                    sim.step()
+                if time.monotonic() > deadline:
+                    outcome = TIMED_OUT
+                while conn.poll():
+                    if conn.recv() == ("cancel", job_id):
+                        outcome = CANCELLED
+                if sim.tick % (sim.ticksPerSecond * 10) == 0:
+                    conn.send(("progress", job_id, sim.tick // sim.ticksPerSecond))
+            sim.timeElapsed = sim.tick // sim.ticksPerSecond
+            conn.send((outcome or DONE, job_id, sim.summary()))
+        except MemoryError:
+            conn.send((FAILED, job_id, "simulation exceeded the worker memory limit"))
+        except Exception as e:
+            # the client only gets the error; the traceback goes to the server log
+            traceback.print_exc()
+            conn.send((FAILED, job_id, f"{type(e).__name__}: {e}"))
+
+
+class SimulationJob:
+    def __init__(self, options):
+        self.id = uuid.uuid4().hex
+        self.options = options
+        self.status = QUEUED
+        self.progress = 0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_requested = False
+        self.done = threading.Event()
+
+    def finish(self, status, result=None, error=None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished = time.time()
+        self.done.set()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "sim_time": self.options["sim_time"],
+            "seed": self.options.get("seed"),
+            "params": self.options.get("params", {}),
+            "progress": self.progress,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+        }
+
+
+class _WorkerSlot:
+    """One warm worker process plus the thread that feeds it jobs and restarts it if it dies."""
+
+    def __init__(self, manager, index):
+        self.manager = manager
+        self.name = f"sim-worker-{index}"
+        self.process = None
+        self.conn = None
+        self.send_lock = threading.Lock()
+        self.job = None
+        self.thread = threading.Thread(name=self.name, target=self._loop, daemon=True)
+
+    def _spawn(self):
+        ctx = multiprocessing.get_context("spawn")
+        parent, child = ctx.Pipe()
+        self.process = ctx.Process(name=self.name, target=_worker_main, args=(child, self.manager.memory_limit_mb),
+                                   daemon=True)
+        self.process.start()
+        child.close()
+        self.conn = parent
+
+    def _kill(self):
+        if self.process is not None and self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.process = None
+
+    def send(self, message):
+        with self.send_lock:
+            self.conn.send(message)
+
+    def _loop(self):
+        try:
+            self._spawn()
+        except Exception:
+            traceback.print_exc()   # retried when the first job arrives
+        while True:
+            job = self.manager._queue.get()
+            if job is None:
+                if self.process is not None:
+                    self.send(None)
+                    self.process.join(timeout=KILL_GRACE)
+                self._kill()
+                return
+            with self.manager._lock:
+                if job.cancel_requested:
+                    continue
+                self.job = job
+                job.status = RUNNING
+                job.started = time.time()
+            try:
+                if self.process is None or not self.process.is_alive():
+                    self._spawn()
+                self.send(("run", job.id, job.options, self.manager.timeout))
+                self._wait(job)
+            except Exception as e:
+                job.finish(FAILED, error=f"could not start a simulation worker: {e}")
+                self._kill()
+            finally:
+                self.job = None
+
+    def _wait(self, job):
+        hard_deadline = time.monotonic() + self.manager.timeout + KILL_GRACE
+        while True:
+            try:
+                ready = self.conn.poll(max(0.0, min(1.0, hard_deadline - time.monotonic())))
+                message = self.conn.recv() if ready else None
+            except (EOFError, OSError):
+                job.finish(FAILED, error="worker process exited")
+                self._kill()
+                return
+            if message is None:
+                if time.monotonic() >= hard_deadline:
+                    job.finish(TIMED_OUT, error="worker did not respond and was restarted")
+                    self._kill()
+                    return
+                continue
+            kind, job_id, payload = message
+            if job_id != job.id:
+                continue
+            if kind == "progress":
+                job.progress = payload
+            elif kind == FAILED:
+                job.finish(FAILED, error=payload)
+                return
+            else:
+                job.progress = payload["timeElapsed"]
+                job.finish(kind, result=payload)
+                return
+
+
+class SimulationJobManager:
+    """Bounded pool of warm simulation worker processes with a bounded job queue.
+
+    Jobs get an id and move queued -> running -> done | failed | cancelled | timeout.
+    Workers are started on first use and reused across jobs, so a run pays no Python
+    or NumPy startup; a worker that crashes or stops responding is replaced.
+    """
+
+    def __init__(self, workers=None, max_queued=SIM_MAX_QUEUED, timeout=SIM_JOB_TIMEOUT,
+                 memory_limit_mb=SIM_MEMORY_LIMIT_MB, max_stored=SIM_MAX_STORED_JOBS):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.max_stored = max_stored
+        self._queue = queue.Queue()
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._slots = []
+
+    def _start(self):
+        if not self._slots:
+            if self.workers is None:
+                # sized with the rest of this process's pools (SIM_WORKERS overrides it there)
+                from thread_plan import current_plan
+                self.workers = current_plan().sim_workers
+            self._slots = [_WorkerSlot(self, i) for i in range(self.workers)]
+            for slot in self._slots:
+                slot.thread.start()
+
+    def submit(self, sim_time, seed=None, params=None):
+        if not 0 < sim_time <= SIM_MAX_SIM_TIME:
+            raise ValueError(f"sim_time must be between 1 and {SIM_MAX_SIM_TIME}")
+        check_params(params or {})
+        job = SimulationJob({"sim_time": sim_time, "seed": seed, "params": params or {}})
+        with self._lock:
+            self._start()
+            queued = sum(1 for j in self._jobs.values() if j.status == QUEUED)
+            if queued >= self.max_queued:
+                raise JobQueueFull(f"{queued} simulation jobs are already queued")
+            self._jobs[job.id] = job
+            finished = [j for j in self._jobs.values() if j.status in FINISHED]
+            for old in finished[:max(0, len(finished) - self.max_stored)]:
+                del self._jobs[old.id]
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return [job.to_dict() for job in reversed(self._jobs.values())]
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns the job, or None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED:
+                return job
+            job.cancel_requested = True
+            if job.status == QUEUED:
+                job.finish(CANCELLED)
+                return job
+            slots = [slot for slot in self._slots if slot.job is job]
+        for slot in slots:
+            slot.send(("cancel", job.id))
+        return job
+
+    def shutdown(self):
+        for _ in self._slots:
+            self._queue.put(None)
+        for slot in self._slots:
+            slot.thread.join(timeout=KILL_GRACE * 2)
+        self._slots = []
+
+
+jobs = SimulationJobManager()
@@ -0,0 +1,308 @@
+import asyncio
+import os
+import struct
+import time
+import traceback
+import uuid
+import numpy as np
+from traffic_simulation import (Simulation, directionNumbers, vehicleTypes, noOfSignals, screenWidth,
+                                screenHeight, signalCoods, vehicleSizes, rotationAngle)
+
+# --- Configuration ---
+DEFAULT_RATE = 10           # state frames per second sent to viewers
+DEFAULT_SPEED = 1.0         # simulated seconds per real second
+VIEWER_QUEUE_FRAMES = 32    # frames buffered per viewer before it is resynced with a keyframe
+FINISHED_RUN_TTL = 60       # seconds a finished run stays joinable (viewers get its summary)
+IDLE_RUN_TTL = float(os.environ.get("SIM_IDLE_RUN_TTL", "30"))    # seconds a live run keeps stepping with no viewers
+TICKS_PER_SLICE = 30        # ticks stepped between yields to the event loop (a few ms)
+MAX_LIVE_RUNS = int(os.environ.get("SIM_MAX_LIVE_RUNS", "4"))   # live runs stepping at the same time
+
+# --- Wire format ---
+# Every binary message is one frame, little-endian:
+#   header  FRAME_HEADER: kind (0 keyframe, 1 delta), tick, currentGreen, currentYellow,
+#           remaining seconds of each signal's current colour (4 x int16),
+#           crossed vehicles per direction (4 x uint32), then the record counts
+#           removed, upserted, moved (3 x uint16)
+#   removed uint32 vehicle ids that left the scene
+#   upsert  UPSERT records: vehicles to create or overwrite (all vehicles in a keyframe)
+#   moved   MOVED records: position change in pixels since the previous frame, plus rotation
+# Positions are the top-left corner in pixels, rotation in degrees (0-90, turning vehicles).
+# A viewer applies deltas on top of the last frame it received; it is sent a fresh
+# keyframe when it joins or whenever it fell behind and frames were dropped.
+FRAME_HEADER = struct.Struct("<BIBB4h4I3H")
+UPSERT = np.dtype([("id", "<u4"), ("direction", "u1"), ("lane", "u1"), ("type", "u1"), ("angle", "u1"),
+                   ("x", "<i2"), ("y", "<i2")])
+MOVED = np.dtype([("id", "<u4"), ("dx", "i1"), ("dy", "i1"), ("angle", "u1")])
+KEYFRAME, DELTA = 0, 1
+
+
+def scene_info():
+    """Static description of the scene sent once as JSON so the client can render frames."""
+    return {
+        "width": screenWidth,
+        "height": screenHeight,
+        "directions": [directionNumbers[d] for d in range(noOfSignals)],
+        "vehicleTypes": [vehicleTypes[t] for t in range(len(vehicleTypes))],
+        # unrotated (width, height) of every vehicle image, by [direction][type]
+        "vehicleSizes": vehicleSizes[:, :, 0].astype(int).tolist(),
+        "signals": signalCoods,
+        "rotationStep": rotationAngle,
+        "format": {"header": FRAME_HEADER.format, "upsert": UPSERT.descr, "moved": MOVED.descr},
+    }
+
+
+class StateEncoder:
+    """Delta-encodes a Simulation's vehicles and signals against the last encoded frame.
+
+    Only vehicles whose rounded position or rotation changed are sent, as 7-byte
+    moves; vehicles that jumped too far for an int8 step are sent as upserts.
+    """
+
+    def __init__(self):
+        self.ids = np.zeros(0, np.uint32)
+        self.state = np.zeros(0, UPSERT)
+        self.header = None
+
+    def _header(self, sim):
+        timers = []
+        for i, signal in enumerate(sim.signals):
+            if i == sim.currentGreen:
+                timers.append(signal.yellow if sim.currentYellow else signal.green)
+            else:
+                timers.append(signal.red)
+        return (sim.tick, sim.currentGreen, sim.currentYellow, *timers, *sim.crossedCounts)
+
+    def encode(self, sim):
+        """Delta frame from the previous call to now; updates the baseline."""
+        v = sim.vehicles
+        current = np.zeros(len(v), UPSERT)
+        current["id"] = v.id
+        current["direction"] = v.direction_number
+        current["lane"] = v.lane
+        current["type"] = v.vehicleType
+        current["angle"] = v.rotateAngle
+        current["x"] = np.clip(np.round(v.x), -32768, 32767)
+        current["y"] = np.clip(np.round(v.y), -32768, 32767)
+
+        # ids only ever grow and vehicles stay in spawn order, so both id arrays are sorted
+        ids = current["id"]
+        removed = self.ids[~np.isin(self.ids, ids, assume_unique=True)]
+        known = np.isin(ids, self.ids, assume_unique=True)
+        previous = self.state[np.searchsorted(self.ids, ids[known])]
+        now = current[known]
+        dx = now["x"].astype(np.int32) - previous["x"]
+        dy = now["y"].astype(np.int32) - previous["y"]
+        changed = (dx != 0) | (dy != 0) | (now["angle"] != previous["angle"])
+        small = (np.abs(dx) < 128) & (np.abs(dy) < 128)
+
+        moved = np.zeros(int(np.count_nonzero(changed & small)), MOVED)
+        moved["id"] = now["id"][changed & small]
+        moved["dx"] = dx[changed & small]
+        moved["dy"] = dy[changed & small]
+        moved["angle"] = now["angle"][changed & small]
+        upserts = np.concatenate([current[~known], now[changed & ~small]])
+
+        self.ids, self.state = ids, current
+        self.header = self._header(sim)
+        return self._frame(DELTA, removed.astype("<u4"), upserts, moved)
+
+    def keyframe(self):
+        """Full state as of the last encode(), for viewers joining or resyncing."""
+        if self.header is None:
+            return None
+        return self._frame(KEYFRAME, np.zeros(0, "<u4"), self.state, np.zeros(0, MOVED))
+
+    def _frame(self, kind, removed, upserts, moved):
+        return b"".join((
+            FRAME_HEADER.pack(kind, *self.header, len(removed), len(upserts), len(moved)),
+            removed.tobytes(), upserts.tobytes(), moved.tobytes(),
+        ))
+
+
+class Viewer(asyncio.Queue):
+    """Frame queue of one connected client; stale means it must resync from a keyframe."""
+
+    def __init__(self):
+        super().__init__(VIEWER_QUEUE_FRAMES)
+        self.stale = True
+
+
+class SimulationRun:
+    """One simulation advancing in real time (times speed) and broadcasting its state.
+
+    Each frame is encoded once and the same bytes are queued to every viewer, so the
+    cost per extra viewer is one queue put. A viewer whose queue fills up is marked
+    stale; its backlog is dropped and it continues from a keyframe.
+    """
+
+    def __init__(self, sim_time=300, seed=None, rate=DEFAULT_RATE, speed=DEFAULT_SPEED, **params):
+        self.id = uuid.uuid4().hex
+        self.sim = Simulation(seed=seed, **params)
+        self.sim_time = sim_time
+        self.rate = rate
+        self.speed = speed
+        self.encoder = StateEncoder()
+        self.viewers = set()
+        self.result = None
+        self.finished_at = None
+        self.stopped = None
+        self.error = None
+        self.idle_since = time.monotonic()
+        self._wake = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def _run(self):
+        sim = self.sim
+        ticks_per_frame = max(1, round(sim.ticksPerSecond * self.speed / self.rate))
+        interval = ticks_per_frame / (sim.ticksPerSecond * self.speed)
+        end_tick = self.sim_time * sim.ticksPerSecond
+        next_frame = time.monotonic()
+        try:
+            while sim.tick < end_tick and self.stopped is None:
+                frame_end = min(sim.tick + ticks_per_frame, end_tick)
+                while sim.tick < frame_end and self.stopped is None:
+                    # a fast run steps hundreds of ticks per frame; yield between slices so
+                    # one run never holds the event loop for more than a few milliseconds
+                    for _ in range(min(TICKS_PER_SLICE, frame_end - sim.tick)):
+                        sim.step()
+                    if sim.tick < frame_end:
+                        self._check_idle()
+                        await asyncio.sleep(0)
+                self._publish(self.encoder.encode(sim))
+                next_frame += interval
+                await self._wait_until(next_frame)
+            sim.timeElapsed = sim.tick // sim.ticksPerSecond
+            self.result = sim.summary()
+        except Exception as e:
+            # the run ends here; viewers and status() report why instead of a missing summary
+            traceback.print_exc()
+            self.stopped = "error"
+            self.error = f"{type(e).__name__}: {e}"
+        finally:
+            self.finished_at = time.monotonic()
+            for viewer in self.viewers:
+                while viewer.full():
+                    viewer.get_nowait()
+                viewer.put_nowait(None)
+
+    def _check_idle(self):
+        if self.stopped is None and not self.viewers and time.monotonic() - self.idle_since > IDLE_RUN_TTL:
+            self.stopped = "no viewers"
+        return self.stopped
+
+    async def _wait_until(self, deadline):
+        """Sleep until the next frame is due, waking early to stop when asked to or when
+        nobody has watched for IDLE_RUN_TTL seconds."""
+        while self._check_idle() is None:
+            now = time.monotonic()
+            if now < deadline:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), min(deadline - now, 1.0))
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(0)
+                return
+
+    def _publish(self, frame):
+        for viewer in self.viewers:
+            if viewer.stale:
+                continue
+            try:
+                viewer.put_nowait(frame)
+            except asyncio.QueueFull:
+                viewer.stale = True
+
+    def stop(self, reason="stopped"):
+        """End the run after the current slice of ticks; viewers get the summary up to that point."""
+        if self.finished_at is None and self.stopped is None:
+            self.stopped = reason
+            self._wake.set()
+
+    def join(self):
+        viewer = Viewer()
+        if self.finished_at is not None:
+            viewer.put_nowait(None)
+        self.viewers.add(viewer)
+        return viewer
+
+    def leave(self, viewer):
+        self.viewers.discard(viewer)
+        if not self.viewers:
+            self.idle_since = time.monotonic()
+
+    async def frames(self, viewer):
+        """Frames for one viewer, starting with a keyframe; ends when the run finishes."""
+        while True:
+            if viewer.stale and self.finished_at is None:
+                while not viewer.empty():
+                    viewer.get_nowait()
+                viewer.stale = False
+                keyframe = self.encoder.keyframe()
+                if keyframe is not None:
+                    yield keyframe
+            frame = await viewer.get()
+            if frame is None:
+                return
+            if not viewer.stale:
+                yield frame
+
+    def status(self):
+        return {
+            "id": self.id,
+            "tick": self.sim.tick,
+            "timeElapsed": self.sim.tick // self.sim.ticksPerSecond,
+            "simTime": self.sim_time,
+            "rate": self.rate,
+            "speed": self.speed,
+            "viewers": len(self.viewers),
+            "finished": self.finished_at is not None,
+            "stopped": self.stopped,
+            "error": self.error,
+            "result": self.result,
+        }
+
+
+class TooManyRuns(Exception):
+    pass
+
+
+class RunRegistry:
+    """Streamed runs by id; finished runs are dropped FINISHED_RUN_TTL seconds after they end.
+
+    A live run nobody has watched for IDLE_RUN_TTL seconds stops itself, so abandoned
+    runs do not hold one of the MAX_LIVE_RUNS slots.
+    """
+
+    def __init__(self):
+        self._runs = {}
+
+    def start(self, **options):
+        self._expire()
+        live = sum(1 for run in self._runs.values() if run.finished_at is None)
+        if live >= MAX_LIVE_RUNS:
+            raise TooManyRuns(f"{live} live simulations are already running")
+        run = SimulationRun(**options).start()
+        self._runs[run.id] = run
+        return run
+
+    def get(self, run_id):
+        self._expire()
+        return self._runs.get(run_id)
+
+    def list(self):
+        self._expire()
+        return [run.status() for run in self._runs.values()]
+
+    def _expire(self):
+        now = time.monotonic()
+        for run_id, run in list(self._runs.items()):
+            if run.finished_at is not None and not run.viewers and now - run.finished_at > FINISHED_RUN_TTL:
+                del self._runs[run_id]
+
+
+runs = RunRegistry()
@@ -0,0 +1,178 @@
+# Parameter sweeps over the headless traffic simulation
+# Usage:
+#   python simulation_sweep.py sweep.json --workers 8 --csv results.csv
+#   python simulation_sweep.py -p defaultMinimum=5,10,15 -p carTime=1.5,2,2.5 --seeds 10
+#
+# A sweep spec is JSON:
+#   {"grid":   {"defaultMinimum": [5, 10, 15], "directionSplit": [[400,800,900,1000], [250,500,750,1000]]},
+#    "random": {"carTime": {"min": 1.5, "max": 3}, "detectionTime": [3, 5, 7]},
+#    "samples": 50,          # random draws per grid point (only when "random" is given)
+#    "searchSeed": 0,        # seed for the random draws
+#    "fixed":  {"vehicleInterval": 0.6},
+#    "seeds": 10,            # or an explicit list of seeds
+#    "duration": 300}
+# Every configuration runs once per seed in a process pool and the rows are averaged per configuration.
+
+import argparse
+import csv
+import itertools
+import json
+import math
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from thread_plan import cpu_info
+from traffic_simulation import PARAMETERS, Simulation, simTime
+
+# Columns of the result table, in order
+METRICS = ('throughput', 'meanWait', 'meanDelay', 'maxQueue', 'totalVehicles')
+
+def drawValue(rng, domain):
+    """One random value from a list of choices or a {"min", "max"} range (ints stay ints)."""
+    if isinstance(domain, dict):
+        low, high = domain['min'], domain['max']
+        if isinstance(low, int) and isinstance(high, int):
+            return rng.randint(low, high)
+        return rng.uniform(low, high)
+    return rng.choice(domain)
+
+def expandSpec(spec):
+    """List of parameter dicts: the grid product, each crossed with "samples" random draws."""
+    grid = spec.get('grid', {})
+    randomSpace = spec.get('random', {})
+    fixed = spec.get('fixed', {})
+    unknown = (set(grid) | set(randomSpace) | set(fixed)) - set(PARAMETERS)
+    if unknown:
+        raise ValueError("Unknown simulation parameters: " + ", ".join(sorted(unknown)))
+    rng = random.Random(spec.get('searchSeed', 0))
+    configs = []
+    for values in itertools.product(*grid.values()):
+        point = dict(fixed, **dict(zip(grid, values)))
+        if randomSpace:
+            for _ in range(spec.get('samples', 1)):
+                configs.append(dict(point, **{name: drawValue(rng, domain) for name, domain in randomSpace.items()}))
+        else:
+            configs.append(point)
+    return configs
+
+def seedList(spec):
+    seeds = spec.get('seeds', 1)
+    return list(seeds) if isinstance(seeds, list) else list(range(seeds))
+
+def runOne(task):
+    """Worker entry point: one seeded headless run of one configuration."""
+    index, params, seed, duration = task
+    result = Simulation(seed=seed, **params).run(duration)
+    return index, seed, {metric: result[metric] for metric in METRICS}
+
+def defaultWorkers():
+    """One process per logical CPU this process may use, capped by the cgroup CPU quota.
+
+    The simulation is pure Python, so unlike the service's BLAS-heavy pools it does gain
+    from SMT siblings; thread_plan's usable count (physical cores) would leave them idle.
+    """
+    info = cpu_info()
+    if info["quota"] is None:
+        return info["logical"]
+    return max(1, min(info["logical"], math.floor(info["quota"])))
+
+def runSweep(spec, workers=None, progress=None):
+    """Run every configuration of spec for every seed; returns one aggregated row per configuration.
+
+    Runs are independent, so they are spread over a process pool in chunks; results are
+    reproducible because each run only depends on its parameters and seed.
+    """
+    configs = expandSpec(spec)
+    seeds = seedList(spec)
+    duration = spec.get('duration', simTime)
+    tasks = [(i, params, seed, duration) for i, params in enumerate(configs) for seed in seeds]
+    workers = workers or defaultWorkers()
+    chunksize = max(1, len(tasks)//(workers*8))
+
+    runs = [[] for _ in configs]
+    if workers==1:
+        results = map(runOne, tasks)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(runOne, tasks, chunksize=chunksize)
+    try:
+        for done, (index, seed, metrics) in enumerate(results, 1):
+            runs[index].append(metrics)
+            if progress:
+                progress(done, len(tasks))
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+
+    rows = []
+    for params, metrics in zip(configs, runs):
+        row = dict(params)
+        row['runs'] = len(metrics)
+        row['throughput'] = sum(m['throughput'] for m in metrics)/len(metrics)
+        row['meanWait'] = sum(m['meanWait']*m['totalVehicles'] for m in metrics)/max(1, sum(m['totalVehicles'] for m in metrics))
+        row['meanDelay'] = sum(m['meanDelay'] for m in metrics)/len(metrics)
+        row['maxQueue'] = max(m['maxQueue'] for m in metrics)
+        row['totalVehicles'] = sum(m['totalVehicles'] for m in metrics)/len(metrics)
+        rows.append(row)
+    return rows
+
+def formatTable(rows, sortBy='throughput', limit=None):
+    reverse = sortBy in ('throughput', 'totalVehicles')   # higher is better; lower wait and queue are better
+    rows = sorted(rows, key=lambda r: r[sortBy], reverse=reverse)[:limit]
+    columns = [c for c in rows[0] if c not in METRICS and c!='runs'] + ['runs'] + list(METRICS) if rows else []
+    cells = [[c for c in columns]] + [[formatCell(r[c]) for c in columns] for r in rows]
+    widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+    return "\n".join("  ".join(cell.rjust(width) for cell, width in zip(line, widths)) for line in cells)
+
+def formatCell(value):
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return json.dumps(value) if isinstance(value, list) else str(value)
+
+def writeCsv(rows, path):
+    columns = list(rows[0]) if rows else []
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([formatCell(row[c]) for c in columns])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel parameter sweep over the headless traffic simulation")
+    parser.add_argument("spec", nargs="?", help="JSON sweep spec file")
+    parser.add_argument("-p", "--param", action="append", default=[], metavar="NAME=V1,V2,...",
+                        help="add a grid axis (values are parsed as JSON, e.g. carTime=1.5,2,2.5)")
+    parser.add_argument("--seeds", type=int, default=None, help="runs per configuration (seeds 0..N-1)")
+    parser.add_argument("--duration", type=int, default=None, help="simulated seconds per run")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: logical CPUs)")
+    parser.add_argument("--csv", default=None, help="also write the full table to this CSV file")
+    parser.add_argument("--sort", default="throughput", choices=METRICS, help="column to rank configurations by")
+    parser.add_argument("--top", type=int, default=20, help="rows to print")
+    args = parser.parse_args()
+
+    spec = {}
+    if args.spec:
+        with open(args.spec, 'r') as f:
+            spec = json.load(f)
+    for axis in args.param:
+        name, values = axis.split('=', 1)
+        spec.setdefault('grid', {})[name] = json.loads('[' + values + ']')
+    if args.seeds is not None:
+        spec['seeds'] = args.seeds
+    if args.duration is not None:
+        spec['duration'] = args.duration
+
+    def progress(done, total):
+        if done==total or done%max(1, total//100)==0:
+            sys.stderr.write(f"\r{done}/{total} runs")
+            sys.stderr.flush()
+
+    start = time.perf_counter()
+    rows = runSweep(spec, args.workers, progress)
+    sys.stderr.write(f"\n{sum(r['runs'] for r in rows)} runs in {time.perf_counter()-start:.1f}s\n")
+    if args.csv:
+        writeCsv(rows, args.csv)
+    print(formatTable(rows, args.sort, args.top))
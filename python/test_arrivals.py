@@ -0,0 +1,20 @@
+import pytest
+
+from traffic_simulation import Simulation
+
+TRACE = "ts,class,direction\n100,car,line\n101,bus,any\n"
+
+
+def test_a_trace_with_unmapped_directions_is_rejected(tmp_path):
+    path = tmp_path / "counts.csv"
+    path.write_text(TRACE)
+    with pytest.raises(ValueError, match="directionMap"):
+        Simulation(arrivalMode=str(path)).run(10)
+
+
+def test_direction_map_replays_the_trace(tmp_path):
+    path = tmp_path / "counts.csv"
+    path.write_text(TRACE)
+    sim = Simulation(arrivalMode={"type": "trace", "paths": str(path), "directionMap": {"line": "right", "any": "down"}})
+    sim.run(10)
+    assert sim.arrivalSource.replayed == 2 and sim.arrivalSource.skipped == 0
@@ -0,0 +1,67 @@
+import numpy as np
+from counting import CountingZones, VehicleCounter, VEHICLE_CLASSES
+
+CLASS_NAMES = list(VEHICLE_CLASSES)
+
+
+def drive(counter, path, cls="car"):
+    """Feed one vehicle through the counter, a frame per centroid in path."""
+    for cx, cy in path:
+        counter.update([[cx - 10, cy - 10, 20, 20, cx, cy]], [0.9], [CLASS_NAMES.index(cls)])
+
+
+def line(name, y, direction=None, **options):
+    return {"name": name, "type": "line", "points": [[0, y], [400, y]], "direction": direction, **options}
+
+
+def counter_for(zones):
+    return VehicleCounter(400, 400, 10, CLASS_NAMES, CountingZones(zones, 400, 400))
+
+
+def test_directional_line_counts_one_way_only():
+    down = counter_for([line("south", 100, "down")])
+    drive(down, [(50, y) for y in range(60, 150, 10)])
+    assert down.counts["car"] == 1
+    assert down.events[0]["zone"] == "south" and down.events[0]["direction"] == "down"
+
+    up = counter_for([line("south", 100, "down")])
+    drive(up, [(50, y) for y in range(150, 60, -10)])
+    assert up.counts["car"] == 0
+
+
+def test_class_filter():
+    counter = counter_for([line("buses", 100, classes=["bus"])])
+    drive(counter, [(50, y) for y in range(60, 150, 10)], "car")
+    drive(counter, [(300, y) for y in range(60, 150, 10)], "bus")
+    assert counter.counts["car"] == 0
+    assert counter.counts["bus"] == 1
+
+
+def test_after_counts_only_turning_tracks():
+    zones = [line("in", 100, "down"),
+             {"name": "out", "type": "line", "points": [[200, 0], [200, 400]], "direction": "right", "after": "in"}]
+    straight = counter_for(zones)
+    drive(straight, [(x, 250) for x in range(150, 260, 10)])
+    assert straight.zone_counts["out"]["car"] == 0
+
+    turning = counter_for(zones)
+    drive(turning, [(150, y) for y in range(60, 140, 10)] + [(x, 130) for x in range(160, 260, 10)])
+    assert [e["zone"] for e in turning.events] == ["in", "out"]
+
+
+def test_polygon_counts_entry():
+    box = {"name": "box", "type": "polygon", "points": [[100, 100], [300, 100], [300, 300], [100, 300]]}
+    zones = CountingZones([box], 400, 400)
+    hit = zones.crossings(np.array([[90., 200], [110, 200]]), np.array([[110., 200], [130, 200]]), np.array([0, 0]))
+    assert hit[:, 0].tolist() == [True, False]
+
+
+def test_stub_detector_car_crosses_the_default_line(monkeypatch):
+    import models
+    monkeypatch.setattr(models, "STUB_INFERENCE_MS", 0)
+    detector = models.StubDetector("yolov3-spp", models.YOLO_NAMES)
+    counter = VehicleCounter(1280, 720, 30, detector.classes)
+    frame = np.zeros((720, 1280, 3), np.uint8)
+    for _ in range(models.STUB_CROSSING_FRAMES):
+        counter.update(*detector.detect(frame))
+    assert counter.counts["car"] == 1
@@ -0,0 +1,31 @@
+from counts_store import CountsStore
+
+DAY = 86400 * 19000     # midnight UTC, so minute, hour and day buckets start here
+
+
+def rows(buckets):
+    return sorted((b["bucket"], b["class"], b["count"]) for b in buckets)
+
+
+def test_rollup_buckets(tmp_path):
+    store = CountsStore(str(tmp_path / "counts.db"))
+    store.add("cam", [{"time": 5, "class": "car"}, {"time": 30, "class": "car"}, {"time": 65, "class": "bus"},
+                      {"time": 3700, "class": "car"}], DAY)
+    store.add("other", [{"time": 10, "class": "truck"}], DAY)
+    store.close()
+
+    assert rows(store.rollup("cam", "minute")) == [(DAY, "car", 2), (DAY + 60, "bus", 1), (DAY + 3660, "car", 1)]
+    assert rows(store.rollup("cam", "hour")) == [(DAY, "bus", 1), (DAY, "car", 2), (DAY + 3600, "car", 1)]
+    assert rows(store.rollup("cam", "day")) == [(DAY, "bus", 1), (DAY, "car", 3)]
+    assert rows(store.rollup("cam", "minute", start=DAY + 60, end=DAY + 3600)) == [(DAY + 60, "bus", 1)]
+    assert store.cameras() == ["cam", "other"]
+    assert store.stats()["written"] == 5
+
+
+def test_rollup_by_direction(tmp_path):
+    store = CountsStore(str(tmp_path / "counts.db"))
+    store.add("cam", [{"time": 1, "class": "car", "direction": "down"}, {"time": 2, "class": "car", "direction": "up"},
+                      {"time": 3, "class": "car", "direction": "down"}], DAY)
+    store.close()
+    buckets = store.rollup("cam", "hour", by_direction=True)
+    assert sorted((b["direction"], b["count"]) for b in buckets) == [("down", 2), ("up", 1)]
@@ -0,0 +1,37 @@
+import threading
+
+from profiling import RequestProfile
+
+
+def in_thread(target):
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+
+
+def test_spans_from_other_threads_get_their_own_track():
+    profile = RequestProfile("GET /x").start()
+    with profile.span("request"):
+        def worker():
+            with profile.span("worker"):
+                pass
+        in_thread(worker)
+    profile.finish()
+    tracks = {span["name"]: span["track"] for span in profile.summary()["spans"]}
+    assert tracks["request"] != tracks["worker"]
+    evented = [p for p in profile.to_speedscope()["profiles"] if p["type"] == "evented"]
+    assert len(evented) == 2
+    assert all([e["type"] for e in p["events"]] == ["O", "C"] for p in evented)
+
+
+def test_spans_after_finish_are_dropped_and_open_ones_cut_off():
+    profile = RequestProfile("GET /x").start()
+    with profile.span("request"):
+        profile.finish()
+    def late():
+        with profile.span("late"):
+            pass
+    in_thread(late)
+    spans = profile.summary()["spans"]
+    assert [span["name"] for span in spans] == ["request"]
+    assert spans[0]["unfinished"]
@@ -0,0 +1,77 @@
+import asyncio
+import numpy as np
+from simulation_stream import SimulationRun, StateEncoder, FRAME_HEADER, UPSERT, MOVED, KEYFRAME, DELTA
+from traffic_simulation import Simulation
+
+
+def decode(frame, state):
+    """Apply one frame to state ({id: (x, y, angle)}) the way a viewer does; returns the header."""
+    header = FRAME_HEADER.unpack_from(frame)
+    kind = header[0]
+    n_removed, n_upsert, n_moved = header[-3:]
+    offset = FRAME_HEADER.size
+    removed = np.frombuffer(frame, "<u4", n_removed, offset)
+    offset += removed.nbytes
+    upserts = np.frombuffer(frame, UPSERT, n_upsert, offset)
+    offset += upserts.nbytes
+    moved = np.frombuffer(frame, MOVED, n_moved, offset)
+    assert offset + moved.nbytes == len(frame)
+    if kind == KEYFRAME:
+        state.clear()
+    for vid in removed.tolist():
+        del state[vid]
+    for r in upserts:
+        state[int(r["id"])] = (int(r["x"]), int(r["y"]), int(r["angle"]))
+    for r in moved:
+        x, y, _ = state[int(r["id"])]
+        state[int(r["id"])] = (x + int(r["dx"]), y + int(r["dy"]), int(r["angle"]))
+    return header
+
+
+def expected(sim):
+    v = sim.vehicles
+    return {int(i): (int(x), int(y), int(a)) for i, x, y, a in
+            zip(v.id, np.round(v.x), np.round(v.y), v.rotateAngle)}
+
+
+def test_deltas_reproduce_the_simulation_state():
+    sim = Simulation(seed=0)
+    encoder = StateEncoder()
+    state = {}
+    for frame in range(300):
+        for _ in range(3):
+            sim.step()
+        header = decode(encoder.encode(sim), state)
+        assert header[0] == DELTA and header[1] == sim.tick
+        assert state == expected(sim)
+    assert sum(header[8:12]) == sum(sim.crossedCounts)
+
+
+def test_keyframe_matches_the_deltas():
+    sim = Simulation(seed=1)
+    encoder = StateEncoder()
+    deltas = {}
+    for _ in range(100):
+        for _ in range(10):
+            sim.step()
+        decode(encoder.encode(sim), deltas)
+    joined = {}
+    assert decode(encoder.keyframe(), joined)[0] == KEYFRAME
+    assert joined == deltas == expected(sim)
+
+
+def test_a_failing_run_reports_its_error():
+    async def failing_run():
+        run = SimulationRun(sim_time=10, speed=100).start()
+        viewer = run.join()
+
+        def fail():
+            raise RuntimeError("boom")
+        run.sim.step = fail
+        frames = [frame async for frame in run.frames(viewer)]
+        return run, frames
+
+    run, frames = asyncio.run(failing_run())
+    status = run.status()
+    assert status["finished"] and status["stopped"] == "error"
+    assert status["error"] == "RuntimeError: boom" and status["result"] is None
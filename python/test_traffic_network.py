@@ -0,0 +1,23 @@
+import numpy as np
+
+from traffic_network import NetworkSimulation
+
+
+def test_vehicles_on_a_link_never_overlap():
+    # busy enough that straight-on and turning vehicles often enter a link in the same tick
+    sim = NetworkSimulation(seed=3, arrivalRate=0.4, turnRatio=0.6)
+    for _ in range(120*sim.ticksPerSecond):
+        sim.step()
+        v = sim.vehicles
+        order = np.lexsort((v.pos, v.link))
+        link, pos, length = v.link[order], v.pos[order], v.length[order]
+        sameLink = link[1:]==link[:-1]
+        assert not (sameLink & (pos[:-1] > pos[1:]-length[1:])).any()
+
+
+def test_green_wave_speeds_up_trips_along_the_wave():
+    # a one-row corridor, everyone straight on: only the offsets differ between the runs
+    def alongWave(offsets):
+        sim = NetworkSimulation(seed=0, rows=1, cols=6, turnRatio=0, offsets=offsets, waveDirection=0)
+        return sim.run(300)['meanTravelTimeByDirection'][0]
+    assert alongWave("greenWave") < 0.8*alongWave(None)
@@ -0,0 +1,17 @@
+from traffic_simulation import runHeadless, Simulation
+
+
+def test_same_seed_gives_the_same_run():
+    assert runHeadless(300, seed=0) == runHeadless(300, seed=0)
+
+
+def test_same_seed_gives_the_same_vehicle_state():
+    a, b = Simulation(seed=3, arrivalMode="poisson"), Simulation(seed=3, arrivalMode="poisson")
+    a.run(120)
+    b.run(120)
+    assert (a.vehicles.id == b.vehicles.id).all()
+    assert (a.vehicles.x == b.vehicles.x).all() and (a.vehicles.y == b.vehicles.y).all()
+
+
+def test_different_seeds_give_different_runs():
+    assert runHeadless(300, seed=0)["laneCounts"] != runHeadless(300, seed=1)["laneCounts"]
@@ -0,0 +1,251 @@
+# Thread and worker layout for the service, sized to the CPUs this process may use.
+#
+# Every worker process runs cv2.dnn and torch (EasyOCR) one after the other in the
+# request path, and each library would otherwise start a pool as large as the machine,
+# so N workers end up with N x cores threads fighting for cores. The plan splits the
+# usable cores into workers x threads and pins every pool to the worker's share:
+#
+#   usable cores   affinity mask, capped by the cgroup CPU quota (v2 cpu.max or v1
+#                  cpu.cfs_quota_us), counting one per physical core when SMT siblings
+#                  are visible
+#   threads        per worker, for cv2.setNumThreads and torch intra-op; min(4, cores)
+#   workers        web workers (gunicorn), cores // threads
+#   sim_workers    simulation job processes per web worker, threads // 2 (at least 1)
+#
+# Overrides (environment): WEB_CONCURRENCY, CV_THREADS, TORCH_THREADS,
+# TORCH_INTEROP_THREADS, SIM_WORKERS. python thread_plan.py --autotune measures
+# candidate layouts on a synthetic detection workload and saves the fastest to
+# THREAD_PLAN_FILE, which later startups use instead of the heuristic (set
+# THREAD_PLAN_AUTOTUNE=1 to tune at startup when no file exists yet).
+import json
+import math
+import multiprocessing
+import os
+import time
+
+# --- Configuration ---
+PLAN_FILE = os.environ.get("THREAD_PLAN_FILE", "thread_plan.json")
+AUTOTUNE = os.environ.get("THREAD_PLAN_AUTOTUNE", "0") == "1"
+AUTOTUNE_SECONDS = float(os.environ.get("THREAD_PLAN_AUTOTUNE_SECONDS", "5"))   # measured per candidate
+MAX_THREADS_PER_WORKER = 4      # beyond this a single detection gains little from more threads
+
+
+def cgroup_cpu_limit():
+    """CPU quota of this cgroup in cores (fractional), or None when unlimited."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def physical_cores(cpus):
+    """Distinct (package, core) pairs among the logical cpus, or None if the topology is hidden."""
+    cores = set()
+    for cpu in cpus:
+        base = f"/sys/devices/system/cpu/cpu{cpu}/topology/"
+        try:
+            with open(base + "physical_package_id") as f:
+                package = f.read().strip()
+            with open(base + "core_id") as f:
+                cores.add((package, f.read().strip()))
+        except OSError:
+            return None
+    return len(cores)
+
+
+def cpu_info():
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    physical = physical_cores(cpus)
+    quota = cgroup_cpu_limit()
+    usable = physical or len(cpus)
+    if quota is not None:
+        usable = min(usable, max(1, math.floor(quota)))
+    return {"logical": len(cpus), "physical": physical, "quota": quota, "usable": usable}
+
+
+class ThreadPlan:
+    def __init__(self, workers, threads, torch_threads=None, interop_threads=1, sim_workers=None, source="heuristic"):
+        self.workers = workers
+        self.threads = threads
+        self.torch_threads = torch_threads or threads
+        self.interop_threads = interop_threads
+        self.sim_workers = sim_workers or max(1, threads // 2)
+        self.source = source
+
+    def to_dict(self):
+        return {
+            "workers": self.workers,
+            "threads": self.threads,
+            "torch_threads": self.torch_threads,
+            "interop_threads": self.interop_threads,
+            "sim_workers": self.sim_workers,
+            "source": self.source,
+        }
+
+    def describe(self):
+        return (f"{self.workers} worker(s) x {self.threads} cv2 thread(s), torch {self.torch_threads} intra / "
+                f"{self.interop_threads} inter-op, {self.sim_workers} simulation worker(s) per worker ({self.source})")
+
+    def apply(self):
+        """Size this process's thread pools; call in every worker before the first inference."""
+        import cv2
+        cv2.setNumThreads(self.threads)
+        try:
+            import torch
+        except ImportError:
+            torch = None
+        if torch is not None:
+            torch.set_num_threads(self.torch_threads)
+            try:
+                torch.set_num_interop_threads(self.interop_threads)
+            except RuntimeError:
+                pass    # already set in this process (or inherited from a preloading master)
+
+
+def heuristic_plan(cores):
+    threads = min(MAX_THREADS_PER_WORKER, cores)
+    return ThreadPlan(max(1, cores // threads), threads)
+
+
+def load_plan(cores):
+    """The tuned plan from PLAN_FILE if there is one, otherwise the heuristic for cores."""
+    try:
+        with open(PLAN_FILE) as f:
+            saved = json.load(f)
+        if saved.get("cores") == cores:
+            return ThreadPlan(saved["workers"], saved["threads"], interop_threads=saved.get("interop_threads", 1),
+                              sim_workers=saved.get("sim_workers"), source=PLAN_FILE)
+    except (OSError, ValueError, KeyError):
+        pass
+    return heuristic_plan(cores)
+
+
+def with_overrides(plan):
+    env = {name: int(os.environ[name]) for name in
+           ("WEB_CONCURRENCY", "CV_THREADS", "TORCH_THREADS", "TORCH_INTEROP_THREADS", "SIM_WORKERS")
+           if os.environ.get(name)}
+    if not env:
+        return plan
+    threads = env.get("CV_THREADS", plan.threads)
+    return ThreadPlan(env.get("WEB_CONCURRENCY", plan.workers), threads,
+                      env.get("TORCH_THREADS", plan.torch_threads if "CV_THREADS" not in env else threads),
+                      env.get("TORCH_INTEROP_THREADS", plan.interop_threads),
+                      env.get("SIM_WORKERS", plan.sim_workers), plan.source + " + environment")
+
+
+# --- Auto-tune ---
+def _workload():
+    """One synthetic detection: yolov3-spp with untrained weights when cv2 can read darknet
+    configs, otherwise a blur/resize pipeline that exercises the same cv2 thread pool."""
+    import cv2
+    import numpy as np
+    from models import YOLO_CFG
+    img = np.random.default_rng(0).integers(0, 255, (720, 1280, 3), np.uint8)
+    if hasattr(cv2.dnn, "readNetFromDarknet"):
+        net = cv2.dnn.readNetFromDarknet(YOLO_CFG)
+        layers = net.getUnconnectedOutLayersNames()
+
+        def run():
+            net.setInput(cv2.dnn.blobFromImage(img, 0.00392, (416, 416), (0, 0, 0), True, crop=False))
+            net.forward(layers)
+        return run
+
+    def run():
+        small = cv2.resize(cv2.GaussianBlur(img, (31, 31), 0), (416, 416))
+        cv2.dnn.blobFromImage(small, 0.00392, (416, 416), (0, 0, 0), True, crop=False)
+    return run
+
+
+def _bench_worker(threads, seconds, start, conn):
+    import cv2
+    cv2.setNumThreads(threads)
+    run = _workload()
+    run()
+    start.wait()
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        t = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - t)
+    conn.send(latencies)
+
+
+def measure(workers, threads, seconds=AUTOTUNE_SECONDS):
+    """Requests per second and p99 latency of workers processes with threads cv2 threads each."""
+    ctx = multiprocessing.get_context("spawn")
+    start = ctx.Event()
+    pipes, procs = [], []
+    for _ in range(workers):
+        parent, child = ctx.Pipe(duplex=False)
+        proc = ctx.Process(target=_bench_worker, args=(threads, seconds, start, child), daemon=True)
+        proc.start()
+        pipes.append(parent)
+        procs.append(proc)
+    time.sleep(1.0)     # let every worker build its net before the clock starts
+    start.set()
+    latencies = sorted(l for parent in pipes for l in parent.recv())
+    for proc in procs:
+        proc.join()
+    return {
+        "workers": workers,
+        "threads": threads,
+        "throughput": round(len(latencies) / seconds, 2),
+        "p99_ms": round(1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 1) if latencies else None,
+    }
+
+
+def autotune(cores, seconds=AUTOTUNE_SECONDS):
+    """Measure every workers x threads split of cores, save the fastest to PLAN_FILE and return it."""
+    candidates = sorted({(cores // t, t) for t in range(1, cores + 1) if cores // t * t == cores})
+    results = []
+    for workers, threads in candidates:
+        result = measure(workers, threads, seconds)
+        print(f"  {workers:>3} x {threads:<3} {result['throughput']:>8} req/s   p99 {result['p99_ms']} ms")
+        results.append(result)
+    best = max(results, key=lambda r: (r["throughput"], -(r["p99_ms"] or 0)))
+    plan = ThreadPlan(best["workers"], best["threads"], source=PLAN_FILE)
+    with open(PLAN_FILE, "w") as f:
+        json.dump({"cores": cores, **plan.to_dict(), "measurements": results}, f, indent=2)
+    return plan
+
+
+_plan = None
+
+def current_plan():
+    """The plan for this machine, decided once per process and logged."""
+    global _plan
+    if _plan is None:
+        info = cpu_info()
+        plan = load_plan(info["usable"])
+        if AUTOTUNE and plan.source != PLAN_FILE:
+            print(f"Auto-tuning thread layout for {info['usable']} core(s)")
+            plan = autotune(info["usable"])
+        _plan = with_overrides(plan)
+        print(f"Thread plan for {info}: {_plan.describe()}")
+    return _plan
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Show or auto-tune the worker/thread layout")
+    parser.add_argument("--autotune", action="store_true", help=f"measure candidate layouts and save to {PLAN_FILE}")
+    parser.add_argument("--seconds", type=float, default=AUTOTUNE_SECONDS, help="measurement time per candidate")
+    args = parser.parse_args()
+    info = cpu_info()
+    print(json.dumps(info))
+    if args.autotune:
+        plan = autotune(info["usable"], args.seconds)
+    else:
+        plan = with_overrides(load_plan(info["usable"]))
+    print(plan.describe())
@@ -0,0 +1,337 @@
+# Multi-intersection (rows x cols grid) version of the traffic simulation
+# Usage:
+#   python traffic_network.py --rows 1 --cols 6 --offsets greenWave --sim-time 600 --seed 1
+#   python traffic_network.py --config network.json
+#
+# Junction (r, c) sits at (c*spacing, r*spacing). Every road segment is a directed link
+# ending at a junction: link j*4+d carries traffic heading direction d (0 right, 1 down,
+# 2 left, 3 up, as in traffic_simulation) into junction j. Links on the edge of the grid
+# are entry links; vehicles leaving the last junction on their route exit the network.
+import argparse
+import json
+import numpy as np
+
+from traffic_simulation import (vehicleTypes, speeds, vehicleSizes, alongX, gap, gap2,
+                                simTime, defaultYellow, noOfSignals)
+
+# --- Network defaults ---
+rows = 3
+cols = 3
+spacing = 300          # pixels between neighbouring junctions (also the length of entry links)
+stopOffset = 20        # stop line sits this far before the junction
+cycle = 60             # signal cycle in seconds, the same at every junction
+greenSplit = 0.5       # share of the green time (cycle minus two yellows) given to right/left traffic
+arrivalRate = 0.1      # mean vehicles per second entering on each entry link (Poisson)
+turnRatio = 0.3        # share of vehicles that turn once somewhere along their route
+ticksPerSecond = 30    # movement steps per simulated second
+
+# Overridable per network, e.g. NetworkSimulation(seed=1, rows=10, cols=10)
+NETWORK_PARAMETERS = ('rows', 'cols', 'spacing', 'stopOffset', 'cycle', 'greenSplit', 'arrivalRate',
+                      'turnRatio', 'ticksPerSecond', 'offsets', 'waveDirection', 'progressionSpeed')
+
+# (dr, dc) of the next junction in each travel direction
+STEP = np.array([(0, 1), (1, 0), (0, -1), (-1, 0)])
+
+# Vehicle length along its travel direction, by [direction, vehicle type]
+vehicleLengths = np.where(alongX[:, None], vehicleSizes[:, :, 0, 0], vehicleSizes[:, :, 0, 1])
+speedArray = np.array([speeds[vehicleTypes[t]] for t in range(len(vehicleTypes))])
+
+
+def greenWaveOffsets(rows, cols, spacing, direction, speed):
+    """Signal offsets (seconds) so a platoon heading direction at speed px/s meets green at every junction."""
+    r, c = np.divmod(np.arange(rows*cols), cols)
+    travelled = [c, r, cols-1-c, rows-1-r][direction] * spacing
+    return travelled/speed
+
+
+class LinkIndex:
+    """Vehicles ordered by (link, position), rebuilt once per tick.
+
+    A grid index with one bucket per link: the vehicle ahead of each vehicle, the
+    last vehicle on every link and per-link counts all come from one sort instead of
+    comparing vehicles pairwise, so a tick stays O(n log n) in the number of vehicles.
+    """
+
+    def __init__(self, link, pos, length, numLinks):
+        self.order = np.lexsort((pos, link))
+        sortedLink = link[self.order]
+        sameLinkNext = np.zeros(len(link), bool)
+        sameLinkNext[:-1] = sortedLink[1:]==sortedLink[:-1]
+        self.ahead = -np.ones(len(link), np.int64)
+        self.ahead[self.order[:-1][sameLinkNext[:-1]]] = self.order[1:][sameLinkNext[:-1]]
+        # rear of the last (lowest position) vehicle on every link, inf when the link is empty
+        self.tail = np.full(numLinks, np.inf)
+        firstOfLink = np.ones(len(link), bool)
+        firstOfLink[1:] = ~sameLinkNext[:-1]
+        last = self.order[firstOfLink]
+        self.tail[link[last]] = pos[last] - length[last]
+        self.count = np.bincount(link, minlength=numLinks)
+
+
+class NetworkVehicles:
+    """Struct-of-arrays state of the vehicles in a network, compacted as they exit."""
+
+    fields = {'id': np.int64, 'vehicleType': np.int8, 'link': np.int64, 'pos': float, 'speed': float,
+              'length': float, 'turnJunction': np.int64, 'turnTo': np.int8, 'spawnTick': np.int64,
+              'stoppedTicks': np.int64}
+
+    def __init__(self, capacity=1024):
+        self.n = 0
+        self.nextId = 0
+        for name, dtype in self.fields.items():
+            setattr(self, '_'+name, np.zeros(capacity, dtype))
+
+    def __len__(self):
+        return self.n
+
+    def __getattr__(self, name):
+        if name in NetworkVehicles.fields:
+            return self.__dict__['_'+name][:self.n]
+        raise AttributeError(name)
+
+    def add(self, values):
+        """Append len(values['link']) vehicles given as a dict of field arrays."""
+        count = len(values['link'])
+        while(self.n+count>len(self._id)):
+            for name in self.fields:
+                old = getattr(self, '_'+name)
+                grown = np.zeros(2*len(old), old.dtype)
+                grown[:self.n] = old[:self.n]
+                setattr(self, '_'+name, grown)
+        new = slice(self.n, self.n+count)
+        self._id[new] = np.arange(self.nextId, self.nextId+count)
+        for name, value in values.items():
+            getattr(self, '_'+name)[new] = value
+        self.nextId += count
+        self.n += count
+
+    def remove(self, gone):
+        keep = ~gone
+        n = int(np.count_nonzero(keep))
+        for name in self.fields:
+            array = getattr(self, '_'+name)
+            array[:n] = array[:self.n][keep]
+        self.n = n
+
+
+class NetworkSimulation:
+    """rows x cols grid of signalised junctions with routed vehicles.
+
+    Vehicles enter on the edge links, drive straight and turn at most once (at a
+    junction chosen at spawn), and pass from link to link until they leave the grid.
+    Each junction runs a two-phase fixed-time signal (right/left, then down/up) with
+    its own offset; offsets="greenWave" staggers them so a platoon travelling
+    waveDirection at progressionSpeed keeps meeting green. The wave is one-way: on a
+    two-way corridor the opposing direction meets the stagger backwards and waits
+    longer than with zero offsets, so the overall means can get worse even though
+    trips along waveDirection get faster (compare meanTravelTimeByDirection). Movement is car following
+    along links: a vehicle stops behind the one ahead, at a red stop line, or when the
+    link it is about to enter has no room.
+    """
+
+    def __init__(self, seed=None, **params):
+        defaults = dict(globals(), offsets=None, waveDirection=0, progressionSpeed=None)
+        for name in NETWORK_PARAMETERS:
+            setattr(self, name, params.pop(name, defaults[name]))
+        if params:
+            raise TypeError("Unknown network parameters: " + ", ".join(params))
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.numJunctions = self.rows*self.cols
+        self.numLinks = self.numJunctions*noOfSignals
+        self.stopLine = self.spacing - self.stopOffset
+
+        # neighbour[j, d]: junction reached from j heading d, -1 off the grid
+        r, c = np.divmod(np.arange(self.numJunctions), self.cols)
+        nr, nc = r[:, None] + STEP[:, 0], c[:, None] + STEP[:, 1]
+        inside = (nr>=0) & (nr<self.rows) & (nc>=0) & (nc<self.cols)
+        self.neighbour = np.where(inside, nr*self.cols + nc, -1)
+        # entry links: no junction upstream
+        upstream = self.neighbour[:, [2, 3, 0, 1]]
+        self.entryLinks = np.flatnonzero((upstream<0).ravel())
+        self.pending = np.zeros(len(self.entryLinks), np.int64)   # arrivals waiting for room to enter
+
+        # signal plan, in ticks
+        tps = self.ticksPerSecond
+        usable = self.cycle - 2*defaultYellow
+        self.greenEW = round(usable*self.greenSplit*tps)
+        self.yellowTicks = defaultYellow*tps
+        self.greenNS = round(usable*tps) - self.greenEW
+        self.cycleTicks = self.greenEW + self.greenNS + 2*self.yellowTicks
+        if(self.offsets=="greenWave"):
+            speed = self.progressionSpeed or speeds['car']*tps
+            offsets = greenWaveOffsets(self.rows, self.cols, self.spacing, self.waveDirection, speed)
+        elif(self.offsets is None):
+            offsets = np.zeros(self.numJunctions)
+        else:
+            offsets = np.asarray(self.offsets, float)
+        self.offsetTicks = np.round(offsets*tps).astype(np.int64)
+
+        self.vehicles = NetworkVehicles()
+        self.tick = 0
+        self.timeElapsed = 0
+        self.completed = 0
+        self.travelTicks = 0
+        self.completedByDirection = np.zeros(noOfSignals, np.int64)
+        self.travelTicksByDirection = np.zeros(noOfSignals, np.int64)
+        self.stoppedTicks = 0
+        self.maxQueue = 0
+        self.observers = []
+
+    # green[j, d]: whether traffic heading d may pass junction j this tick
+    def signalState(self):
+        phase = (self.tick - self.offsetTicks) % self.cycleTicks
+        ewGreen = phase < self.greenEW
+        nsGreen = (phase >= self.greenEW+self.yellowTicks) & (phase < self.greenEW+self.yellowTicks+self.greenNS)
+        return np.stack([ewGreen, nsGreen, ewGreen, nsGreen], axis=1)
+
+    # Poisson arrivals on every entry link; they enter once the start of the link is clear
+    def spawnVehicles(self, tail):
+        self.pending += self.rng.poisson(self.arrivalRate/self.ticksPerSecond, len(self.entryLinks))
+        ready = (self.pending>0) & (tail[self.entryLinks]>vehicleLengths.max()+gap)
+        links = self.entryLinks[ready]
+        count = len(links)
+        if(count==0):
+            return
+        self.pending[ready] -= 1
+        junction, direction = np.divmod(links, noOfSignals)
+        vehicleType = self.rng.integers(0, len(vehicleTypes), count)
+        length = vehicleLengths[direction, vehicleType]
+
+        # route: straight through, or one left/right turn at one of the junctions on the way
+        r, c = np.divmod(junction, self.cols)
+        junctionsAhead = np.where(alongX[direction], np.where(direction==0, self.cols-c, c+1),
+                                  np.where(direction==1, self.rows-r, r+1))
+        turns = self.rng.random(count) < self.turnRatio
+        k = (self.rng.random(count)*junctionsAhead).astype(np.int64)
+        turnJunction = np.where(turns, (r + STEP[direction, 0]*k)*self.cols + c + STEP[direction, 1]*k, -1)
+        turnTo = (direction + np.where(self.rng.random(count)<0.5, 1, 3)) % noOfSignals
+
+        self.vehicles.add({'vehicleType': vehicleType, 'link': links, 'pos': length, 'length': length,
+                           'speed': speedArray[vehicleType], 'turnJunction': turnJunction, 'turnTo': turnTo,
+                           'spawnTick': self.tick, 'stoppedTicks': 0})
+
+    # Advance the network by one tick
+    def step(self):
+        v = self.vehicles
+        index = LinkIndex(v.link, v.pos, v.length, self.numLinks)
+        if(len(v)):
+            self.moveVehicles(index)
+        # tails from before the move are safe for entry links: nothing drives onto them, vehicles only advance
+        self.spawnVehicles(index.tail)
+        self.tick += 1
+        if(self.tick%self.ticksPerSecond==0):
+            self.timeElapsed += 1
+        for observer in self.observers:
+            observer.update(self)
+
+    def moveVehicles(self, index):
+        v = self.vehicles
+        link, pos = v.link, v.pos
+        junction, direction = np.divmod(link, noOfSignals)
+        nextDirection = np.where(v.turnJunction==junction, v.turnTo, direction)
+        nextJunction = self.neighbour[junction, nextDirection]
+        nextLink = nextJunction*noOfSignals + nextDirection
+
+        # furthest the front may reach: behind the vehicle ahead, or behind the last vehicle on the next link
+        ahead = index.ahead
+        leaderRear = np.where(ahead>=0, pos[ahead] - v.length[ahead], np.inf)
+        room = np.where(nextJunction>=0, self.spacing + index.tail[np.maximum(nextLink, 0)], np.inf)
+        limit = np.where(ahead>=0, leaderRear, room) - gap2
+        green = self.signalState()[junction, direction]
+        limit = np.where(~green & (pos<=self.stopLine), np.minimum(limit, self.stopLine), limit)
+        newPos = np.minimum(pos + v.speed, np.maximum(pos, limit))
+        # a turn changes the vehicle's length along its travel direction
+        newLength = vehicleLengths[nextDirection, v.vehicleType]
+
+        # every vehicle entering a link this tick (straight on, or turning in from a cross
+        # street) was limited by that link's tail from before the move; let them in one at a
+        # time, furthest along first, each stopping behind the rear of the one before it
+        entering = np.flatnonzero((ahead<0) & (nextJunction>=0) & (newPos>=self.spacing))
+        if(len(entering)>1):
+            entering = entering[np.lexsort((-pos[entering], nextLink[entering]))]
+            target = nextLink[entering]
+            firstOfLink = np.ones(len(entering), bool)
+            firstOfLink[1:] = target[1:]!=target[:-1]
+            slot = np.arange(len(entering))
+            rank = slot - np.maximum.accumulate(np.where(firstOfLink, slot, 0))
+            for k in range(1, int(rank.max())+1):
+                later = slot[rank==k]
+                current, previous = entering[later], entering[later-1]
+                previousRear = newPos[previous] - newLength[previous] - gap2
+                newPos[current] = np.minimum(newPos[current], np.maximum(pos[current], previousRear))
+
+        stopped = newPos - pos < 0.1
+        v.stoppedTicks[stopped] += 1
+        queues = np.bincount(link[stopped], minlength=self.numLinks)
+        self.maxQueue = max(self.maxQueue, int(queues.max()))
+        pos[:] = newPos
+
+        # vehicles past the junction move on to their next link or leave the network
+        passed = pos>=self.spacing
+        exiting = passed & (nextJunction<0)
+        moving = passed & ~exiting
+        link[moving] = nextLink[moving]
+        pos[moving] -= self.spacing
+        v.length[moving] = newLength[moving]
+        if(exiting.any()):
+            self.completed += int(np.count_nonzero(exiting))
+            self.travelTicks += int((self.tick - v.spawnTick[exiting]).sum())
+            self.completedByDirection += np.bincount(nextDirection[exiting], minlength=noOfSignals)
+            self.travelTicksByDirection += np.bincount(nextDirection[exiting], self.tick - v.spawnTick[exiting],
+                                                       minlength=noOfSignals).astype(np.int64)
+            self.stoppedTicks += int(v.stoppedTicks[exiting].sum())
+            v.remove(exiting)
+
+    # Run for duration simulated seconds (simTime by default) and return the summary
+    def run(self, duration=None):
+        duration = simTime if duration is None else duration
+        while(self.tick<duration*self.ticksPerSecond):
+            self.step()
+        return self.summary()
+
+    def summary(self):
+        tps = self.ticksPerSecond
+        return {
+            'seed': self.seed,
+            'rows': self.rows,
+            'cols': self.cols,
+            'timeElapsed': self.timeElapsed,
+            'completedTrips': self.completed,
+            'vehiclesInNetwork': len(self.vehicles),
+            'waitingToEnter': int(self.pending.sum()),
+            'throughput': self.completed/self.timeElapsed if self.timeElapsed else 0.0,
+            'meanTravelTime': self.travelTicks/tps/self.completed if self.completed else 0.0,
+            # by the direction trips leave the network in, to see what offsets do for each way
+            'meanTravelTimeByDirection': [ticks/tps/n if n else 0.0 for ticks, n in
+                                          zip(self.travelTicksByDirection.tolist(), self.completedByDirection.tolist())],
+            # seconds spent standing still per completed trip
+            'meanStoppedTime': self.stoppedTicks/tps/self.completed if self.completed else 0.0,
+            'maxQueue': self.maxQueue,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grid network traffic simulation (headless)")
+    parser.add_argument("--config", default=None, help="JSON file of network parameters")
+    parser.add_argument("--rows", type=int, default=None)
+    parser.add_argument("--cols", type=int, default=None)
+    parser.add_argument("--spacing", type=float, default=None)
+    parser.add_argument("--arrival-rate", type=float, default=None, help="vehicles per second per entry link")
+    parser.add_argument("--offsets", choices=["none", "greenWave"], default=None)
+    parser.add_argument("--wave-direction", type=int, default=None, help="direction number the green wave follows")
+    parser.add_argument("--sim-time", type=int, default=simTime, help="simulated seconds to run")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    params = {}
+    if args.config:
+        with open(args.config, 'r') as f:
+            params = json.load(f)
+    for name, value in (('rows', args.rows), ('cols', args.cols), ('spacing', args.spacing),
+                        ('arrivalRate', args.arrival_rate), ('waveDirection', args.wave_direction)):
+        if value is not None:
+            params[name] = value
+    if args.offsets is not None:
+        params['offsets'] = None if args.offsets=="none" else args.offsets
+    print(json.dumps(NetworkSimulation(seed=args.seed, **params).run(args.sim_time)))
@@ -1,27 +1,15 @@
-# LAG
-# NO. OF VEHICLES IN SIGNAL CLASS
-# stops not used
-# DISTRIBUTION
-# BUS TOUCHING ON TURNS
-# Distribution using python class
-
-# *** IMAGE XY COOD IS TOP LEFT
+# Image x, y coordinates are the top-left corner
 import random
 import math
-import time
-import threading
-# from vehicle_detection import detection
-import pygame
+import struct
+import numpy as np
 import sys
 import os
-
-# options={
-#    'model':'./cfg/yolo.cfg',     #specifying the path of model
-#    'load':'./bin/yolov2.weights',   #weights
-#    'threshold':0.3     #minimum confidence factor to create a box, greater than 0.3 good
-# }
-
-# tfnet=TFNet(options)    #READ ABOUT TFNET
+import json
+import argparse
+from signal_controllers import CONTROLLERS, createController
+from arrivals import createArrivals
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")   # keep stdout clean for --headless JSON
 
 # Default values of signal times
 defaultRed = 150
@@ -30,14 +18,10 @@ defaultGreen = 20
 defaultMinimum = 10
 defaultMaximum = 60
 
-signals = []
 noOfSignals = 4
 simTime = 300       # change this to change time of simulation
-timeElapsed = 0
-
-currentGreen = 0   # Indicates which signal is green
-nextGreen = (currentGreen+1)%noOfSignals
-currentYellow = 0   # Indicates whether yellow signal is on or off 
+ticksPerSecond = 30 # vehicle movement steps per simulated second
+vehicleInterval = 0.75  # seconds between generated vehicles
 
 # Average times for vehicles to pass the intersection
 carTime = 2
@@ -46,37 +30,42 @@ rickshawTime = 2.25
 busTime = 2.5
 truckTime = 2.5
 
-# Count of cars at a traffic signal
-noOfCars = 0
-noOfBikes = 0
-noOfBuses =0
-noOfTrucks = 0
-noOfRickshaws = 0
 noOfLanes = 2
 
 # Red signal time at which cars will be detected at a signal
 detectionTime = 5
 
+# Where vehicles come from: "uniform", "poisson" or recorded trace files (see arrivals.py)
+arrivalMode = "uniform"
+arrivalProfile = None   # [[startSecond, vehiclesPerSecond], ...] for time-varying poisson arrivals
+
+# Signal controller deciding green times (see signal_controllers.py)
+controller = "density"
+
+# Cumulative share (out of 1000) of generated vehicles heading right, down, left, up
+directionSplit = [400,800,900,1000]
+
 speeds = {'car':2.25, 'bus':1.8, 'truck':1.8, 'rickshaw':2, 'bike':2.5}  # average speeds of vehicles
 
 # Coordinates of start
 x = {'right':[0,0,0], 'down':[755,727,697], 'left':[1400,1400,1400], 'up':[602,627,657]}    
 y = {'right':[348,370,398], 'down':[0,0,0], 'left':[498,466,436], 'up':[800,800,800]}
 
-vehicles = {'right': {0:[], 1:[], 2:[], 'crossed':0}, 'down': {0:[], 1:[], 2:[], 'crossed':0}, 'left': {0:[], 1:[], 2:[], 'crossed':0}, 'up': {0:[], 1:[], 2:[], 'crossed':0}}
 vehicleTypes = {0:'car', 1:'bus', 2:'truck', 3:'rickshaw', 4:'bike'}
 directionNumbers = {0:'right', 1:'down', 2:'left', 3:'up'}
 
+# Screensize; vehicles that have crossed and left this area are removed
+screenWidth = 1400
+screenHeight = 800
+
 # Coordinates of signal image, timer, and vehicle count
 signalCoods = [(530,230),(810,230),(810,570),(530,570)]
 signalTimerCoods = [(530,210),(810,210),(810,550),(530,550)]
 vehicleCountCoods = [(480,210),(880,210),(880,550),(480,550)]
-vehicleCountTexts = ["0", "0", "0", "0"]
 
 # Coordinates of stop lines
 stopLines = {'right': 590, 'down': 330, 'left': 800, 'up': 535}
 defaultStop = {'right': 580, 'down': 320, 'left': 810, 'up': 545}
-stops = {'right': [580,580,580], 'down': [320,320,320], 'left': [810,810,810], 'up': [545,545,545]}
 
 mid = {'right': {'x':705, 'y':445}, 'down': {'x':695, 'y':450}, 'left': {'x':695, 'y':425}, 'up': {'x':695, 'y':400}}
 rotationAngle = 3
@@ -85,8 +74,11 @@ rotationAngle = 3
 gap = 15    # stopping gap
 gap2 = 15   # moving gap
 
-pygame.init()
-simulation = pygame.sprite.Group()
+# Module defaults that a Simulation can override per run, e.g. Simulation(seed=1, carTime=3)
+PARAMETERS = ('defaultRed', 'defaultYellow', 'defaultGreen', 'defaultMinimum', 'defaultMaximum',
+              'simTime', 'ticksPerSecond', 'vehicleInterval', 'detectionTime', 'noOfLanes',
+              'carTime', 'bikeTime', 'rickshawTime', 'busTime', 'truckTime', 'directionSplit', 'controller',
+              'arrivalMode', 'arrivalProfile')
 
 class TrafficSignal:
     def __init__(self, red, yellow, green, minimum, maximum):
@@ -98,388 +90,533 @@ class TrafficSignal:
         self.signalText = "30"
         self.totalGreenTime = 0
         
-class Vehicle(pygame.sprite.Sprite):
-    def __init__(self, lane, vehicleClass, direction_number, direction, will_turn):
-        pygame.sprite.Sprite.__init__(self)
-        self.lane = lane
-        self.vehicleClass = vehicleClass
-        self.speed = speeds[vehicleClass]
-        self.direction_number = direction_number
-        self.direction = direction
-        self.x = x[direction][lane]
-        self.y = y[direction][lane]
-        self.crossed = 0
-        self.willTurn = will_turn
-        self.turned = 0
-        self.rotateAngle = 0
-        vehicles[direction][lane].append(self)
-        # self.stop = stops[direction][lane]
-        self.index = len(vehicles[direction][lane]) - 1
-        path = "images/" + direction + "/" + vehicleClass + ".png"
-        self.originalImage = pygame.image.load(path)
-        self.currentImage = pygame.image.load(path)
-
-    
-        if(direction=='right'):
-            if(len(vehicles[direction][lane])>1 and vehicles[direction][lane][self.index-1].crossed==0):    # if more than 1 vehicle in the lane of vehicle before it has crossed stop line
-                self.stop = vehicles[direction][lane][self.index-1].stop - vehicles[direction][lane][self.index-1].currentImage.get_rect().width - gap         # setting stop coordinate as: stop coordinate of next vehicle - width of next vehicle - gap
-            else:
-                self.stop = defaultStop[direction]
-            # Set new starting and stopping coordinate
-            temp = self.currentImage.get_rect().width + gap    
-            x[direction][lane] -= temp
-            stops[direction][lane] -= temp
-        elif(direction=='left'):
-            if(len(vehicles[direction][lane])>1 and vehicles[direction][lane][self.index-1].crossed==0):
-                self.stop = vehicles[direction][lane][self.index-1].stop + vehicles[direction][lane][self.index-1].currentImage.get_rect().width + gap
-            else:
-                self.stop = defaultStop[direction]
-            temp = self.currentImage.get_rect().width + gap
-            x[direction][lane] += temp
-            stops[direction][lane] += temp
-        elif(direction=='down'):
-            if(len(vehicles[direction][lane])>1 and vehicles[direction][lane][self.index-1].crossed==0):
-                self.stop = vehicles[direction][lane][self.index-1].stop - vehicles[direction][lane][self.index-1].currentImage.get_rect().height - gap
-            else:
-                self.stop = defaultStop[direction]
-            temp = self.currentImage.get_rect().height + gap
-            y[direction][lane] -= temp
-            stops[direction][lane] -= temp
-        elif(direction=='up'):
-            if(len(vehicles[direction][lane])>1 and vehicles[direction][lane][self.index-1].crossed==0):
-                self.stop = vehicles[direction][lane][self.index-1].stop + vehicles[direction][lane][self.index-1].currentImage.get_rect().height + gap
+# Pixel size of every vehicle image, read from the PNG header so headless runs need no pygame
+def imageSize(path):
+    with open(path, 'rb') as f:
+        header = f.read(24)
+    return struct.unpack(">II", header[16:24])
+
+# Bounding box of a w x h image rotated by angle degrees, as pygame.transform.rotate computes it
+def rotatedSize(w, h, angle):
+    if(angle%90==0):
+        return (w, h) if angle%180==0 else (h, w)
+    rad = math.radians(angle)
+    cx, cy, sx, sy = math.cos(rad)*w, math.cos(rad)*h, math.sin(rad)*w, math.sin(rad)*h
+    return (int(max(abs(cx+sy), abs(cx-sy), abs(-cx+sy), abs(-cx-sy))),
+            int(max(abs(sx+cy), abs(sx-cy), abs(-sx+cy), abs(-sx-cy))))
+
+# vehicleSizes[direction_number, vehicle_type, rotateAngle//rotationAngle] = (width, height)
+turnSteps = 90//rotationAngle + 1
+vehicleSizes = np.zeros((noOfSignals, len(vehicleTypes), turnSteps, 2))
+for d, direction in directionNumbers.items():
+    for t, vehicleClass in vehicleTypes.items():
+        w, h = imageSize("images/" + direction + "/" + vehicleClass + ".png")
+        for k in range(turnSteps):
+            vehicleSizes[d, t, k] = rotatedSize(w, h, -k*rotationAngle)
+
+# Per-direction constants, indexed by direction number
+moveSign = np.array([1, 1, -1, -1])                 # travel towards +x/+y (right, down) or -x/-y (left, up)
+alongX = np.array([True, False, True, False])       # right/left travel along x, down/up along y
+stopLineArray = np.array([stopLines[directionNumbers[d]] for d in range(noOfSignals)], float)
+midArray = np.array([mid[directionNumbers[d]]['x' if alongX[d] else 'y'] for d in range(noOfSignals)], float)
+turnStep = np.array([(2, 1.8), (-2.5, 2), (-1.8, -2.5), (1, -1)])   # (dx, dy) per tick while rotating
+
+class Vehicles:
+    """Struct-of-arrays state of every vehicle in a simulation, in spawn order.
+
+    Each vehicle keeps a link to its leader (the vehicle spawned before it in the same
+    lane, -1 for none), so a movement tick is a fixed number of array operations over
+    all vehicles instead of a Python branch tree per vehicle. Arrays grow by doubling.
+    """
+
+    fields = {'id': np.int64, 'direction_number': np.int8, 'lane': np.int8, 'vehicleType': np.int8,
+              'x': float, 'y': float, 'w': float, 'h': float, 'speed': float, 'stop': float,
+              'crossed': bool, 'willTurn': bool, 'turned': bool, 'rotateAngle': np.int16, 'leader': np.int64,
+              'spawnTick': np.int64,
+              # per-direction constants copied in at spawn so a tick needs no lookups; the signed
+              # ones are multiplied by sign, the way move() compares positions
+              'sign': float, 'onX': bool, 'forward': bool, 'signedStopLine': float, 'signedMidLine': float,
+              'signedSpeed': float, 'goesStraight': bool}
+
+    def __init__(self, capacity=256):
+        self.n = 0
+        self.nextId = 0
+        self.lastInLane = -np.ones((noOfSignals, 3), np.int64)
+        for name, dtype in self.fields.items():
+            setattr(self, '_'+name, np.zeros(capacity, dtype))
+
+    def __len__(self):
+        return self.n
+
+    def __getattr__(self, name):
+        # vehicles.x etc. are views of the live part of each array
+        if name in Vehicles.fields:
+            return self.__dict__['_'+name][:self.n]
+        raise AttributeError(name)
+
+    def add(self, direction_number, lane, vehicleType, will_turn, x, y, stop, tick=0):
+        if(self.n==len(self._id)):
+            for name in self.fields:
+                old = getattr(self, '_'+name)
+                grown = np.zeros(2*len(old), old.dtype)
+                grown[:self.n] = old[:self.n]
+                setattr(self, '_'+name, grown)
+        i = self.n
+        w, h = vehicleSizes[direction_number, vehicleType, 0]
+        sign = moveSign[direction_number]
+        values = {'id': self.nextId, 'direction_number': direction_number, 'lane': lane, 'vehicleType': vehicleType,
+                  'x': x, 'y': y, 'w': w, 'h': h, 'speed': speeds[vehicleTypes[vehicleType]], 'stop': stop,
+                  'crossed': False, 'willTurn': will_turn, 'turned': False, 'rotateAngle': 0,
+                  'leader': self.lastInLane[direction_number, lane], 'spawnTick': tick,
+                  'sign': sign, 'onX': alongX[direction_number], 'forward': sign>0,
+                  'signedStopLine': sign*stopLineArray[direction_number], 'signedMidLine': sign*midArray[direction_number],
+                  'signedSpeed': sign*speeds[vehicleTypes[vehicleType]], 'goesStraight': not will_turn}
+        for name, value in values.items():
+            getattr(self, '_'+name)[i] = value
+        self.lastInLane[direction_number, lane] = i
+        self.nextId += 1
+        self.n += 1
+        return i
+
+    def move(self, currentGreen, currentYellow):
+        """Move every vehicle by one tick; returns the indices of vehicles that crossed
+        their stop line during this tick.
+
+        Leader positions are taken from the start of the tick, so a queue that starts
+        moving ripples back one vehicle per tick. Positions along the direction of travel
+        are compared multiplied by sign, so every test reads "ahead of" whichever way the
+        vehicle drives.
+        """
+        n = self.n
+        if(n==0):
+            return np.zeros(0, np.int64)
+        # the live views are taken directly: this runs every tick, and __getattr__ is slow
+        x, y, w, h = self._x[:n], self._y[:n], self._w[:n], self._h[:n]
+        crossed, turned = self._crossed[:n], self._turned[:n]
+        sign, onX = self._sign[:n], self._onX[:n]
+        leader = self._leader[:n]
+        first = leader<0    # leader -1 indexes the last vehicle; first masks those values out
+
+        along = np.where(onX, x, y)
+        far = along + np.where(onX, w, h)
+        forward = self._forward[:n]
+        front = sign*np.where(forward, far, along)
+        rear = sign*np.where(forward, along, far)
+
+        # if the image has crossed stop line now
+        newlyCrossed = (front>self._signedStopLine[:n]) & ~crossed
+        crossed |= newlyCrossed
+
+        # (if the image has not reached its stop coordinate or has crossed stop line or has green signal) and
+        # (it is either the first vehicle in that lane or it is has enough gap to the next vehicle in that lane)
+        straight = self._goesStraight[:n] | ~crossed | (front<self._signedMidLine[:n])
+        canGo = (front<=sign*self._stop[:n]) | crossed
+        if(currentYellow==0):
+            canGo |= self._direction_number[:n]==currentGreen
+        hasGap = first | (rear[leader]-front>gap2) | turned[leader]
+        go = straight & canGo & hasGap
+
+        # turning vehicles past the middle of the intersection rotate, then drive off sideways
+        turning = (~straight).nonzero()[0].tolist()
+        if(turning):
+            # only a handful at a time, so they are handled one by one; leaders are read
+            # before anything moves this tick
+            driving = []
+            for i in turning:
+                if(turned.item(i)):
+                    L = leader.item(i)
+                    driving.append((i, L, x.item(L), y.item(L), w.item(L), h.item(L)))
+
+        step = self._signedSpeed[:n]*go
+        np.add(x, step, out=x, where=onX)
+        np.add(y, step, out=y, where=~onX)
+        if(turning):
+            self.turn([i for i in turning if not turned.item(i)], driving)
+        return newlyCrossed.nonzero()[0]
+
+    def turn(self, rotating, driving):
+        """Rotate the vehicles in rotating one step, and drive the turned ones in driving
+        ((index, leader, leader x, y, w, h) each) sideways when the leader leaves room."""
+        d, x, y, w, h = self._direction_number, self._x, self._y, self._w, self._h
+        for i in rotating:
+            di = d.item(i)
+            angle = self._rotateAngle.item(i) + rotationAngle
+            self._rotateAngle[i] = angle
+            x[i] += turnStep[di, 0]
+            y[i] += turnStep[di, 1]
+            w[i], h[i] = vehicleSizes[di, self._vehicleType.item(i), angle//rotationAngle]
+            self._turned[i] = angle==90
+        for i, L, lx, ly, lw, lh in driving:
+            di, xi, yi, wi, hi, speed = d.item(i), x.item(i), y.item(i), w.item(i), h.item(i), self._speed.item(i)
+            first = L<0
+            if(di==0 and (first or yi+hi<ly-gap2 or xi+wi<lx-gap2)):
+                y[i] = yi + speed
+            elif(di==1 and (first or xi>lx+lw+gap2 or yi<ly-gap2)):
+                x[i] = xi - speed
+            elif(di==2 and (first or yi>ly+lh+gap2 or xi>lx+gap2)):
+                y[i] = yi - speed
+            elif(di==3 and (first or xi<lx-lw-gap2 or yi>ly+gap2)):
+                x[i] = xi + speed
+
+    def despawn(self):
+        """Remove vehicles that have crossed and driven off screen; returns how many.
+
+        Arrays are compacted in place. Leader links that pointed at a removed vehicle
+        move to the nearest remaining vehicle ahead in the lane (or -1).
+        """
+        x, y = self.x, self.y
+        gone = self.crossed & ((x>screenWidth) | (x+self.w<0) | (y>screenHeight) | (y+self.h<0))
+        removed = int(np.count_nonzero(gone))
+        if(removed==0):
+            return 0
+        keep = ~gone
+        leader = self.leader.copy()
+        while(True):
+            dangling = np.flatnonzero((leader>=0) & gone[np.maximum(leader, 0)])
+            if(len(dangling)==0):
+                break
+            leader[dangling] = leader[leader[dangling]]
+        last = self.lastInLane
+        lastGone = (last>=0) & gone[np.maximum(last, 0)]
+        last[lastGone] = leader[last[lastGone]]
+
+        newIndex = np.cumsum(keep) - 1
+        remap = lambda links: np.where(links>=0, newIndex[np.maximum(links, 0)], -1)
+        self.lastInLane = remap(last)
+        leader = remap(leader)[keep]
+        n = self.n - removed
+        for name in self.fields:
+            array = getattr(self, '_'+name)
+            array[:n] = array[:self.n][keep]
+        self._leader[:n] = leader
+        self.n = n
+        return removed
+
+class Simulation:
+    """One intersection run: signal state machine, vehicle generation and movement.
+
+    Everything advances from step(), one tick (1/ticksPerSecond simulated seconds) at a
+    time, on the calling thread. Random choices come from a private random.Random, so
+    two runs with the same seed and parameters produce identical results. Observers
+    (e.g. Renderer) are called with the simulation after every tick.
+    """
+
+    def __init__(self, seed=None, verbose=False, **params):
+        for name in PARAMETERS:
+            setattr(self, name, params.pop(name, globals()[name]))
+        if params:
+            raise TypeError("Unknown simulation parameters: " + ", ".join(params))
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.verbose = verbose
+        self.observers = []
+        self.vehicles = Vehicles()
+        self.crossedCounts = [0]*noOfSignals    # vehicles that crossed the stop line, per direction
+        # vehicles that have not crossed yet, by [direction_number, lane, vehicle_type]; updated on spawn and crossing
+        self.waiting = np.zeros((noOfSignals, 3, len(vehicleTypes)), np.int64)
+        self.arrivals = [0]*noOfSignals         # vehicles generated so far, per direction
+        self.lastCrossing = [-math.inf]*noOfSignals    # tick of the latest stop-line crossing, per direction
+        self.signalController = createController(self.controller)
+        self.arrivalSource = createArrivals(self.arrivalMode, self, directionNumbers, vehicleTypes)
+        self.currentGreen = 0   # Indicates which signal is green
+        self.nextGreen = (self.currentGreen+1)%noOfSignals
+        self.currentYellow = 0   # Indicates whether yellow signal is on or off 
+        self.timeElapsed = 0
+        self.tick = 0
+        self.nextVehicle = 0.0
+        self.waitTicks = 0      # spawn-to-crossing ticks summed over crossed vehicles
+        self.maxQueue = 0       # most uncrossed vehicles seen in one direction
+        self.initialize()
+
+    # Initialization of signals with default values
+    def initialize(self):
+        ts1 = TrafficSignal(0, self.defaultYellow, self.defaultGreen, self.defaultMinimum, self.defaultMaximum)
+        ts2 = TrafficSignal(ts1.red+ts1.yellow+ts1.green, self.defaultYellow, self.defaultGreen, self.defaultMinimum, self.defaultMaximum)
+        ts3 = TrafficSignal(self.defaultRed, self.defaultYellow, self.defaultGreen, self.defaultMinimum, self.defaultMaximum)
+        ts4 = TrafficSignal(self.defaultRed, self.defaultYellow, self.defaultGreen, self.defaultMinimum, self.defaultMaximum)
+        self.signals = [ts1, ts2, ts3, ts4]
+
+    # Vehicles that have not crossed yet, per direction
+    def queueLengths(self):
+        return self.waiting.sum(axis=(1, 2))
+
+    # Ask the signal controller which approach goes next and for how long
+    def setTime(self):
+        direction = self.signalController.nextDirection(self)
+        if(direction!=self.nextGreen):
+            self.signals[direction].red = self.signals[self.nextGreen].red
+            self.nextGreen = direction
+        greenTime = self.signalController.greenTime(self, self.nextGreen)
+        if(self.verbose):
+            print('Green Time: ',greenTime)
+        if(greenTime<self.defaultMinimum):
+            greenTime = self.defaultMinimum
+        elif(greenTime>self.defaultMaximum):
+            greenTime = self.defaultMaximum
+        self.signals[self.nextGreen].green = greenTime
+
+    # Advance the signals by one second
+    def signalTick(self):
+        signals = self.signals
+        if(self.currentYellow==0 and signals[self.currentGreen].green==1 and self.signalController.extendGreen(self)):
+            signals[self.currentGreen].green += 1
+            signals[self.nextGreen].red += 1
+        if(self.currentYellow==0 and signals[self.currentGreen].green==0):
+            self.currentYellow = 1   # set yellow signal on
+            # reset stop coordinates of lanes and vehicles 
+            direction = directionNumbers[self.currentGreen]
+            self.vehicles.stop[self.vehicles.direction_number==self.currentGreen] = defaultStop[direction]
+        elif(self.currentYellow==1 and signals[self.currentGreen].yellow==0):
+            self.currentYellow = 0   # set yellow signal off
+            # reset all signal times of current signal to default times
+            signals[self.currentGreen].green = self.defaultGreen
+            signals[self.currentGreen].yellow = self.defaultYellow
+            signals[self.currentGreen].red = self.defaultRed
+            self.currentGreen = self.nextGreen # set next signal as green signal
+            self.nextGreen = (self.currentGreen+1)%noOfSignals    # set next green signal
+            signals[self.nextGreen].red = signals[self.currentGreen].yellow+signals[self.currentGreen].green    # set the red time of next to next signal as (yellow time + green time) of next signal
+        self.updateValues()
+        if(self.currentYellow==0 and signals[self.nextGreen].red==self.detectionTime):    # set time of next green signal 
+            self.setTime()
+        if(self.verbose):
+            self.printStatus()
+
+    # Update values of the signal timers after every second
+    def updateValues(self):
+        for i in range(0, noOfSignals):
+            if(i==self.currentGreen):
+                if(self.currentYellow==0):
+                    self.signals[i].green-=1
+                    self.signals[i].totalGreenTime+=1
+                else:
+                    self.signals[i].yellow-=1
             else:
-                self.stop = defaultStop[direction]
-            temp = self.currentImage.get_rect().height + gap
-            y[direction][lane] += temp
-            stops[direction][lane] += temp
-        simulation.add(self)
-
-    def render(self, screen):
-        screen.blit(self.currentImage, (self.x, self.y))
-
-    def move(self):
-        if(self.direction=='right'):
-            if(self.crossed==0 and self.x+self.currentImage.get_rect().width>stopLines[self.direction]):   # if the image has crossed stop line now
-                self.crossed = 1
-                vehicles[self.direction]['crossed'] += 1
-            if(self.willTurn==1):
-                if(self.crossed==0 or self.x+self.currentImage.get_rect().width<mid[self.direction]['x']):
-                    if((self.x+self.currentImage.get_rect().width<=self.stop or (currentGreen==0 and currentYellow==0) or self.crossed==1) and (self.index==0 or self.x+self.currentImage.get_rect().width<(vehicles[self.direction][self.lane][self.index-1].x - gap2) or vehicles[self.direction][self.lane][self.index-1].turned==1)):                
-                        self.x += self.speed
-                else:   
-                    if(self.turned==0):
-                        self.rotateAngle += rotationAngle
-                        self.currentImage = pygame.transform.rotate(self.originalImage, -self.rotateAngle)
-                        self.x += 2
-                        self.y += 1.8
-                        if(self.rotateAngle==90):
-                            self.turned = 1
-                            # path = "images/" + directionNumbers[((self.direction_number+1)%noOfSignals)] + "/" + self.vehicleClass + ".png"
-                            # self.x = mid[self.direction]['x']
-                            # self.y = mid[self.direction]['y']
-                            # self.image = pygame.image.load(path)
-                    else:
-                        if(self.index==0 or self.y+self.currentImage.get_rect().height<(vehicles[self.direction][self.lane][self.index-1].y - gap2) or self.x+self.currentImage.get_rect().width<(vehicles[self.direction][self.lane][self.index-1].x - gap2)):
-                            self.y += self.speed
-            else: 
-                if((self.x+self.currentImage.get_rect().width<=self.stop or self.crossed == 1 or (currentGreen==0 and currentYellow==0)) and (self.index==0 or self.x+self.currentImage.get_rect().width<(vehicles[self.direction][self.lane][self.index-1].x - gap2) or (vehicles[self.direction][self.lane][self.index-1].turned==1))):                
-                # (if the image has not reached its stop coordinate or has crossed stop line or has green signal) and (it is either the first vehicle in that lane or it is has enough gap to the next vehicle in that lane)
-                    self.x += self.speed  # move the vehicle
-
-
-
-        elif(self.direction=='down'):
-            if(self.crossed==0 and self.y+self.currentImage.get_rect().height>stopLines[self.direction]):
-                self.crossed = 1
-                vehicles[self.direction]['crossed'] += 1
-            if(self.willTurn==1):
-                if(self.crossed==0 or self.y+self.currentImage.get_rect().height<mid[self.direction]['y']):
-                    if((self.y+self.currentImage.get_rect().height<=self.stop or (currentGreen==1 and currentYellow==0) or self.crossed==1) and (self.index==0 or self.y+self.currentImage.get_rect().height<(vehicles[self.direction][self.lane][self.index-1].y - gap2) or vehicles[self.direction][self.lane][self.index-1].turned==1)):                
-                        self.y += self.speed
-                else:   
-                    if(self.turned==0):
-                        self.rotateAngle += rotationAngle
-                        self.currentImage = pygame.transform.rotate(self.originalImage, -self.rotateAngle)
-                        self.x -= 2.5
-                        self.y += 2
-                        if(self.rotateAngle==90):
-                            self.turned = 1
-                    else:
-                        if(self.index==0 or self.x>(vehicles[self.direction][self.lane][self.index-1].x + vehicles[self.direction][self.lane][self.index-1].currentImage.get_rect().width + gap2) or self.y<(vehicles[self.direction][self.lane][self.index-1].y - gap2)):
-                            self.x -= self.speed
-            else: 
-                if((self.y+self.currentImage.get_rect().height<=self.stop or self.crossed == 1 or (currentGreen==1 and currentYellow==0)) and (self.index==0 or self.y+self.currentImage.get_rect().height<(vehicles[self.direction][self.lane][self.index-1].y - gap2) or (vehicles[self.direction][self.lane][self.index-1].turned==1))):                
-                    self.y += self.speed
-            
-        elif(self.direction=='left'):
-            if(self.crossed==0 and self.x<stopLines[self.direction]):
-                self.crossed = 1
-                vehicles[self.direction]['crossed'] += 1
-            if(self.willTurn==1):
-                if(self.crossed==0 or self.x>mid[self.direction]['x']):
-                    if((self.x>=self.stop or (currentGreen==2 and currentYellow==0) or self.crossed==1) and (self.index==0 or self.x>(vehicles[self.direction][self.lane][self.index-1].x + vehicles[self.direction][self.lane][self.index-1].currentImage.get_rect().width + gap2) or vehicles[self.direction][self.lane][self.index-1].turned==1)):                
-                        self.x -= self.speed
-                else: 
-                    if(self.turned==0):
-                        self.rotateAngle += rotationAngle
-                        self.currentImage = pygame.transform.rotate(self.originalImage, -self.rotateAngle)
-                        self.x -= 1.8
-                        self.y -= 2.5
-                        if(self.rotateAngle==90):
-                            self.turned = 1
-                            # path = "images/" + directionNumbers[((self.direction_number+1)%noOfSignals)] + "/" + self.vehicleClass + ".png"
-                            # self.x = mid[self.direction]['x']
-                            # self.y = mid[self.direction]['y']
-                            # self.currentImage = pygame.image.load(path)
-                    else:
-                        if(self.index==0 or self.y>(vehicles[self.direction][self.lane][self.index-1].y + vehicles[self.direction][self.lane][self.index-1].currentImage.get_rect().height +  gap2) or self.x>(vehicles[self.direction][self.lane][self.index-1].x + gap2)):
-                            self.y -= self.speed
-            else: 
-                if((self.x>=self.stop or self.crossed == 1 or (currentGreen==2 and currentYellow==0)) and (self.index==0 or self.x>(vehicles[self.direction][self.lane][self.index-1].x + vehicles[self.direction][self.lane][self.index-1].currentImage.get_rect().width + gap2) or (vehicles[self.direction][self.lane][self.index-1].turned==1))):                
-                # (if the image has not reached its stop coordinate or has crossed stop line or has green signal) and (it is either the first vehicle in that lane or it is has enough gap to the next vehicle in that lane)
-                    self.x -= self.speed  # move the vehicle    
-            # if((self.x>=self.stop or self.crossed == 1 or (currentGreen==2 and currentYellow==0)) and (self.index==0 or self.x>(vehicles[self.direction][self.lane][self.index-1].x + vehicles[self.direction][self.lane][self.index-1].currentImage.get_rect().width + gap2))):                
-            #     self.x -= self.speed
-        elif(self.direction=='up'):
-            if(self.crossed==0 and self.y<stopLines[self.direction]):
-                self.crossed = 1
-                vehicles[self.direction]['crossed'] += 1
-            if(self.willTurn==1):
-                if(self.crossed==0 or self.y>mid[self.direction]['y']):
-                    if((self.y>=self.stop or (currentGreen==3 and currentYellow==0) or self.crossed == 1) and (self.index==0 or self.y>(vehicles[self.direction][self.lane][self.index-1].y + vehicles[self.direction][self.lane][self.index-1].currentImage.get_rect().height +  gap2) or vehicles[self.direction][self.lane][self.index-1].turned==1)):
-                        self.y -= self.speed
-                else:   
-                    if(self.turned==0):
-                        self.rotateAngle += rotationAngle
-                        self.currentImage = pygame.transform.rotate(self.originalImage, -self.rotateAngle)
-                        self.x += 1
-                        self.y -= 1
-                        if(self.rotateAngle==90):
-                            self.turned = 1
-                    else:
-                        if(self.index==0 or self.x<(vehicles[self.direction][self.lane][self.index-1].x - vehicles[self.direction][self.lane][self.index-1].currentImage.get_rect().width - gap2) or self.y>(vehicles[self.direction][self.lane][self.index-1].y + gap2)):
-                            self.x += self.speed
-            else: 
-                if((self.y>=self.stop or self.crossed == 1 or (currentGreen==3 and currentYellow==0)) and (self.index==0 or self.y>(vehicles[self.direction][self.lane][self.index-1].y + vehicles[self.direction][self.lane][self.index-1].currentImage.get_rect().height + gap2) or (vehicles[self.direction][self.lane][self.index-1].turned==1))):                
-                    self.y -= self.speed
-
-# Initialization of signals with default values
-def initialize():
-    ts1 = TrafficSignal(0, defaultYellow, defaultGreen, defaultMinimum, defaultMaximum)
-    signals.append(ts1)
-    ts2 = TrafficSignal(ts1.red+ts1.yellow+ts1.green, defaultYellow, defaultGreen, defaultMinimum, defaultMaximum)
-    signals.append(ts2)
-    ts3 = TrafficSignal(defaultRed, defaultYellow, defaultGreen, defaultMinimum, defaultMaximum)
-    signals.append(ts3)
-    ts4 = TrafficSignal(defaultRed, defaultYellow, defaultGreen, defaultMinimum, defaultMaximum)
-    signals.append(ts4)
-    repeat()
-
-# Set time according to formula
-def setTime():
-    global noOfCars, noOfBikes, noOfBuses, noOfTrucks, noOfRickshaws, noOfLanes
-    global carTime, busTime, truckTime, rickshawTime, bikeTime
-    os.system("say detecting vehicles, "+directionNumbers[(currentGreen+1)%noOfSignals])
-#    detection_result=detection(currentGreen,tfnet)
-#    greenTime = math.ceil(((noOfCars*carTime) + (noOfRickshaws*rickshawTime) + (noOfBuses*busTime) + (noOfBikes*bikeTime))/(noOfLanes+1))
-#    if(greenTime<defaultMinimum):
-#       greenTime = defaultMinimum
-#    elif(greenTime>defaultMaximum):
-#       greenTime = defaultMaximum
-    # greenTime = len(vehicles[currentGreen][0])+len(vehicles[currentGreen][1])+len(vehicles[currentGreen][2])
-    # noOfVehicles = len(vehicles[directionNumbers[nextGreen]][1])+len(vehicles[directionNumbers[nextGreen]][2])-vehicles[directionNumbers[nextGreen]]['crossed']
-    # print("no. of vehicles = ",noOfVehicles)
-    noOfCars, noOfBuses, noOfTrucks, noOfRickshaws, noOfBikes = 0,0,0,0,0
-    for j in range(len(vehicles[directionNumbers[nextGreen]][0])):
-        vehicle = vehicles[directionNumbers[nextGreen]][0][j]
-        if(vehicle.crossed==0):
-            vclass = vehicle.vehicleClass
-            # print(vclass)
-            noOfBikes += 1
-    for i in range(1,3):
-        for j in range(len(vehicles[directionNumbers[nextGreen]][i])):
-            vehicle = vehicles[directionNumbers[nextGreen]][i][j]
-            if(vehicle.crossed==0):
-                vclass = vehicle.vehicleClass
-                # print(vclass)
-                if(vclass=='car'):
-                    noOfCars += 1
-                elif(vclass=='bus'):
-                    noOfBuses += 1
-                elif(vclass=='truck'):
-                    noOfTrucks += 1
-                elif(vclass=='rickshaw'):
-                    noOfRickshaws += 1
-    # print(noOfCars)
-    greenTime = math.ceil(((noOfCars*carTime) + (noOfRickshaws*rickshawTime) + (noOfBuses*busTime) + (noOfTrucks*truckTime)+ (noOfBikes*bikeTime))/(noOfLanes+1))
-    # greenTime = math.ceil((noOfVehicles)/noOfLanes) 
-    print('Green Time: ',greenTime)
-    if(greenTime<defaultMinimum):
-        greenTime = defaultMinimum
-    elif(greenTime>defaultMaximum):
-        greenTime = defaultMaximum
-    # greenTime = random.randint(15,50)
-    signals[(currentGreen+1)%(noOfSignals)].green = greenTime
-   
-def repeat():
-    global currentGreen, currentYellow, nextGreen
-    while(signals[currentGreen].green>0):   # while the timer of current green signal is not zero
-        printStatus()
-        updateValues()
-        if(signals[(currentGreen+1)%(noOfSignals)].red==detectionTime):    # set time of next green signal 
-            thread = threading.Thread(name="detection",target=setTime, args=())
-            thread.daemon = True
-            thread.start()
-            # setTime()
-        time.sleep(1)
-    currentYellow = 1   # set yellow signal on
-    vehicleCountTexts[currentGreen] = "0"
-    # reset stop coordinates of lanes and vehicles 
-    for i in range(0,3):
-        stops[directionNumbers[currentGreen]][i] = defaultStop[directionNumbers[currentGreen]]
-        for vehicle in vehicles[directionNumbers[currentGreen]][i]:
-            vehicle.stop = defaultStop[directionNumbers[currentGreen]]
-    while(signals[currentGreen].yellow>0):  # while the timer of current yellow signal is not zero
-        printStatus()
-        updateValues()
-        time.sleep(1)
-    currentYellow = 0   # set yellow signal off
-    
-    # reset all signal times of current signal to default times
-    signals[currentGreen].green = defaultGreen
-    signals[currentGreen].yellow = defaultYellow
-    signals[currentGreen].red = defaultRed
-       
-    currentGreen = nextGreen # set next signal as green signal
-    nextGreen = (currentGreen+1)%noOfSignals    # set next green signal
-    signals[nextGreen].red = signals[currentGreen].yellow+signals[currentGreen].green    # set the red time of next to next signal as (yellow time + green time) of next signal
-    repeat()     
-
-# Print the signal timers on cmd
-def printStatus():                                                                                           
-	for i in range(0, noOfSignals):
-		if(i==currentGreen):
-			if(currentYellow==0):
-				print(" GREEN TS",i+1,"-> r:",signals[i].red," y:",signals[i].yellow," g:",signals[i].green)
-			else:
-				print("YELLOW TS",i+1,"-> r:",signals[i].red," y:",signals[i].yellow," g:",signals[i].green)
-		else:
-			print("   RED TS",i+1,"-> r:",signals[i].red," y:",signals[i].yellow," g:",signals[i].green)
-	print()
-
-# Update values of the signal timers after every second
-def updateValues():
-    for i in range(0, noOfSignals):
-        if(i==currentGreen):
-            if(currentYellow==0):
-                signals[i].green-=1
-                signals[i].totalGreenTime+=1
+                self.signals[i].red-=1
+
+    # Print the signal timers on cmd
+    def printStatus(self):
+        for i in range(0, noOfSignals):
+            signal = self.signals[i]
+            if(i==self.currentGreen):
+                if(self.currentYellow==0):
+                    print(" GREEN TS",i+1,"-> r:",signal.red," y:",signal.yellow," g:",signal.green)
+                else:
+                    print("YELLOW TS",i+1,"-> r:",signal.red," y:",signal.yellow," g:",signal.green)
             else:
-                signals[i].yellow-=1
-        else:
-            signals[i].red-=1
+                print("   RED TS",i+1,"-> r:",signal.red," y:",signal.yellow," g:",signal.green)
+        print()
+
+    # Generating vehicles in the simulation
+    def generateVehicle(self):
+        rng = self.rng
+        vehicle_type = rng.randint(0,4)
+        lane_number, will_turn = self.chooseLane(vehicle_type)
+        temp = rng.randint(0,999)
+        direction_number = 0
+        a = self.directionSplit
+        if(temp<a[0]):
+            direction_number = 0
+        elif(temp<a[1]):
+            direction_number = 1
+        elif(temp<a[2]):
+            direction_number = 2
+        elif(temp<a[3]):
+            direction_number = 3
+        self.addVehicle(lane_number, vehicle_type, direction_number, will_turn)
 
-# Generating vehicles in the simulation
-def generateVehicles():
-    while(True):
-        vehicle_type = random.randint(0,4)
+    # Bikes keep to lane 0, other vehicles pick lane 1 or 2; some in lane 2 turn
+    def chooseLane(self, vehicle_type):
+        rng = self.rng
         if(vehicle_type==4):
             lane_number = 0
         else:
-            lane_number = random.randint(0,1) + 1
+            lane_number = rng.randint(0,1) + 1
         will_turn = 0
         if(lane_number==2):
-            temp = random.randint(0,4)
+            temp = rng.randint(0,4)
             if(temp<=2):
                 will_turn = 1
             elif(temp>2):
                 will_turn = 0
-        temp = random.randint(0,999)
-        direction_number = 0
-        a = [400,800,900,1000]
-        if(temp<a[0]):
-            direction_number = 0
-        elif(temp<a[1]):
-            direction_number = 1
-        elif(temp<a[2]):
-            direction_number = 2
-        elif(temp<a[3]):
-            direction_number = 3
-        Vehicle(lane_number, vehicleTypes[vehicle_type], direction_number, directionNumbers[direction_number], will_turn)
-        time.sleep(0.75)
-
-def simulationTime():
-    global timeElapsed, simTime
-    while(True):
-        timeElapsed += 1
-        time.sleep(1)
-        if(timeElapsed==simTime):
-            totalVehicles = 0
-            print('Lane-wise Vehicle Counts')
-            for i in range(noOfSignals):
-                print('Lane',i+1,':',vehicles[directionNumbers[i]]['crossed'])
-                totalVehicles += vehicles[directionNumbers[i]]['crossed']
-            print('Total vehicles passed: ',totalVehicles)
-            print('Total time passed: ',timeElapsed)
-            print('No. of vehicles passed per unit time: ',(float(totalVehicles)/float(timeElapsed)))
-            os._exit(1)
-    
-
-class Main:
-    thread4 = threading.Thread(name="simulationTime",target=simulationTime, args=()) 
-    thread4.daemon = True
-    thread4.start()
-
-    thread2 = threading.Thread(name="initialization",target=initialize, args=())    # initialization
-    thread2.daemon = True
-    thread2.start()
+        return lane_number, will_turn
+
+    # Place a new vehicle behind the last one in its lane
+    def addVehicle(self, lane, vehicle_type, direction_number, will_turn):
+        direction = directionNumbers[direction_number]
+        vehicles = self.vehicles
+        sign, onX = moveSign[direction_number], alongX[direction_number]
+        leader = vehicles.lastInLane[direction_number, lane]
+        if(leader>=0 and not vehicles.crossed[leader]):    # if the vehicle before it in the lane has not crossed the stop line
+            # setting stop coordinate as: stop coordinate of next vehicle -/+ length of next vehicle -/+ gap
+            leaderLength = vehicles.w[leader] if onX else vehicles.h[leader]
+            stop = vehicles.stop[leader] - sign*(leaderLength + gap)
+        else:
+            stop = defaultStop[direction]
+        w, h = vehicleSizes[direction_number, vehicle_type, 0]
+        # Start at the lane entry, or queued behind the previous vehicle if it is still there
+        startX, startY = x[direction][lane], y[direction][lane]
+        if(leader>=0):
+            if(onX):
+                behind = vehicles.x[leader] - sign*(w + gap) if sign>0 else vehicles.x[leader] + vehicles.w[leader] + gap
+                startX = min(startX, behind) if sign>0 else max(startX, behind)
+            else:
+                behind = vehicles.y[leader] - sign*(h + gap) if sign>0 else vehicles.y[leader] + vehicles.h[leader] + gap
+                startY = min(startY, behind) if sign>0 else max(startY, behind)
+        vehicles.add(direction_number, lane, vehicle_type, will_turn, startX, startY, stop, self.tick)
+        self.waiting[direction_number, lane, vehicle_type] += 1
+        self.arrivals[direction_number] += 1
+
+    # Advance the simulation by one tick
+    def step(self):
+        if(self.tick%self.ticksPerSecond==0):
+            if(self.tick>0):
+                self.timeElapsed += 1
+            self.vehicles.despawn()
+            self.signalTick()
+            self.maxQueue = max(self.maxQueue, int(self.waiting.sum(axis=(1, 2)).max()))
+        now = self.tick/self.ticksPerSecond
+        if(self.arrivalSource is None):
+            while(self.nextVehicle<=now):
+                self.generateVehicle()
+                self.nextVehicle += self.vehicleInterval
+        else:
+            for direction_number, vehicle_type in self.arrivalSource.arrivalsUntil(now):
+                lane_number, will_turn = self.chooseLane(vehicle_type)
+                self.addVehicle(lane_number, vehicle_type, direction_number, will_turn)
+        vehicles = self.vehicles
+        crossedNow = vehicles.move(self.currentGreen, self.currentYellow)
+        if(len(crossedNow)):
+            d = vehicles.direction_number[crossedNow]
+            np.subtract.at(self.waiting, (d, vehicles.lane[crossedNow], vehicles.vehicleType[crossedNow]), 1)
+            self.waitTicks += int((self.tick - vehicles.spawnTick[crossedNow]).sum())
+            for direction, count in enumerate(np.bincount(d, minlength=noOfSignals)):
+                if(count):
+                    self.crossedCounts[direction] += int(count)
+                    self.lastCrossing[direction] = self.tick
+        self.tick += 1
+        for observer in self.observers:
+            observer.update(self)
+
+    # Run for duration simulated seconds (simTime by default) and return the summary
+    def run(self, duration=None):
+        duration = self.simTime if duration is None else duration
+        while(self.tick<duration*self.ticksPerSecond):
+            self.step()
+        self.timeElapsed = self.tick//self.ticksPerSecond
+        return self.summary()
+
+    # Seconds from spawn to crossing, or to now for vehicles that have not crossed yet
+    def meanDelay(self):
+        vehicles = self.vehicles
+        queued = ~vehicles.crossed
+        generated = sum(self.arrivals)
+        if(generated==0):
+            return 0.0
+        delayTicks = self.waitTicks + int((self.tick - vehicles.spawnTick[queued]).sum())
+        return delayTicks/self.ticksPerSecond/generated
+
+    # Lane-wise throughput and delay of the run so far
+    def summary(self):
+        laneCounts = list(self.crossedCounts)
+        totalVehicles = sum(laneCounts)
+        return {
+            'seed': self.seed,
+            'controller': self.signalController.name,
+            'laneCounts': laneCounts,
+            'totalVehicles': totalVehicles,
+            'timeElapsed': self.timeElapsed,
+            'throughput': float(totalVehicles)/float(self.timeElapsed) if self.timeElapsed else 0.0,
+            'totalGreenTime': [self.signals[i].totalGreenTime for i in range(noOfSignals)],
+            # seconds from spawn to crossing the stop line, over the vehicles that crossed
+            'meanWait': self.waitTicks/self.ticksPerSecond/totalVehicles if totalVehicles else 0.0,
+            # the same over every vehicle generated, counting those still queued up to now, so
+            # a controller cannot look better by serving fewer vehicles
+            'meanDelay': self.meanDelay(),
+            'maxQueue': self.maxQueue,
+        }
+
+# Run the simulation without a window, advancing simulated time in fixed ticks
+def runHeadless(duration=None, seed=None, **params):
+    return Simulation(seed=seed, **params).run(duration)
+
+# pygame, imported on first use: only the window needs it, so headless runs never import it
+def loadPygame():
+    import pygame
+    return pygame
+
+# Every vehicle image at every turn step, loaded and rotated once; needs an open window for convert_alpha()
+def buildSpriteAtlas(pygame):
+    atlas = np.empty((noOfSignals, len(vehicleTypes), turnSteps), object)
+    for d, direction in directionNumbers.items():
+        for t, vehicleClass in vehicleTypes.items():
+            image = pygame.image.load("images/" + direction + "/" + vehicleClass + ".png").convert_alpha()
+            for k in range(turnSteps):
+                atlas[d, t, k] = pygame.transform.rotate(image, -k*rotationAngle) if k else image
+                if(atlas[d, t, k].get_size()!=tuple(vehicleSizes[d, t, k].astype(int))):
+                    raise RuntimeError("Rotated size of "+direction+"/"+vehicleClass+" differs from vehicleSizes")
+    return atlas
+
+class Renderer:
+    """Draws a Simulation in a pygame window; attach with sim.observers.append(Renderer()).
+
+    Vehicles are drawn from a pre-rotated sprite atlas in one batched blit, so a frame
+    does no image loading or transforms.
+    """
 
     # Colours 
     black = (0, 0, 0)
     white = (255, 255, 255)
 
-    # Screensize 
-    screenWidth = 1400
-    screenHeight = 800
-    screenSize = (screenWidth, screenHeight)
-
-    # Setting background image i.e. image of intersection
-    background = pygame.image.load('images/mod_int.png')
-
-    screen = pygame.display.set_mode(screenSize)
-    pygame.display.set_caption("SIMULATION")
-
-    # Loading signal images and font
-    redSignal = pygame.image.load('images/signals/red.png')
-    yellowSignal = pygame.image.load('images/signals/yellow.png')
-    greenSignal = pygame.image.load('images/signals/green.png')
-    font = pygame.font.Font(None, 30)
-
-    thread3 = threading.Thread(name="generateVehicles",target=generateVehicles, args=())    # Generating vehicles
-    thread3.daemon = True
-    thread3.start()
-
-    while True:
+    def __init__(self, speed=1.0):
+        self.pygame = pygame = loadPygame()
+        pygame.init()
+        self.speed = speed  # simulated seconds per real second
+        self.screen = pygame.display.set_mode((screenWidth, screenHeight))
+        pygame.display.set_caption("SIMULATION")
+        self.clock = pygame.time.Clock()
+
+        # Setting background image i.e. image of intersection
+        self.background = pygame.image.load('images/mod_int.png').convert()
+
+        # Loading signal images and font
+        self.redSignal = pygame.image.load('images/signals/red.png').convert_alpha()
+        self.yellowSignal = pygame.image.load('images/signals/yellow.png').convert_alpha()
+        self.greenSignal = pygame.image.load('images/signals/green.png').convert_alpha()
+        self.font = pygame.font.Font(None, 30)
+        self.textCache = {}
+        self.atlas = buildSpriteAtlas(pygame)
+
+    # Rendered text surfaces are reused while the text stays the same
+    def text(self, value, foreground, background):
+        key = (value, foreground, background)
+        if(key not in self.textCache):
+            if(len(self.textCache)>1024):
+                self.textCache.clear()
+            self.textCache[key] = self.font.render(value, True, foreground, background)
+        return self.textCache[key]
+
+    def update(self, sim):
+        pygame = self.pygame
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 sys.exit()
 
-        screen.blit(background,(0,0))   # display background in simulation
+        screen, signals = self.screen, sim.signals
+        screen.blit(self.background,(0,0))   # display background in simulation
         for i in range(0,noOfSignals):  # display signal and set timer according to current status: green, yello, or red
-            if(i==currentGreen):
-                if(currentYellow==1):
+            if(i==sim.currentGreen):
+                if(sim.currentYellow==1):
                     if(signals[i].yellow==0):
                         signals[i].signalText = "STOP"
                     else:
                         signals[i].signalText = signals[i].yellow
-                    screen.blit(yellowSignal, signalCoods[i])
+                    screen.blit(self.yellowSignal, signalCoods[i])
                 else:
                     if(signals[i].green==0):
                         signals[i].signalText = "SLOW"
                     else:
                         signals[i].signalText = signals[i].green
-                    screen.blit(greenSignal, signalCoods[i])
+                    screen.blit(self.greenSignal, signalCoods[i])
             else:
                 if(signals[i].red<=10):
                     if(signals[i].red==0):
@@ -488,27 +625,44 @@ class Main:
                         signals[i].signalText = signals[i].red
                 else:
                     signals[i].signalText = "---"
-                screen.blit(redSignal, signalCoods[i])
-        signalTexts = ["","","",""]
+                screen.blit(self.redSignal, signalCoods[i])
 
         # display signal timer and vehicle count
         for i in range(0,noOfSignals):  
-            signalTexts[i] = font.render(str(signals[i].signalText), True, white, black)
-            screen.blit(signalTexts[i],signalTimerCoods[i]) 
-            displayText = vehicles[directionNumbers[i]]['crossed']
-            vehicleCountTexts[i] = font.render(str(displayText), True, black, white)
-            screen.blit(vehicleCountTexts[i],vehicleCountCoods[i])
+            screen.blit(self.text(str(signals[i].signalText), self.white, self.black), signalTimerCoods[i])
+            screen.blit(self.text(str(sim.crossedCounts[i]), self.black, self.white), vehicleCountCoods[i])
 
-        timeElapsedText = font.render(("Time Elapsed: "+str(timeElapsed)), True, black, white)
-        screen.blit(timeElapsedText,(1100,50))
+        screen.blit(self.text("Time Elapsed: "+str(sim.timeElapsed), self.black, self.white), (1100,50))
 
         # display the vehicles
-        for vehicle in simulation:  
-            screen.blit(vehicle.currentImage, [vehicle.x, vehicle.y])
-            # vehicle.render(screen)
-            vehicle.move()
+        vehicles = sim.vehicles
+        images = self.atlas[vehicles.direction_number, vehicles.vehicleType, vehicles.rotateAngle//rotationAngle]
+        screen.blits(list(zip(images, zip(vehicles.x.tolist(), vehicles.y.tolist()))), False)
         pygame.display.update()
-
-Main()
-
-  
+        self.clock.tick(sim.ticksPerSecond*self.speed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Traffic signal simulation")
+    parser.add_argument("--headless", action="store_true", help="run without a window as fast as possible and print a JSON summary")
+    parser.add_argument("--sim-time", type=int, default=simTime, help="simulated seconds to run")
+    parser.add_argument("--seed", type=int, default=None, help="random seed; identical seeds give identical runs")
+    parser.add_argument("--speed", type=float, default=1.0, help="simulated seconds per real second in the window")
+    parser.add_argument("--controller", default=controller, choices=list(CONTROLLERS), help="signal controller")
+    parser.add_argument("--arrivals", default=arrivalMode, help="uniform, poisson, or comma-separated trace files (.csv/.parquet)")
+    parser.add_argument("--camera", default=None, help="only replay trace rows of this camera_id")
+    args = parser.parse_args()
+    arrivalSpec = args.arrivals
+    if(arrivalSpec not in ("uniform", "poisson")):
+        arrivalSpec = {"type": "trace", "paths": arrivalSpec.split(','), "camera": args.camera}
+    if(args.headless):
+        print(json.dumps(runHeadless(args.sim_time, seed=args.seed, controller=args.controller, arrivalMode=arrivalSpec)))
+    else:
+        sim = Simulation(seed=args.seed, verbose=True, controller=args.controller, arrivalMode=arrivalSpec)
+        sim.observers.append(Renderer(args.speed))
+        result = sim.run(args.sim_time)
+        print('Lane-wise Vehicle Counts')
+        for i in range(noOfSignals):
+            print('Lane',i+1,':',result['laneCounts'][i])
+        print('Total vehicles passed: ',result['totalVehicles'])
+        print('Total time passed: ',result['timeElapsed'])
+        print('No. of vehicles passed per unit time: ',result['throughput'])
@@ -1,83 +1,190 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, File, UploadFile, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 import cv2
-import numpy as np
-import easyocr
 import shutil
 import os
 import uuid
+import asyncio
+import base64
+import json
+import re
+import threading
+import contextvars
+from typing import Optional
+import time
+import profiling
+import video_encoder
+from config import UPLOAD_FOLDER, HLS_FOLDER, OUTPUT_TTL
+from counts_store import CountsStore, COUNTS_DB
+from counting import VehicleCounter, load_zones
+from evidence import EvidenceStore, HELMET_VIOLATION, PLATE, union_box
+from helmet_detection import check_riders
+from image_decode import FrameImage
+from models import registry
+from plate_detection import recognize_number_plate
 
-app = FastAPI()
-
-# Enable CORS for frontend
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Load YOLO for helmet & plate detection
-net = cv2.dnn.readNet("yolov3-spp.weights", "yolov3-spp.cfg")
-layer_names = net.getLayerNames()
-output_layers = [layer_names[i - 1] for i in net.getUnconnectedOutLayers()]
-with open("coco.names", "r") as f:
-    classes = [line.strip() for line in f.readlines()]
-reader = easyocr.Reader(['en'], gpu=False)
-
-# Utility: detect objects
-def detect_objects(img):
-    h, w, _ = img.shape
-    blob = cv2.dnn.blobFromImage(img, 0.00392, (416, 416), (0, 0, 0), True, crop=False)
-    net.setInput(blob)
-    outs = net.forward(output_layers)
-    boxes, confidences, class_ids = [], [], []
-    for out in outs:
-        for det in out:
-            scores = det[5:]
-            cid = int(np.argmax(scores))
-            conf = float(scores[cid])
-            if conf > 0.5:
-                cx, cy, ww, hh = det[0]*w, det[1]*h, det[2]*w, det[3]*h
-                x, y = int(cx - ww/2), int(cy - hh/2)
-                boxes.append([x, y, int(ww), int(hh), int(cx), int(cy)])
-                confidences.append(conf)
-                class_ids.append(cid)
-    return boxes, confidences, class_ids
-
-# Utility: recognize number plates
-def recognize_number_plate(img):
-    res = reader.readtext(img)
-    return [text for _, text, prob in res if len(text)>4 and prob>0.5]
-
-@app.post("/detect-helmet-plate")
-async def detect_helmet_plate(file: UploadFile = File(...)):
-    # save temp image
-    tmp_in = f"tmp_{uuid.uuid4().hex}.jpg"
-    with open(tmp_in, "wb") as buf:
-        shutil.copyfileobj(file.file, buf)
-    img = cv2.imread(tmp_in)
-    if img is None:
-        os.remove(tmp_in)
-        raise HTTPException(400, "Invalid image file")
-
-    # detect objects
-    boxes, confs, cids = detect_objects(img)
-    person = any(classes[c]=='person' for c in cids)
-    moto = any(classes[c]=='motorcycle' for c in cids)
-    helmet_ok = not (person and moto)
-    plates = recognize_number_plate(img)
-    dets = [ {"class": classes[cids[i]], "box": boxes[i][:4], "confidence": confs[i]} for i in range(len(boxes)) ]
-
-    os.remove(tmp_in)
-    return {"helmet_on_motorcycle": helmet_ok, "plates": plates, "detections": dets}
-
-@app.post("/count-vehicles")
-async def count_vehicles(file: UploadFile = File(...)):
-    # save temp video
-    tmp_vid = f"tmp_{uuid.uuid4().hex}.mp4"
+router = APIRouter()
+
+# --- Persistent Counts ---
+counts_db = CountsStore(COUNTS_DB)
+
+# --- Violation Evidence ---
+evidence_store = EvidenceStore()
+PLATE_MIN_WIDTH = 80    # pixels a vehicle box needs before OCR is tried on it
+
+def collect_evidence(recorder, frame, frame_idx, tracks, boxes, confs, cids, classes):
+    """Record helmet violations and plate reads for tracks that do not have theirs yet.
+
+    Only tracks the recorder still wants are inspected, so the helmet model and OCR
+    run a few times per vehicle rather than on every frame.
+    """
+    image = FrameImage(frame)
+    bikes = {tuple(box): vid for vid, box, vtype in tracks if vtype == 'motorbike'}
+    if any(recorder.wants(vid, HELMET_VIOLATION) for vid in bikes.values()):
+        for rider in check_riders(image, boxes, confs, cids, classes):
+            vid = bikes.get(tuple(rider["motorbike"]))
+            if vid is None or not recorder.wants(vid, HELMET_VIOLATION):
+                continue
+            recorder.tried(vid, HELMET_VIOLATION)
+            if not rider["helmet"]:
+                recorder.add(HELMET_VIOLATION, vid, frame_idx, image.crop(*union_box(rider["box"], rider["motorbike"])),
+                             box=rider["box"], motorbike=rider["motorbike"], confidence=rider["confidence"])
+
+    for vid, box, vtype in tracks:
+        if box[2] < PLATE_MIN_WIDTH or not recorder.wants(vid, PLATE):
+            continue
+        recorder.tried(vid, PLATE)
+        crop = image.crop(*box)
+        plates = recognize_number_plate(crop) if crop.size else []
+        if plates:
+            recorder.add(PLATE, vid, frame_idx, crop, plate=" ".join(plates), box=[int(v) for v in box], vehicle=vtype)
+
+# --- Vehicle Counting Endpoint ---
+def process_video(cap, counter, writer=None, annotate_every=0, recorder=None):
+    """Run detection and counting over every frame of cap.
+
+    Frames are only drawn on when they are written to writer or sampled by
+    annotate_every; returns the sampled frames as base64 JPEGs. With a recorder,
+    helmet violations and plates are collected as evidence before any drawing.
+    """
+    model = registry.get("yolov3-spp")
+    snapshots = []
+    while True:
+        with profiling.span("decode"):
+            ret, frame = cap.read()
+        if not ret: break
+        frame_idx = counter.frames
+        boxes, confs, cids = model.detect(frame)
+        tracks = counter.update(boxes, confs, cids)
+        if recorder is not None:
+            collect_evidence(recorder, frame, frame_idx, tracks, boxes, confs, cids, model.classes)
+
+        if writer is not None:
+            counter.draw(frame, tracks)
+            with profiling.span("encode"):
+                writer.write(frame)
+        elif annotate_every > 0 and frame_idx % annotate_every == 0:
+            counter.draw(frame, tracks)
+            with profiling.span("encode"):
+                _, buffer = cv2.imencode('.jpg', frame)
+            snapshots.append({"frame": frame_idx, "image": base64.b64encode(buffer).decode()})
+    return snapshots
+
+# video_id -> error of HLS encodes that failed, so their playlist requests say why
+failed_videos = {}
+
+def process_video_in_background(cap, counter, writer, tmp_vid, camera_id, start_time, recorder=None, video_id=None):
+    """Encode on a worker thread so the output can be served while it is produced."""
+    def fail(e):
+        print(f"Video encode {video_id or tmp_vid} failed: {e!r}")
+        if video_id is not None:
+            failed_videos[video_id] = str(e) or type(e).__name__
+
+    def run():
+        try:
+            process_video(cap, counter, writer, recorder=recorder)
+            counts_db.add(camera_id, counter.events, start_time)
+        except BrokenPipeError:
+            pass  # client stopped reading the stream, or ffmpeg died (release() reports that)
+        except Exception as e:
+            fail(e)
+        finally:
+            try:
+                writer.release()
+            except Exception as e:
+                fail(e)
+            finally:
+                try:
+                    cap.release()
+                finally:
+                    os.remove(tmp_vid)
+    ctx = contextvars.copy_context()
+    threading.Thread(target=ctx.run, args=(run,), daemon=True).start()
+
+# --- Output Cleanup ---
+# Annotated files are deleted once served; HLS directories stay playable for OUTPUT_TTL
+# seconds after their last segment was written. Anything older is swept on the next
+# count request, at most every CLEANUP_INTERVAL seconds.
+CLEANUP_INTERVAL = 60
+last_cleanup = 0.0
+
+def remove_expired_outputs():
+    global last_cleanup
+    now = time.time()
+    if now - last_cleanup < CLEANUP_INTERVAL:
+        return
+    last_cleanup = now
+    for video_id in os.listdir(HLS_FOLDER):
+        out_dir = os.path.join(HLS_FOLDER, video_id)
+        try:
+            modified = max([os.path.getmtime(out_dir)] +
+                           [os.path.getmtime(os.path.join(out_dir, name)) for name in os.listdir(out_dir)])
+        except OSError:
+            continue
+        if now - modified > OUTPUT_TTL:
+            shutil.rmtree(out_dir, ignore_errors=True)
+            failed_videos.pop(video_id, None)
+    for name in os.listdir(UPLOAD_FOLDER):
+        path = os.path.join(UPLOAD_FOLDER, name)
+        try:
+            # annotated files whose response never finished
+            if name.startswith("out_") and now - os.path.getmtime(path) > OUTPUT_TTL:
+                os.remove(path)
+        except OSError:
+            pass
+
+@router.post("/count-vehicles")
+async def count_vehicles(file: UploadFile = File(...), analytics_only: bool = False, annotate_every: int = 0,
+                         output: str = "file", preset: str = video_encoder.DEFAULT_PRESET,
+                         crf: int = video_encoder.DEFAULT_CRF, scale: float = 1.0,
+                         camera_id: str = "default", start_time: Optional[float] = None, evidence: bool = False):
+    """Count vehicles crossing the camera's counting zones in an uploaded video.
+
+    By default returns the annotated video (totals in the X-Vehicle-Counts header),
+    encoded as H.264 through ffmpeg when it is installed. output=stream streams
+    fragmented MP4 while it is being produced; output=hls starts encoding HLS segments
+    and returns the playlist URL straight away (playable for OUTPUT_TTL seconds).
+    With analytics_only=true nothing is drawn or re-encoded and the response is the
+    JSON time series of crossings; annotate_every=N additionally returns every Nth
+    frame annotated as a base64 JPEG.
+    Crossings are stored under camera_id, timestamped from start_time (epoch seconds
+    of the first frame, defaults to upload time).
+    With evidence=true helmet violations and plate reads are recorded once per track,
+    each with a snapshot, and can be listed on /evidence.
+    """
+    start_time = time.time() if start_time is None else start_time
+    remove_expired_outputs()
+    if output not in ("file", "stream", "hls"):
+        raise HTTPException(400, "output must be one of: file, stream, hls")
+    if output != "file" and not analytics_only and not video_encoder.ffmpeg_available():
+        raise HTTPException(503, "ffmpeg is required for streamed output")
+    try:
+        video_encoder.check_options(preset, crf, scale)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    tmp_vid = os.path.join(UPLOAD_FOLDER, f"temp_{uuid.uuid4().hex}.mp4")
     with open(tmp_vid, "wb") as buf:
         shutil.copyfileobj(file.file, buf)
 
@@ -86,66 +193,157 @@ async def count_vehicles(file: UploadFile = File(...)):
         os.remove(tmp_vid)
         raise HTTPException(400, "Invalid video file")
 
-    # output video writer setup
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
     fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
     w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    out_path = f"out_{uuid.uuid4().hex}.mp4"
-    writer = cv2.VideoWriter(out_path, fourcc, fps, (w, h))
+    counter = VehicleCounter(w, h, fps, registry.get("yolov3-spp").classes, load_zones(camera_id, w, h))
+    recorder = evidence_store.recorder(camera_id, start_time, counter.fps) if evidence else None
+    encoder_options = {"preset": preset, "crf": crf, "scale": scale}
 
-    # counting line
-    line_y = h - 150
-    counts = {"car":0, "bus":0}
-    tracker = {}
-    next_id = 0
-    MIN_DIST = 30
+    if analytics_only:
+        snapshots = process_video(cap, counter, annotate_every=annotate_every, recorder=recorder)
+        cap.release(); os.remove(tmp_vid)
+        counts_db.add(camera_id, counter.events, start_time)
+        result = counter.summary()
+        if annotate_every > 0:
+            result["annotated_frames"] = snapshots
+        if recorder is not None:
+            result["evidence"] = recorder.events
+        return JSONResponse(result)
 
-    while True:
-        ret, frame = cap.read()
-        if not ret: break
-        boxes, confs, cids = detect_objects(frame)
-        idxs = cv2.dnn.NMSBoxes([b[:4] for b in boxes], confs, 0.5, 0.4)
-        current = {}
-
-        for i in idxs.flatten():
-            x,y,w_,h_,cx,cy = boxes[i]
-            vid = None
-            # match or new id
-            for tid,data in tracker.items():
-                dist = np.hypot(cx-data['cx'], cy-data['cy'])
-                if dist<MIN_DIST:
-                    vid = tid; break
-            if vid is None:
-                vid = next_id; next_id+=1
-                tracker[vid] = {'cx':cx,'cy':cy,'counted':False,'type': classes[cids[i]]}
-            else:
-                tracker[vid].update({'cx':cx,'cy':cy})
+    if output == "stream":
+        writer = video_encoder.FFmpegWriter("pipe:1", w, h, fps, **encoder_options)
+        process_video_in_background(cap, counter, writer, tmp_vid, camera_id, start_time, recorder)
+        return StreamingResponse(writer.iter_output(), media_type="video/mp4")
+
+    if output == "hls":
+        video_id = uuid.uuid4().hex
+        out_dir = os.path.join(HLS_FOLDER, video_id)
+        writer = video_encoder.FFmpegWriter(out_dir, w, h, fps, container="hls", **encoder_options)
+        process_video_in_background(cap, counter, writer, tmp_vid, camera_id, start_time, recorder, video_id)
+        return {"video_id": video_id, "playlist": f"/videos/{video_id}/index.m3u8"}
 
-            current[vid]=True
-            vtype = 'car' if cids[i]==2 else 'bus'
-            if cy>line_y and not tracker[vid]['counted']:
-                counts[vtype]+=1; tracker[vid]['counted']=True
+    out_path = os.path.join(UPLOAD_FOLDER, f"out_{uuid.uuid4().hex}.mp4")
+    try:
+        writer = video_encoder.open_writer(out_path, w, h, fps, **encoder_options)
+        try:
+            process_video(cap, counter, writer, recorder=recorder)
+        finally:
+            writer.release()
+    except (OSError, RuntimeError) as e:
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        raise HTTPException(500, f"Encoding failed: {e}")
+    finally:
+        cap.release(); os.remove(tmp_vid)
+    counts_db.add(camera_id, counter.events, start_time)
+    return FileResponse(out_path, media_type="video/mp4", filename="annotated.mp4",
+                        headers={"X-Vehicle-Counts": json.dumps(counter.counts)},
+                        background=BackgroundTask(os.remove, out_path))
 
-            # draw
-            clr = (0,255,0) if vtype=='car' else (0,0,255)
-            cv2.rectangle(frame,(x,y),(x+w_,y+h_),clr,2)
-            cv2.putText(frame,f"{vtype} ID:{vid}",(x,y-10),cv2.FONT_HERSHEY_SIMPLEX,0.5,clr,2)
+# --- HLS Playlists and Segments ---
+@router.get("/videos/{video_id}/{name}")
+async def get_video_segment(video_id: str, name: str):
+    if not re.fullmatch(r"[0-9a-f]{32}", video_id) or not re.fullmatch(r"(index\.m3u8|segment_\d+\.ts)", name):
+        raise HTTPException(404, "Not found")
+    path = os.path.join(HLS_FOLDER, video_id, name)
+    if not os.path.exists(path):
+        if video_id in failed_videos:
+            raise HTTPException(500, f"Encoding failed: {failed_videos[video_id]}")
+        raise HTTPException(404, "Not found")
+    media_type = "application/vnd.apple.mpegurl" if name.endswith(".m3u8") else "video/mp2t"
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+# --- WebSocket for Real-Time Vehicle Counting ---
+@router.websocket("/ws/vehicle-count")
+async def websocket_vehicle_count(websocket: WebSocket, analytics_only: bool = False, camera_id: str = "default",
+                                  evidence: bool = False):
+    await websocket.accept()
+    start_time = time.time()
+    cap = counter = None
+    try:
+        video_bytes = await websocket.receive_bytes()
+        file_path = os.path.join(UPLOAD_FOLDER, f"temp_{uuid.uuid4().hex}.mp4")
+
+        with open(file_path, "wb") as f:
+            f.write(video_bytes)
+
+        cap = cv2.VideoCapture(file_path)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_delay = 1/fps if fps > 0 else 0.04
+        w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        model = registry.get("yolov3-spp")
+        counter = VehicleCounter(w, h, fps, model.classes, load_zones(camera_id, w, h))
+        recorder = evidence_store.recorder(camera_id, start_time, counter.fps) if evidence else None
+
+        while cap.isOpened():
+            with profiling.span("decode"):
+                ret, frame = cap.read()
+            if not ret:
+                break
+
+            frame_idx = counter.frames
+            boxes, confs, cids = model.detect(frame)
+            tracks = counter.update(boxes, confs, cids)
+            if recorder is not None:
+                collect_evidence(recorder, frame, frame_idx, tracks, boxes, confs, cids, model.classes)
+            await websocket.send_json({"counts": counter.counts})
+
+            # Analytics-only clients get the counts without the annotated JPEG stream
+            if not analytics_only:
+                counter.draw(frame, tracks)
+                with profiling.span("encode"):
+                    _, buffer = cv2.imencode('.jpg', frame)
+                    jpeg_bytes = buffer.tobytes()
+                await websocket.send_bytes(jpeg_bytes)
+                await asyncio.sleep(frame_delay)
+            else:
+                await asyncio.sleep(0)
 
-        # cleanup
-        for tid in list(tracker):
-            if tid not in current: del tracker[tid]
-        # draw line and counts
-        cv2.line(frame,(0,line_y),(w,line_y),(255,0,0),2)
-        cv2.putText(frame,f"Cars: {counts['car']}",(10,30),cv2.FONT_HERSHEY_SIMPLEX,1,(0,255,0),2)
-        cv2.putText(frame,f"Buses: {counts['bus']}",(10,70),cv2.FONT_HERSHEY_SIMPLEX,1,(0,0,255),2)
+        if analytics_only:
+            summary = counter.summary()
+            if recorder is not None:
+                summary["evidence"] = recorder.events
+            await websocket.send_json(summary)
+        await websocket.close()
+    except WebSocketDisconnect:
+        print("Client disconnected")
+    finally:
+        if cap is not None:
+            cap.release()
+        # crossings counted before a disconnect are kept too
+        if counter is not None:
+            counts_db.add(camera_id, counter.events, start_time)
+        if 'file_path' in locals():
+            os.remove(file_path)
 
-        writer.write(frame)
+# --- Historical Counts ---
+@router.get("/counts")
+async def list_count_cameras():
+    return {"cameras": counts_db.cameras(), "pipeline": counts_db.stats()}
 
-    cap.release(); writer.release(); os.remove(tmp_vid)
+@router.get("/counts/{camera_id}")
+async def get_counts(camera_id: str, granularity: str = "minute", start: Optional[int] = None,
+                     end: Optional[int] = None, by_direction: bool = False):
+    """Per-minute/hour/day crossing counts for a camera, start/end in epoch seconds."""
+    try:
+        buckets = counts_db.rollup(camera_id, granularity, start, end, by_direction)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return {"camera_id": camera_id, "granularity": granularity, "buckets": buckets}
 
-    # return processed video and counts
-    return FileResponse(out_path, media_type="video/mp4", filename="annotated.mp4")
+# --- Violation Evidence ---
+@router.get("/evidence")
+async def list_evidence(camera_id: Optional[str] = None, kind: Optional[str] = None, start: Optional[float] = None,
+                        end: Optional[float] = None, limit: int = 100):
+    """Recorded helmet violations and plate reads, newest first, plus the state of the write pipeline."""
+    events = evidence_store.query(camera_id, kind, start, end, min(max(limit, 1), 1000))
+    return {"events": events, "pipeline": evidence_store.stats()}
 
-# Run with:
-# uvicorn app:app --reload --host 0.0.0.0 --port 5000
+@router.get("/evidence/{event_id}/image")
+async def get_evidence_image(event_id: str):
+    path = evidence_store.snapshot_path(event_id) if re.fullmatch(r"[0-9a-f]{32}", event_id) else None
+    if path is None or not os.path.exists(path):
+        raise HTTPException(404, "Evidence not found")
+    return FileResponse(path, media_type="image/jpeg")
@@ -0,0 +1,111 @@
+import os
+import shutil
+import subprocess
+import cv2
+
+# --- Configuration ---
+FFMPEG_BIN = os.environ.get("FFMPEG_BIN", "ffmpeg")
+DEFAULT_PRESET = "veryfast"
+DEFAULT_CRF = 26
+HLS_SEGMENT_SECONDS = 2
+STREAM_CHUNK_SIZE = 64 * 1024
+X264_PRESETS = ("ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow",
+                "placebo")
+
+
+def ffmpeg_available():
+    return shutil.which(FFMPEG_BIN) is not None
+
+
+def check_options(preset=DEFAULT_PRESET, crf=DEFAULT_CRF, scale=1.0):
+    """Raise ValueError for options ffmpeg would reject; it would exit before the first frame."""
+    if preset not in X264_PRESETS:
+        raise ValueError(f"preset must be one of: {', '.join(X264_PRESETS)}")
+    if not 0 <= crf <= 51:
+        raise ValueError("crf must be between 0 and 51")
+    if not 0 < scale <= 1:
+        raise ValueError("scale must be in (0, 1]")
+
+
+class FFmpegWriter:
+    """cv2.VideoWriter look-alike that pipes raw BGR frames into an ffmpeg subprocess.
+
+    container="mp4" writes H.264 in fragmented MP4 (playable while still being written);
+    output="pipe:1" sends it to stdout so it can be streamed to the client as it is
+    produced. container="hls" treats output as a directory and writes index.m3u8 plus
+    segments into it. scale < 1 downscales before encoding.
+    """
+
+    def __init__(self, output, width, height, fps, preset=DEFAULT_PRESET, crf=DEFAULT_CRF,
+                 scale=1.0, container="mp4"):
+        check_options(preset, crf, scale)
+        self.output = output
+        self.width = width
+        self.height = height
+        self.frame_bytes = width * height * 3
+        cmd = [
+            FFMPEG_BIN, "-loglevel", "error", "-y",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", str(fps),
+            "-i", "pipe:0",
+        ]
+        if scale != 1.0:
+            # libx264 with yuv420p needs even dimensions
+            cmd += ["-vf", f"scale=trunc(iw*{scale}/2)*2:trunc(ih*{scale}/2)*2"]
+        cmd += ["-c:v", "libx264", "-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p"]
+
+        if container == "hls":
+            os.makedirs(output, exist_ok=True)
+            cmd += [
+                "-f", "hls", "-hls_time", str(HLS_SEGMENT_SECONDS), "-hls_playlist_type", "event",
+                "-hls_segment_filename", os.path.join(output, "segment_%05d.ts"),
+                os.path.join(output, "index.m3u8"),
+            ]
+        elif container == "mp4":
+            cmd += ["-movflags", "frag_keyframe+empty_moov+default_base_moof", "-f", "mp4", output]
+        else:
+            raise ValueError(f"Unsupported container: {container}")
+
+        self.process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE if output == "pipe:1" else subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def isOpened(self):
+        return self.process.poll() is None
+
+    def write(self, frame):
+        if frame.shape[1] != self.width or frame.shape[0] != self.height:
+            frame = cv2.resize(frame, (self.width, self.height))
+        self.process.stdin.write(frame.tobytes())
+
+    def release(self):
+        if self.process.stdin and not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        if self.process.stdout is None:
+            if self.process.wait() != 0:
+                raise RuntimeError(f"ffmpeg exited with status {self.process.returncode}")
+
+    def iter_output(self, chunk_size=STREAM_CHUNK_SIZE):
+        """Yield encoded bytes from stdout until ffmpeg exits (only for output="pipe:1")."""
+        try:
+            while True:
+                chunk = self.process.stdout.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self.process.stdout.close()
+            self.process.wait()
+
+
+def open_writer(path, width, height, fps, **options):
+    """H.264 via ffmpeg when available, otherwise fall back to OpenCV's mp4v writer."""
+    if ffmpeg_available():
+        return FFmpegWriter(path, width, height, fps, **options)
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    return cv2.VideoWriter(path, fourcc, fps, (width, height))